@@ -1,19 +1,30 @@
 import logging, logging.config
 import os
+import atexit
 
 from dotenv import load_dotenv
 
-load_dotenv(override=True)
+# the .env file overriding the environment, found by searching upward from this package
+# by default, empty to load none (e.g. to run against the fakes of tests/fake_upstreams.py)
+g_dotenv_path = os.getenv("MOVIE_REQUEST_SERVER_DOTENV_PATH")
+if g_dotenv_path is None:
+    load_dotenv(override=True)
+elif g_dotenv_path:
+    load_dotenv(g_dotenv_path, override=True)
 
 g_log_level = os.getenv("MOVIE_REQUEST_SERVER_LOG_LEVEL", "INFO").upper()
 g_log_file_name = os.getenv("MOVIE_REQUEST_SERVER_LOG_FILE", "_logs/app.log")
+# "text" or "json"
+g_log_format = os.getenv("MOVIE_REQUEST_SERVER_LOG_FORMAT", "text").lower()
+# records logged while this many are waiting to be written are dropped, 0 writes synchronously
+g_log_queue_size = int(os.getenv("MOVIE_REQUEST_SERVER_LOG_QUEUE_SIZE", 10000))
 
 g_logging_config = {
     "version": 1,
     "handlers": {
         "file": {
             "class": "logging.handlers.RotatingFileHandler",
-            "formatter": "default",
+            "formatter": "json" if g_log_format == "json" else "default",
             "filename": g_log_file_name,
             "maxBytes": 10485760,  # 10MB
             "backupCount": 2,
@@ -22,7 +33,10 @@ g_logging_config = {
     "formatters": {
         "default": {
             "format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        }
+        },
+        "json": {
+            "()": "app.log_queue.JsonFormatter",
+        },
     },
     "loggers": {
         "root": {
@@ -39,5 +53,15 @@ g_logging_config = {
 
 logging.config.dictConfig(g_logging_config)
 
+# formatting and writing (and rotating) the file happen on the listener thread
+g_log_queue_handler = None
+if g_log_queue_size > 0:
+    from app.log_queue import install
+
+    g_log_queue_handler, g_log_listener = install(
+        [logging.getLogger(), logging.getLogger(__package__)], g_log_queue_size
+    )
+    atexit.register(g_log_listener.stop)
+
 logger = logging.getLogger(__package__)
-logger.info(f"Logger initialized with level: {g_log_level}")
+logger.info("Logger initialized with level: %s", g_log_level)
@@ -0,0 +1,69 @@
+# ASGI entry point, e.g. `uvicorn app.asgi:g_asgi_app`, a single process (no --workers),
+# see the worker settings of tool/gunicorn.conf.py
+# the Flask app itself runs in a thread pool, and its async views share the
+# persistent background event loop with the background and request jobs
+# (not the server's loop, the views still do blocking I/O such as reading the request body)
+
+import os
+import logging
+
+from a2wsgi import WSGIMiddleware
+
+from .main import MovieRequestApp, create_app, init_worker
+from .extensions import g_db, g_background
+
+logger = logging.getLogger(__name__)
+
+# max number of WSGI requests handled at the same time, including open event streams
+ASGI_THREADS = int(os.getenv("MOVIE_REQUEST_SERVER_ASGI_THREADS", 32))
+
+
+class LifespanApp:
+    """
+    ASGI app serving a WSGI app, with startup/shutdown hooks bound to the server's event loop.
+    """
+
+    def __init__(self, app: MovieRequestApp, threads: int = ASGI_THREADS):
+        self.app = app
+        self.wsgi = WSGIMiddleware(app, workers=threads)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.__lifespan(receive, send)
+            return
+        await self.wsgi(scope, receive, send)
+
+    async def startup(self):
+        init_worker(self.app)
+        self.app.event_loop = g_background.loop
+        logger.info("ASGI app started")
+
+    async def shutdown(self):
+        g_background.stop()
+        self.app.event_loop = None
+        g_db.close()
+        logger.info("ASGI app stopped")
+
+    async def __lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.startup()
+                except Exception as e:
+                    logger.exception(f"ASGI startup failed: {e}")
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                try:
+                    await self.shutdown()
+                except Exception as e:
+                    logger.exception(f"ASGI shutdown failed: {e}")
+                    await send({"type": "lifespan.shutdown.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+g_asgi_app = LifespanApp(create_app())
@@ -0,0 +1,146 @@
+import gzip
+import json
+import shutil
+import hashlib
+import pathlib
+import logging
+import mimetypes
+
+from flask import Flask, Response, send_from_directory
+
+from .compression import accepted_encodings
+
+try:
+    import brotli
+except ImportError:
+    # optional, only gzip variants are built without it
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = pathlib.Path(__file__).parent / "static"
+# fingerprinted and precompressed copies of the static files, see `build`
+BUILD_DIR_NAME = "_build"
+BUILD_DIR = STATIC_DIR / BUILD_DIR_NAME
+MANIFEST_PATH = BUILD_DIR / "manifest.json"
+
+# files that are worth compressing, images are already compressed
+COMPRESSIBLE_SUFFIXES = (".js", ".css", ".html", ".json", ".svg", ".txt", ".map")
+# variants are only kept if they save at least this much
+MIN_COMPRESSION_RATIO = 0.9
+
+# in order of preference, (encoding, file suffix)
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def fingerprint(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=6).hexdigest()
+
+
+def fingerprinted_name(path: pathlib.PurePosixPath, digest: str) -> str:
+    # tablesort.min.js -> tablesort.min.<digest>.js
+    return str(path.with_name(f"{path.stem}.{digest}{path.suffix}"))
+
+
+def build(static_dir: pathlib.Path = STATIC_DIR) -> dict[str, str]:
+    """
+    Copy every static file to the build directory under a content-hashed name,
+    alongside gzip (and brotli, if installed) variants, and write the manifest.
+    Returns the manifest, which maps the original names to the built ones.
+    """
+    build_dir = static_dir / BUILD_DIR_NAME
+    if build_dir.exists():
+        shutil.rmtree(build_dir)
+    build_dir.mkdir(parents=True)
+
+    manifest: dict[str, str] = {}
+    for src in sorted(static_dir.rglob("*")):
+        if not src.is_file() or build_dir in src.parents:
+            continue
+        rel = pathlib.PurePosixPath(src.relative_to(static_dir).as_posix())
+        data = src.read_bytes()
+        built = fingerprinted_name(rel, fingerprint(data))
+        dst = build_dir / built
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        dst.write_bytes(data)
+        manifest[str(rel)] = f"{BUILD_DIR_NAME}/{built}"
+
+        if rel.suffix not in COMPRESSIBLE_SUFFIXES:
+            continue
+        variants = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants[".br"] = brotli.compress(data, quality=11)
+        for suffix, compressed in variants.items():
+            if len(compressed) <= len(data) * MIN_COMPRESSION_RATIO:
+                dst.with_name(dst.name + suffix).write_bytes(compressed)
+
+    (build_dir / "manifest.json").write_text(json.dumps(manifest, indent=2))
+    if brotli is None:
+        logger.warning("brotli is not installed, only gzip variants were built")
+    logger.info(f"Built {len(manifest)} static files into {build_dir}")
+    return manifest
+
+
+def load_manifest() -> dict[str, str]:
+    try:
+        with open(MANIFEST_PATH, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.error(f"Failed to load static manifest: {e}")
+        return {}
+
+
+def send_built_file(filename: str) -> Response:
+    """
+    Serve a fingerprinted file, or its best precompressed variant the client accepts.
+    """
+    accepted = accepted_encodings()
+    path = STATIC_DIR / filename
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted and path.with_name(path.name + suffix).is_file():
+            mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            response = send_from_directory(
+                STATIC_DIR, filename + suffix, mimetype=mimetype, max_age=None
+            )
+            response.headers["Content-Encoding"] = encoding
+            break
+    else:
+        response = send_from_directory(STATIC_DIR, filename, max_age=None)
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
+def init_app(app: Flask):
+    """
+    Rewrite `url_for('static', ...)` to the fingerprinted files if they were built,
+    and serve those with precompression and immutable cache headers.
+    Without a build the static files are served as usual.
+    """
+    manifest = load_manifest()
+    if not manifest:
+        logger.info("No static build found, serving the static files as is")
+        return
+    built = set(manifest.values())
+
+    @app.url_defaults
+    def _fingerprint_static(endpoint: str, values: dict):
+        if endpoint == "static" and "filename" in values:
+            values["filename"] = manifest.get(values["filename"], values["filename"])
+
+    def _static(filename: str):
+        if filename in built:
+            return send_built_file(filename)
+        return app.send_static_file(filename)
+
+    app.view_functions["static"] = _static
+    logger.info(f"Serving {len(manifest)} fingerprinted static files")
+
+
+if __name__ == "__main__":
+    manifest = build()
+    print(f"Built {len(manifest)} static files into {BUILD_DIR}")
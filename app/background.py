@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from typing import Awaitable, Callable, Coroutine, Any
+
+logger = logging.getLogger(__name__)
+
+
+class LoopSemaphore:
+    """
+    asyncio.Semaphore of the running event loop, `async with semaphore.get(): ...`.
+    A semaphore is bound to the first loop it waits on, so one created at import
+    would fail once the background loop is restarted, e.g. by the ASGI lifespan.
+    It is recreated whenever the loop changes.
+    """
+
+    def __init__(self, value: int):
+        self._value = value
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+
+    def get(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self._value)
+        return self._semaphore
+
+
+class BackgroundLoop:
+    """
+    A daemon thread running its own event loop.
+    Flask runs every async view on a throwaway event loop, so long-running jobs
+    (periodic monitors, worker pools) live here instead.
+    """
+
+    def __init__(self, name: str = "background"):
+        self.name = name
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._periodic: list[tuple[str, float, Callable[[], Awaitable[None]]]] = []
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop | None:
+        return self._loop
+
+    def every(
+        self, interval_s: float, fn: Callable[[], Awaitable[None]], name: str = ""
+    ):
+        """
+        Register a coroutine function to be called every `interval_s` seconds.
+        A non-positive interval disables the job.
+        """
+        name = name or getattr(fn, "__qualname__", repr(fn))
+        if interval_s <= 0:
+            logger.info(f"Periodic job {name} is disabled")
+            return
+        self._periodic.append((name, interval_s, fn))
+        if self.running:
+            self.call_soon(self.__schedule_periodic, name, interval_s, fn)
+
+    def start(self):
+        if self.running:
+            return
+        self._loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def _run():
+            assert self._loop is not None
+            asyncio.set_event_loop(self._loop)
+            for name, interval_s, fn in self._periodic:
+                self.__schedule_periodic(name, interval_s, fn)
+            self._loop.call_soon(ready.set)
+            self._loop.run_forever()
+
+            # cancel whatever is left once stopped
+            pending = asyncio.all_tasks(self._loop)
+            for task in pending:
+                task.cancel()
+            self._loop.run_until_complete(
+                asyncio.gather(*pending, return_exceptions=True)
+            )
+            self._loop.close()
+
+        self._thread = threading.Thread(target=_run, name=self.name, daemon=True)
+        self._thread.start()
+        ready.wait()
+        logger.info(f"Background loop {self.name} started")
+
+    def stop(self, timeout_s: float = 5):
+        if not self.running:
+            return
+        assert self._loop is not None and self._thread is not None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout_s)
+        self._thread = None
+        self._loop = None
+        self._tasks.clear()
+        logger.info(f"Background loop {self.name} stopped")
+
+    def call_soon(self, fn: Callable[..., Any], *args):
+        assert self._loop is not None, "background loop is not running"
+        self._loop.call_soon_threadsafe(fn, *args)
+
+    def submit(
+        self, coro: Coroutine[Any, Any, Any]
+    ) -> concurrent.futures.Future:
+        """
+        Run a coroutine on the background loop, can be called from any thread.
+        """
+        assert self._loop is not None, "background loop is not running"
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def __schedule_periodic(
+        self, name: str, interval_s: float, fn: Callable[[], Awaitable[None]]
+    ):
+        assert self._loop is not None
+
+        async def _periodic():
+            while True:
+                try:
+                    await fn()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.exception(f"Periodic job {name} failed: {e}")
+                await asyncio.sleep(interval_s)
+
+        self._tasks.append(self._loop.create_task(_periodic(), name=name))
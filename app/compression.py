@@ -0,0 +1,139 @@
+import os
+import zlib
+import logging
+from typing import Iterable, Iterator
+
+from flask import Flask, Response, request
+
+try:
+    import brotli
+except ImportError:
+    # optional, only gzip is used without it
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# responses smaller than this are sent as is, streamed responses are always compressed
+COMPRESS_MIN_SIZE = int(os.getenv("MOVIE_REQUEST_SERVER_COMPRESS_MIN_SIZE", 1024))
+COMPRESS_GZIP_LEVEL = 6
+# brotli's default of 11 is too slow to be used on the fly
+COMPRESS_BROTLI_QUALITY = 4
+COMPRESSIBLE_MIMETYPES = (
+    "text/html",
+    "text/plain",
+    "text/css",
+    "text/javascript",
+    "application/javascript",
+    "application/json",
+)
+
+# in order of preference
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def accepted_encodings() -> set[str]:
+    ret = set()
+    for value in request.headers.get("Accept-Encoding", "").split(","):
+        encoding, _, params = value.partition(";")
+        encoding = encoding.strip().lower()
+        if not encoding:
+            continue
+        try:
+            # e.g. gzip;q=0 explicitly refuses gzip
+            q = float(params.strip()[2:]) if params.strip().startswith("q=") else 1.0
+        except ValueError:
+            q = 1.0
+        if q > 0:
+            ret.add(encoding)
+    return ret
+
+
+class _GzipCompressor:
+    def __init__(self):
+        # wbits 16 + MAX_WBITS writes a gzip header and trailer
+        self._obj = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def process(self, data: bytes) -> bytes:
+        return self._obj.compress(data)
+
+    def flush(self) -> bytes:
+        # sync flush so that the client can decode what was sent so far
+        return self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._obj.flush(zlib.Z_FINISH)
+
+
+class _BrotliCompressor:
+    def __init__(self):
+        assert brotli is not None
+        self._obj = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+
+    def process(self, data: bytes) -> bytes:
+        return self._obj.process(data)
+
+    def flush(self) -> bytes:
+        return self._obj.flush()
+
+    def finish(self) -> bytes:
+        return self._obj.finish()
+
+
+def _compressor(encoding: str) -> _GzipCompressor | _BrotliCompressor:
+    return _BrotliCompressor() if encoding == "br" else _GzipCompressor()
+
+
+def compress_stream(chunks: Iterable[bytes | str], encoding: str) -> Iterator[bytes]:
+    """
+    Compress a streamed body chunk by chunk, every chunk is flushed as soon as it is produced.
+    """
+    compressor = _compressor(encoding)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+def compress_response(response: Response) -> Response:
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    accepted = accepted_encodings()
+    encoding = next((e for e in ENCODINGS if e in accepted), None)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        compressor = _compressor(encoding)
+        response.set_data(compressor.process(data) + compressor.finish())
+
+    response.headers["Content-Encoding"] = encoding
+    # the compressed body differs byte-wise from the one the etag was computed for
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app: Flask):
+    app.after_request(compress_response)
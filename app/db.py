@@ -59,12 +59,25 @@ class IDatabase(ABC):
     @abstractmethod
     async def make_request(self, user: User, torrent: Torrent) -> MovieRequest: ...
 
+    # one transaction for all the torrents, see make_request
+    @abstractmethod
+    async def make_requests(
+        self, user: User, torrents: list[Torrent]
+    ) -> list[MovieRequest]: ...
+
     @abstractmethod
     async def get_requests(self, user: User) -> list[MovieRequest]: ...
 
     @abstractmethod
     async def cancel_request(self, user: User, torrent: Torrent) -> bool: ...
 
+    # every requested torrent once, ref_count is the number of users who requested it
+    @abstractmethod
+    async def get_all_requests(self) -> list[MovieRequest]: ...
+
+    @abstractmethod
+    async def get_requests_by_user(self) -> dict[User, list[Torrent]]: ...
+
     @abstractmethod
     def drop(self): ...
 
@@ -134,7 +147,7 @@ class JsonDatabase(IDatabase):
 
     def __assert(self, cond, msg: str):
         if not cond:
-            logger.fatal(f"invariant violation: {msg}")
+            logger.fatal("invariant violation: %s", msg)
             sys.exit(1)
 
     def __get_or_create_request(self, torrent: Torrent) -> tuple[MovieRequest, bool]:
@@ -164,36 +177,60 @@ class JsonDatabase(IDatabase):
 
         return True
 
-    async def make_request(self, user: User, torrent: Torrent) -> MovieRequest:
-        async with self.lock:
-            user_to_torrents = self._db.user_to_torrents
-            if user not in user_to_torrents:
-                user_to_torrents[user] = []
+    def __make_request(self, user: User, torrent: Torrent) -> tuple[MovieRequest, bool]:
+        """
+        The boolean indicates whether the database changed, it must be saved by the caller.
+        """
+        user_to_torrents = self._db.user_to_torrents
+        if user not in user_to_torrents:
+            user_to_torrents[user] = []
 
-            req, is_new = self.__get_or_create_request(torrent)
+        req, is_new = self.__get_or_create_request(torrent)
 
-            if torrent in user_to_torrents[user]:
-                logger.warning(
-                    f"User {user.username} already has a request for torrent {torrent.infohash}."
-                )
-                self.__assert(
-                    not is_new, "torrent is new but already in user_to_torrents"
-                )
-                return req
-            else:
-                user_to_torrents[user].append(torrent)
+        if torrent in user_to_torrents[user]:
+            logger.warning(
+                "User %s already has a request for torrent %s.",
+                user.username,
+                torrent.infohash,
+            )
+            self.__assert(not is_new, "torrent is new but already in user_to_torrents")
+            return req, False
+        else:
+            user_to_torrents[user].append(torrent)
 
-            if is_new:
-                self._db.all_requests.append(req)
-            else:
-                req.ref_count += 1
+        if is_new:
+            self._db.all_requests.append(req)
+        else:
+            req.ref_count += 1
 
-            logger.info(
-                f"User {user.username} made a request for torrent {torrent.infohash}."
-            )
-            self.__save()
+        logger.info(
+            "User %s made a request for torrent %s.",
+            user.username,
+            torrent.infohash,
+        )
+        return req, True
+
+    async def make_request(self, user: User, torrent: Torrent) -> MovieRequest:
+        async with self.lock:
+            req, changed = self.__make_request(user, torrent)
+            if changed:
+                self.__save()
             return req
 
+    async def make_requests(
+        self, user: User, torrents: list[Torrent]
+    ) -> list[MovieRequest]:
+        async with self.lock:
+            ret = []
+            changed = False
+            for torrent in torrents:
+                req, req_changed = self.__make_request(user, torrent)
+                ret.append(req)
+                changed = changed or req_changed
+            if changed:
+                self.__save()
+            return ret
+
     async def get_requests(self, user: User) -> list[MovieRequest]:
         user_to_torrents = self._db.user_to_torrents
         if user not in user_to_torrents:
@@ -212,12 +249,14 @@ class JsonDatabase(IDatabase):
         async with self.lock:
             user_to_torrents = self._db.user_to_torrents
             if user not in user_to_torrents:
-                logger.warning(f"User {user.username} does not have any requests.")
+                logger.warning("User %s does not have any requests.", user.username)
                 return False
             torrents = user_to_torrents[user]
             if torrent not in torrents:
                 logger.warning(
-                    f"User {user.username} does not have a request for torrent {torrent.infohash}."
+                    "User %s does not have a request for torrent %s.",
+                    user.username,
+                    torrent.infohash,
                 )
                 return False
             torrents.remove(torrent)
@@ -237,6 +276,15 @@ class JsonDatabase(IDatabase):
             self.__save()
             return True
 
+    async def get_all_requests(self) -> list[MovieRequest]:
+        return list(self._db.all_requests)
+
+    async def get_requests_by_user(self) -> dict[User, list[Torrent]]:
+        return {
+            user: list(torrents)
+            for user, torrents in self._db.user_to_torrents.items()
+        }
+
     def drop(self):
         try:
             os.remove(self.db_path)
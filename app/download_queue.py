@@ -0,0 +1,134 @@
+import os
+import time
+import logging
+from datetime import datetime
+
+import app.db as db
+import app.qbittorrent as qbittorrent
+
+logger = logging.getLogger(__name__)
+
+# 0 disables the queue manager
+QUEUE_INTERVAL_S = float(os.getenv("MOVIE_REQUEST_SERVER_QUEUE_INTERVAL_S", 30))
+# downloads qbittorrent runs at the same time, the others wait in its queue.
+# the queueing preferences are global, the cap also applies to the torrents outside
+# QBITTORRENT_CATEGORY, which are not reordered.
+# 0 leaves the preferences of qbittorrent untouched, its queue is still reordered if enabled
+QUEUE_MAX_ACTIVE_DOWNLOADS = int(
+    os.getenv("MOVIE_REQUEST_SERVER_QUEUE_MAX_ACTIVE_DOWNLOADS", 0)
+)
+# waiting this long weighs as much as one more user requesting the torrent,
+# so that the torrents only one user wants are not starved
+QUEUE_AGING_S = float(os.getenv("MOVIE_REQUEST_SERVER_QUEUE_AGING_H", 24)) * 3600
+
+
+def queue_score(ref_count: int, waited_s: float) -> float:
+    return ref_count + max(0.0, waited_s) / QUEUE_AGING_S
+
+
+def plan_moves(current: list[str], desired: list[str]) -> list[str]:
+    """
+    Hashes to move to the top of the queue, one after the other, to turn the `current`
+    order into the `desired` one. The longest tail of `desired` already in order stays put.
+    """
+    position = {infohash: i for i, infohash in enumerate(current)}
+    keep = len(desired)
+    while keep > 1 and position[desired[keep - 2]] < position[desired[keep - 1]]:
+        keep -= 1
+    if keep == 1:
+        return []
+    return desired[: keep - 1][::-1]
+
+
+class DownloadQueue:
+    """
+    Orders qbittorrent's download queue so that the torrents most users are waiting for
+    download first, and caps the number of downloads sharing the link.
+    """
+
+    def __init__(self, database: db.IDatabase):
+        self._db = database
+        self._configured = QUEUE_MAX_ACTIVE_DOWNLOADS <= 0
+
+    async def check(self):
+        if not self._configured:
+            self._configured = await self.__configure()
+
+        torrents = await qbittorrent.get_torrent_list(
+            filter=qbittorrent.GetTorrentListFilter.DOWNLOADING,
+            category=qbittorrent.QBITTORRENT_CATEGORY or None,
+        )
+        if torrents is None:
+            logger.warning("Download queue could not fetch the torrent list")
+            return
+        # qbittorrent reports a non-positive priority when queueing is disabled
+        queued = [
+            torrent
+            for torrent in torrents
+            if torrent.get("priority", 0) > 0 and torrent.get("progress", 0) < 1
+        ]
+        if len(queued) < 2:
+            return
+
+        requests = {req.torrent.infohash: req for req in await self._db.get_all_requests()}
+        now = time.time()
+
+        def _score(torrent: qbittorrent.TorrentInfo) -> float:
+            req = requests.get(torrent["hash"])
+            if req is None:
+                # not requested through the server
+                return queue_score(0, now - torrent.get("added_on", now))
+            requested_at = datetime.strptime(
+                req.created_at, "%Y-%m-%d %H:%M:%S"
+            ).timestamp()
+            return queue_score(req.ref_count, now - requested_at)
+
+        current = sorted(queued, key=lambda t: t["priority"])
+        # ties keep their current order, to not reshuffle the queue for nothing
+        desired = sorted(current, key=lambda t: -_score(t))
+        moves = plan_moves(
+            [torrent["hash"] for torrent in current],
+            [torrent["hash"] for torrent in desired],
+        )
+        if not moves:
+            return
+
+        # moving several torrents at once keeps their current relative order,
+        # so they are moved one by one, the last one ends up first
+        for infohash in moves:
+            if not await qbittorrent.top_priority(infohash):
+                return
+        logger.info(
+            f"Reordered the download queue, moved {len(moves)} torrents: "
+            f"{[torrent['hash'] for torrent in desired[: len(moves)]]}"
+        )
+
+    async def __configure(self) -> bool:
+        """
+        Take over the global queueing preferences of qbittorrent.
+        """
+        # seeding is not queued, only the downloads are capped
+        preferences = {
+            "queueing_enabled": True,
+            "max_active_downloads": QUEUE_MAX_ACTIVE_DOWNLOADS,
+            "max_active_torrents": -1,
+            "max_active_uploads": -1,
+        }
+        current = await qbittorrent.get_preferences()
+        if current is None:
+            return False
+        previous = {
+            name: current.get(name)
+            for name, value in preferences.items()
+            if current.get(name) != value
+        }
+        if not previous:
+            return True
+        if not await qbittorrent.set_preferences(preferences):
+            return False
+        # the admin may want them back, e.g. after disabling the queue manager
+        logger.warning(
+            f"qBittorrent now runs at most {QUEUE_MAX_ACTIVE_DOWNLOADS} downloads at once "
+            f"across all categories, replaced its queueing preferences: {previous}"
+        )
+        return True
@@ -0,0 +1,168 @@
+import os
+import re
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import NamedTuple
+
+import app.db as db
+import app.jackett as jackett
+import app.qbittorrent as qbittorrent
+
+logger = logging.getLogger(__name__)
+
+# 0 disables the periodic refresh, requests made through the server are still indexed
+DUPLICATE_INDEX_INTERVAL_S = float(
+    os.getenv("MOVIE_REQUEST_SERVER_DUPLICATE_INDEX_INTERVAL_S", 300)
+)
+
+
+class MediaKey(NamedTuple):
+    """
+    What two releases of the same media have in common.
+    """
+
+    title: str
+    year: int | None
+    season: tuple[int, ...]
+    episode: tuple[int, ...]
+    screen_size: str | None
+
+
+def _as_tuple(value) -> tuple[int, ...]:
+    if value is None:
+        return ()
+    if isinstance(value, list):
+        return tuple(sorted(value))
+    return (value,)
+
+
+def media_key(metadata: jackett.MetadataDict) -> MediaKey | None:
+    title = metadata.get("title")
+    if not isinstance(title, str):
+        return None
+    # "The.Matrix" and "the matrix!" are the same title
+    title = " ".join(re.sub(r"[^\w]+", " ", title.lower()).split())
+    if not title:
+        return None
+    return MediaKey(
+        title=title,
+        year=metadata.get("year"),
+        season=_as_tuple(metadata.get("season")),
+        episode=_as_tuple(metadata.get("episode")),
+        screen_size=metadata.get("screen_size"),
+    )
+
+
+@dataclass
+class IndexedRequest:
+    infohash: str
+    name: str
+    size: int
+    ref_count: int
+    progress: float
+
+    def to_dict(self) -> dict:
+        return {
+            "infohash": self.infohash,
+            "name": self.name,
+            "size": self.size,
+            "ref_count": self.ref_count,
+            "progress": self.progress,
+        }
+
+
+class DuplicateIndex:
+    """
+    The requested torrents by media, to find the requests of other releases of the same media.
+    """
+
+    def __init__(self, database: db.IDatabase):
+        self._db = database
+        # hash -> key, guessing is slow so it is done once per torrent
+        self._keys: dict[str, MediaKey | None] = {}
+        self._requests: dict[str, IndexedRequest] = {}
+        self._by_key: dict[MediaKey, list[IndexedRequest]] = {}
+
+    def find(
+        self, metadata: jackett.MetadataDict, exclude: str | None = None
+    ) -> list[IndexedRequest]:
+        """
+        Requests of the same media as `metadata`, except the torrent `exclude`.
+        """
+        key = media_key(metadata)
+        if key is None:
+            return []
+        exclude = exclude.lower() if exclude else None
+        return [req for req in self._by_key.get(key, []) if req.infohash != exclude]
+
+    async def add(self, infohash: str, name: str, size: int):
+        """
+        Index a torrent just requested, before the next refresh.
+        """
+        infohash = infohash.lower()
+        if infohash not in self._keys:
+            self._keys[infohash] = await asyncio.to_thread(
+                lambda: media_key(jackett.guess_metadata(name))
+            )
+        req = self._requests.get(infohash)
+        if req is None:
+            self._requests[infohash] = IndexedRequest(infohash, name, size, 1, 0)
+        else:
+            req.ref_count += 1
+        self.__rebuild()
+
+    def get(self, infohash: str) -> IndexedRequest | None:
+        return self._requests.get(infohash.lower())
+
+    def join(self, infohash: str):
+        """
+        Count a user joining the request of an indexed torrent, before the next refresh.
+        """
+        req = self._requests.get(infohash.lower())
+        if req is not None:
+            req.ref_count += 1
+            self.__rebuild()
+
+    async def refresh(self):
+        torrents = await qbittorrent.get_torrent_list()
+        if torrents is None:
+            logger.warning("Duplicate index could not fetch the torrent list")
+            return
+        ref_counts = {
+            req.torrent.infohash.lower(): req.ref_count
+            for req in await self._db.get_all_requests()
+        }
+        requested = [t for t in torrents if t["hash"].lower() in ref_counts]
+
+        new = [t for t in requested if t["hash"].lower() not in self._keys]
+        if new:
+            # off the event loop, guessit takes tens of ms per name
+            keys = await asyncio.to_thread(
+                lambda: [media_key(jackett.guess_metadata(t["name"])) for t in new]
+            )
+            self._keys.update(zip((t["hash"].lower() for t in new), keys))
+
+        self._requests = {
+            t["hash"].lower(): IndexedRequest(
+                infohash=t["hash"].lower(),
+                name=t["name"],
+                size=t.get("total_size", t.get("size", 0)),
+                ref_count=ref_counts[t["hash"].lower()],
+                progress=t.get("progress", 0),
+            )
+            for t in requested
+        }
+        self._keys = {h: k for h, k in self._keys.items() if h in self._requests}
+        self.__rebuild()
+
+    def __rebuild(self):
+        by_key: dict[MediaKey, list[IndexedRequest]] = {}
+        for infohash, req in self._requests.items():
+            key = self._keys.get(infohash)
+            if key is not None:
+                by_key.setdefault(key, []).append(req)
+        # the most wanted, then the most advanced release first
+        for reqs in by_key.values():
+            reqs.sort(key=lambda r: (-r.ref_count, -r.progress))
+        self._by_key = by_key
@@ -1,8 +1,22 @@
 import os
+import asyncio
 from pathlib import Path
 
 import app.db as db
 import app.jellyfin as jellyfin
+import app.watchdog as watchdog
+import app.rebalancer as rebalancer
+import app.status_feed as status_feed
+import app.download_queue as download_queue
+import app.fair_share as fair_share
+import app.seeding as seeding
+import app.reconcile as reconcile
+import app.duplicates as duplicates
+import app.search_index as search_index
+import app.shared_state as shared_state
+import app.metrics as metrics
+from app.background import BackgroundLoop
+from app.jobs import JobPool
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 
@@ -18,8 +32,97 @@ DB_FILE = os.getenv(
 
 
 g_db = db.JsonDatabase(DB_FILE)
+metrics.register(
+    metrics.Gauge(
+        "movie_request_db_size_bytes",
+        "Size of the database file.",
+        lambda: os.path.getsize(DB_FILE) if os.path.exists(DB_FILE) else 0,
+    )
+)
+g_shared_state = shared_state.create_shared_state(shared_state.SHARED_STATE_URI)
 g_limiter = Limiter(
     key_func=limiter_key_func,
-    storage_uri=os.getenv("MOVIE_REQUEST_SERVER_RATE_LIMIT_STORAGE_URI", "memory://"),
+    # sqlite:// uris are served by shared_state.SqliteLimiterStorage
+    storage_uri=os.getenv(
+        "MOVIE_REQUEST_SERVER_RATE_LIMIT_STORAGE_URI", shared_state.SHARED_STATE_URI
+    ),
+)
+
+g_background = BackgroundLoop()
+
+g_watchdog = watchdog.DiskWatchdog()
+g_background.every(watchdog.WATCHDOG_INTERVAL_S, g_watchdog.check, name="disk_watchdog")
+g_background.every(
+    rebalancer.REBALANCE_INTERVAL_S, rebalancer.rebalance, name="rebalancer"
+)
+
+g_fair_share = fair_share.FairShareAllocator(g_db, g_watchdog)
+g_background.every(
+    fair_share.FAIR_SHARE_INTERVAL_S, g_fair_share.check, name="fair_share"
+)
+
+g_seeding = seeding.SeedingManager()
+g_background.every(seeding.SEEDING_INTERVAL_S, g_seeding.check, name="seeding")
+
+g_reconciler = reconcile.Reconciler(g_db)
+g_background.every(
+    reconcile.RECONCILE_INTERVAL_S, g_reconciler.check, name="reconcile"
+)
+metrics.register(
+    metrics.Gauge(
+        "movie_request_dangling_requests",
+        "Requests whose torrent is missing from qBittorrent, at the last reconciliation.",
+        lambda: len(g_reconciler.report.dangling) if g_reconciler.report else 0,
+    )
+)
+metrics.register(
+    metrics.Gauge(
+        "movie_request_orphan_torrents",
+        "Torrents nobody requested, at the last reconciliation.",
+        lambda: len(g_reconciler.report.orphans) if g_reconciler.report else 0,
+    )
 )
 
+g_duplicates = duplicates.DuplicateIndex(g_db)
+g_background.every(
+    duplicates.DUPLICATE_INDEX_INTERVAL_S, g_duplicates.refresh, name="duplicate_index"
+)
+
+g_search_index = search_index.SearchIndex(search_index.SEARCH_INDEX_PATH)
+metrics.register(
+    metrics.Gauge(
+        "movie_request_search_index_entries",
+        "Search results in the local search index.",
+        g_search_index.count,
+    )
+)
+
+
+async def evict_search_index():
+    await asyncio.to_thread(g_search_index.evict)
+
+
+g_background.every(
+    search_index.SEARCH_INDEX_EVICT_INTERVAL_S,
+    evict_search_index,
+    name="search_index_evict",
+)
+
+g_download_queue = download_queue.DownloadQueue(g_db)
+g_background.every(
+    download_queue.QUEUE_INTERVAL_S, g_download_queue.check, name="download_queue"
+)
+
+g_status_feed = status_feed.StatusFeed(g_db)
+g_background.every(
+    status_feed.STATUS_FEED_INTERVAL_S, g_status_feed.poll, name="status_feed"
+)
+
+g_jobs = JobPool(g_background)
+g_jobs.subscribe(lambda job: g_status_feed.notify(job.owner, "job", job.to_dict()))
+
+async def purge_shared_state():
+    g_shared_state.purge_expired()
+
+
+g_background.every(60, purge_shared_state, name="shared_state_purge")
@@ -0,0 +1,211 @@
+import os
+import math
+import logging
+
+import app.db as db
+import app.qbittorrent as qbittorrent
+import app.watchdog as watchdog
+
+logger = logging.getLogger(__name__)
+
+FAIR_SHARE_INTERVAL_S = float(
+    os.getenv("MOVIE_REQUEST_SERVER_FAIR_SHARE_INTERVAL_S", 15)
+)
+# total download rate split between the users, 0 disables the allocator
+FAIR_SHARE_BUDGET_BYTES = int(
+    float(os.getenv("MOVIE_REQUEST_SERVER_FAIR_SHARE_BUDGET_KBPS", 0)) * 1024
+)
+# a torrent downloading slower than this fraction of its limit doesn't use its share
+FAIR_SHARE_SATURATION = 0.9
+# limit given to such torrents, relative to their current rate, so they can speed up
+FAIR_SHARE_HEADROOM = 1.5
+# lowest limit ever applied, so that stalled torrents can ramp up again
+FAIR_SHARE_MIN_BYTES = 64 * 1024
+# limits changing less than this fraction are not updated
+FAIR_SHARE_TOLERANCE = 0.1
+
+# tag of the torrents limited by the allocator, so that their limits can be reset
+# even after a restart, e.g. with the allocator disabled
+FAIR_SHARE_TAG = "fair-share"
+
+# states in which a torrent takes bandwidth, queued and paused torrents don't
+DOWNLOADING_STATES = {
+    qbittorrent.TorrentState.DOWNLOADING,
+    qbittorrent.TorrentState.FORCED_DL,
+    qbittorrent.TorrentState.META_DL,
+    qbittorrent.TorrentState.STALLED_DL,
+}
+
+
+def torrent_weights(owners: dict[str, list[str]]) -> dict[str, float]:
+    """
+    Every user weighs 1, split equally between their torrents.
+    A torrent requested by several users adds up their parts, so its cost is shared.
+
+    :param owners: user id -> hashes of their downloading torrents
+    """
+    ret: dict[str, float] = {}
+    for hashes in owners.values():
+        for infohash in hashes:
+            ret[infohash] = ret.get(infohash, 0) + 1 / len(hashes)
+    return ret
+
+
+def water_fill(
+    budget: float, weights: dict[str, float], demands: dict[str, float]
+) -> dict[str, float]:
+    """
+    Weighted max-min fair split of `budget`: torrents demanding less than their share
+    get their demand, what they leave is split again between the others.
+    """
+    ret: dict[str, float] = {}
+    remaining = dict(weights)
+    left = budget
+    while remaining:
+        total = sum(remaining.values())
+        satisfied = [
+            infohash
+            for infohash, weight in remaining.items()
+            if demands[infohash] <= left * weight / total
+        ]
+        if not satisfied:
+            for infohash, weight in remaining.items():
+                ret[infohash] = left * weight / total
+            break
+        for infohash in satisfied:
+            ret[infohash] = demands[infohash]
+            left -= demands[infohash]
+            del remaining[infohash]
+    return ret
+
+
+def demand(torrent: qbittorrent.TorrentInfo) -> float:
+    """
+    Rate a torrent could use: unbounded if nothing holds it back but its limit.
+    """
+    limit = torrent.get("dl_limit", 0)
+    speed = torrent.get("dlspeed", 0)
+    if limit <= 0 or speed >= limit * FAIR_SHARE_SATURATION:
+        return math.inf
+    return max(FAIR_SHARE_MIN_BYTES, speed * FAIR_SHARE_HEADROOM)
+
+
+class FairShareAllocator:
+    """
+    Splits the download budget equally between the users with downloading torrents,
+    through the per-torrent download limits of qbittorrent.
+    """
+
+    def __init__(self, database: db.IDatabase, disk_watchdog: watchdog.DiskWatchdog):
+        self._db = database
+        self._watchdog = disk_watchdog
+        # hash -> fair limit given by the last run, before the cap of the watchdog
+        self._limits: dict[str, int] = {}
+        # whether the limits left by a previous run were reset, with the allocator disabled
+        self._released = False
+        # torrents released by the watchdog get their fair limit back
+        disk_watchdog.set_base_limit(lambda infohash: self._limits.get(infohash, 0))
+
+    @property
+    def limits(self) -> dict[str, int]:
+        return dict(self._limits)
+
+    async def check(self):
+        if FAIR_SHARE_BUDGET_BYTES <= 0:
+            if not self._released:
+                tagged = await qbittorrent.get_torrent_list(tag=FAIR_SHARE_TAG)
+                if tagged is not None:
+                    self._released = await self.__release(
+                        [torrent["hash"] for torrent in tagged]
+                    )
+            return
+        torrents = await qbittorrent.get_torrent_list(
+            category=qbittorrent.QBITTORRENT_CATEGORY or None,
+        )
+        if torrents is None:
+            logger.warning("Fair share allocator could not fetch the torrent list")
+            return
+        downloading = {
+            torrent["hash"]: torrent
+            for torrent in torrents
+            if torrent.get("state") in DOWNLOADING_STATES
+        }
+        # the torrents that stopped downloading don't take part anymore
+        await self.__release(
+            [
+                torrent["hash"]
+                for torrent in torrents
+                if torrent["hash"] not in downloading
+                and (
+                    torrent["hash"] in self._limits
+                    or qbittorrent.has_tag(torrent, FAIR_SHARE_TAG)
+                )
+            ]
+        )
+        self._limits = {h: l for h, l in self._limits.items() if h in downloading}
+        if not downloading:
+            return
+
+        owners: dict[str, list[str]] = {}
+        owned = set()
+        for user, user_torrents in (await self._db.get_requests_by_user()).items():
+            hashes = [t.infohash for t in user_torrents if t.infohash in downloading]
+            if hashes:
+                owners[user.id] = hashes
+                owned.update(hashes)
+        # torrents not requested through the server share the part of one user
+        unowned = [infohash for infohash in downloading if infohash not in owned]
+        if unowned:
+            owners[""] = unowned
+
+        allocation = water_fill(
+            FAIR_SHARE_BUDGET_BYTES,
+            torrent_weights(owners),
+            {infohash: demand(torrent) for infohash, torrent in downloading.items()},
+        )
+
+        watchdog_limited = self._watchdog.limited
+        changes: dict[int, list[str]] = {}
+        fair: dict[str, int] = {}
+        for infohash, rate in allocation.items():
+            fair[infohash] = max(FAIR_SHARE_MIN_BYTES, int(rate) // 1024 * 1024)
+            limit = fair[infohash]
+            if infohash in watchdog_limited:
+                limit = min(limit, watchdog.WATCHDOG_RATE_LIMIT_BYTES)
+            current = downloading[infohash].get("dl_limit", 0)
+            if current > 0 and abs(limit - current) <= current * FAIR_SHARE_TOLERANCE:
+                self._limits[infohash] = fair[infohash]
+                continue
+            changes.setdefault(limit, []).append(infohash)
+
+        untagged = [
+            infohash
+            for infohash in allocation
+            if not qbittorrent.has_tag(downloading[infohash], FAIR_SHARE_TAG)
+        ]
+        if untagged:
+            await qbittorrent.add_tags(untagged, FAIR_SHARE_TAG)
+        for limit, hashes in changes.items():
+            if await qbittorrent.set_download_limit(hashes, limit):
+                self._limits.update({infohash: fair[infohash] for infohash in hashes})
+        if changes:
+            logger.debug(
+                f"Fair share of {FAIR_SHARE_BUDGET_BYTES} B/s between {len(owners)} users: "
+                f"{self._limits}"
+            )
+
+    async def __release(self, hashes: list[str]) -> bool:
+        """
+        Reset the download limits of torrents the allocator stops managing,
+        except the ones rate-limited by the watchdog, which restores them itself.
+        """
+        if not hashes:
+            return True
+        for infohash in hashes:
+            self._limits.pop(infohash, None)
+        watchdog_limited = self._watchdog.limited
+        unlimit = [infohash for infohash in hashes if infohash not in watchdog_limited]
+        if unlimit and not await qbittorrent.set_download_limit(unlimit, 0):
+            return False
+        logger.debug(f"Fair share allocator released {hashes}")
+        return await qbittorrent.remove_tags(hashes, FAIR_SHARE_TAG)
@@ -6,6 +6,9 @@ import json
 from typing import TypedDict, NotRequired, Literal
 from guessit import guessit
 
+import app.metrics as metrics
+import app.profiling as profiling
+
 JACKETT_HOST = os.getenv("JACKETT_HOST", "localhost")
 JACKETT_CONFIG_DIR = os.getenv("JACKETT_CONFIG_DIR", "./_data/jackett/config")
 
@@ -25,6 +28,7 @@ logger.info(f"JACKETT_API_URL: {JACKETT_API_URL}, JACKETT_API_KEY: {JACKETT_API_
 @contextlib.asynccontextmanager
 async def async_client():
     async with httpx.AsyncClient(
+        transport=metrics.InstrumentedTransport("jackett"),
         base_url=JACKETT_API_URL,
         headers={
             "Content-Type": "application/json",
@@ -65,7 +69,8 @@ def guess_metadata(raw_torrent_name: str) -> MetadataDict:
     uses guessit to guess the metadata of a media file from its torrent name
     :param raw_torrent_name: the name of the torrent
     """
-    return guessit(raw_torrent_name)
+    with profiling.span("guessit"):
+        return guessit(raw_torrent_name)
 
 async def search(query: str) -> list[dict] | None:
     try:
@@ -8,6 +8,8 @@ from typing import TypedDict
 from flask import session
 from typing import cast
 
+import app.metrics as metrics
+
 JELLYFIN_HOST = os.getenv("JELLYFIN_HOST", "localhost")
 JELLYFIN_PORT = os.getenv("JELLYFIN_PORT", 8096)
 JELLYFIN_URL = f"http://{JELLYFIN_HOST}:{JELLYFIN_PORT}"
@@ -21,6 +23,7 @@ logger.info(f"JELLYFIN_URL: {JELLYFIN_URL}")
 @contextlib.asynccontextmanager
 async def async_client():
     async with httpx.AsyncClient(
+        transport=metrics.InstrumentedTransport("jellyfin"),
         base_url=JELLYFIN_URL,
         headers={
             "Content-Type": "application/json",
@@ -0,0 +1,191 @@
+import os
+import time
+import uuid
+import enum
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from app.background import BackgroundLoop, LoopSemaphore
+import app.profiling as profiling
+
+logger = logging.getLogger(__name__)
+
+# max number of jobs processed at the same time
+JOB_WORKERS = int(os.getenv("MOVIE_REQUEST_SERVER_JOB_WORKERS", 4))
+# max number of queued or running jobs, new jobs are rejected beyond this
+JOB_QUEUE_SIZE = int(os.getenv("MOVIE_REQUEST_SERVER_JOB_QUEUE_SIZE", 64))
+# how long finished jobs can still be queried
+JOB_TTL_S = 3600
+
+
+class JobState(str, enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class JobError(Exception):
+    """
+    Raised by job handlers to fail the job with a message for the user.
+    """
+
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+@dataclass(eq=False)
+class Job:
+    id: str
+    # id of the user that submitted the job
+    owner: str
+    params: dict[str, Any]
+    state: JobState = JobState.QUEUED
+    # the step the job is currently at, for display only
+    step: str = ""
+    message: str = ""
+    status_code: int | None = None
+    # per-item outcome of the jobs handling several items
+    results: list[dict] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (JobState.DONE, JobState.FAILED)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "state": self.state.value,
+            "step": self.step,
+            "message": self.message,
+            "status_code": self.status_code,
+            "results": self.results,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+JobHandler = Callable[[Job], Awaitable[str]]
+
+
+class JobPool:
+    """
+    Runs jobs on the background loop with bounded concurrency.
+    Handlers return a message on success and raise `JobError` on failure.
+    """
+
+    def __init__(
+        self,
+        background: BackgroundLoop,
+        max_workers: int = JOB_WORKERS,
+        max_pending: int = JOB_QUEUE_SIZE,
+        ttl_s: float = JOB_TTL_S,
+    ):
+        self._background = background
+        self._max_pending = max_pending
+        self._ttl_s = ttl_s
+        self._semaphore = LoopSemaphore(max_workers)
+        self._lock = threading.Lock()
+        self._jobs: dict[str, Job] = {}
+        self._listeners: list[Callable[[Job], None]] = []
+
+    def subscribe(self, listener: Callable[[Job], None]):
+        """
+        Register a callback invoked whenever a job changes state.
+        """
+        self._listeners.append(listener)
+
+    def submit(
+        self, owner: str, handler: JobHandler, params: dict[str, Any]
+    ) -> Job | None:
+        """
+        Queue a job, returns None if too many jobs are pending.
+        """
+        with self._lock:
+            self.__prune()
+            pending = sum(1 for job in self._jobs.values() if not job.finished)
+            if pending >= self._max_pending:
+                logger.warning(f"Job queue is full, rejecting job from {owner}")
+                return None
+            job = Job(id=uuid.uuid4().hex, owner=owner, params=params)
+            self._jobs[job.id] = job
+
+        # the submitting request usually finishes before the job starts
+        parent = profiling.current_trace()
+        self._background.submit(self.__run(job, handler, parent))
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def pending(self, owner: str) -> list[Job]:
+        with self._lock:
+            return [
+                job
+                for job in self._jobs.values()
+                if job.owner == owner and not job.finished
+            ]
+
+    def update(self, job: Job, **changes):
+        for name, value in changes.items():
+            setattr(job, name, value)
+        job.updated_at = time.time()
+        for listener in self._listeners:
+            try:
+                listener(job)
+            except Exception as e:
+                logger.exception(f"Job listener failed: {e}")
+
+    async def __run(
+        self, job: Job, handler: JobHandler, parent: profiling.Trace | None
+    ):
+        # a job submitted by a profiled request is profiled too
+        trace = profiling.start_trace(
+            f"job {getattr(handler, '__name__', 'job')}", parent=parent
+        )
+        try:
+            await self.__run_handler(job, handler)
+        finally:
+            if trace is not None:
+                profiling.finish_trace(
+                    trace, job=job.id, state=job.state.value, step=job.step
+                )
+
+    async def __run_handler(self, job: Job, handler: JobHandler):
+        async with self._semaphore.get():
+            self.update(job, state=JobState.RUNNING)
+            try:
+                message = await handler(job)
+                self.update(job, state=JobState.DONE, message=message, status_code=201)
+            except JobError as e:
+                self.update(
+                    job,
+                    state=JobState.FAILED,
+                    message=e.message,
+                    status_code=e.status_code,
+                )
+            except Exception as e:
+                logger.exception(f"Job {job.id} failed: {e}")
+                self.update(
+                    job,
+                    state=JobState.FAILED,
+                    message="Internal error",
+                    status_code=500,
+                )
+
+    def __prune(self):
+        deadline = time.time() - self._ttl_s
+        expired = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.finished and job.updated_at < deadline
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -0,0 +1,96 @@
+"""
+Logging off the request path: loggers only put their records on a bounded queue,
+a listener thread formats them and writes them to the actual handlers.
+"""
+
+import os
+import json
+import queue
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Never blocks the caller: records are dropped and counted when the queue is full.
+    """
+
+    def __init__(self, maxsize: int):
+        super().__init__(queue.Queue(maxsize))
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+    @property
+    def dropped(self) -> int:
+        return self._dropped
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # unlike the base class, the message is formatted by the listener thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+
+
+class Listener(QueueListener):
+    def enqueue_sentinel(self):
+        # the queue may be full when stopping, wait for the thread to make room
+        self.queue.put(self._sentinel)
+
+    def restart_after_fork(self, queue_handler: DroppingQueueHandler):
+        """
+        Only the forking thread survives a fork, so the child needs a new listener thread,
+        and a new queue since the copied one may be locked by a thread that is gone.
+        """
+        queue_handler.queue = self.queue = queue.Queue(queue_handler.queue.maxsize)
+        queue_handler._lock = threading.Lock()
+        self._thread = None
+        self.start()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, for log shippers.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+def install(loggers: list[logging.Logger], maxsize: int) -> tuple[DroppingQueueHandler, Listener]:
+    """
+    Move the handlers of `loggers` behind a single queue and start its listener.
+    """
+    handlers: list[logging.Handler] = []
+    for logger in loggers:
+        for handler in logger.handlers:
+            if handler not in handlers:
+                handlers.append(handler)
+
+    queue_handler = DroppingQueueHandler(maxsize)
+    for logger in loggers:
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        logger.addHandler(queue_handler)
+
+    listener = Listener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # e.g. the workers of gunicorn --preload
+    os.register_at_fork(after_in_child=lambda: listener.restart_after_fork(queue_handler))
+    return queue_handler, listener
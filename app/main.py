@@ -1,30 +1,122 @@
 import os
+import asyncio
 import logging
 import atexit
+import functools
 
 from flask import Flask
-from .extensions import g_db, g_limiter
+from jinja2 import FileSystemBytecodeCache
+from .extensions import g_db, g_limiter, g_background, g_reconciler
 from .routes import main_bp
+import app.assets as assets
+import app.compression as compression
+import app.metrics as metrics
+import app.profiling as profiling
+import app.jackett as jackett
 
-def init_app():
-    app = Flask(__name__)
+# compiled templates are cached here across restarts and workers, empty to disable
+JINJA_CACHE_DIR = os.getenv("MOVIE_REQUEST_SERVER_JINJA_CACHE_DIR", "_cache/jinja")
+
+
+class MovieRequestApp(Flask):
+    """
+    Flask runs every async view on a fresh event loop by default.
+    When `event_loop` is set, async views run on that loop instead,
+    so that they can share long-lived resources with the background jobs.
+    """
+
+    event_loop: asyncio.AbstractEventLoop | None = None
+    # process that started the per-worker resources, see `init_worker`
+    worker_pid: int | None = None
+
+    def async_to_sync(self, func):
+        loop = self.event_loop
+        if loop is None:
+            return super().async_to_sync(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # must be called from a thread other than the loop's, the request context is carried over
+            return asyncio.run_coroutine_threadsafe(
+                func(*args, **kwargs), loop
+            ).result()
+
+        return wrapper
+
+
+def warm_up(app: MovieRequestApp):
+    """
+    Load what every worker would otherwise load on its first requests,
+    so that workers forked from a preloaded app share it.
+    """
+    # guessit builds its rule tables on the first guess
+    jackett.guess_metadata("Warm.Up.2000.1080p.BluRay.x264-GROUP")
+    for name in app.jinja_env.list_templates(filter_func=lambda n: n.endswith(".html")):
+        app.jinja_env.get_template(name)
+
+
+def create_app() -> MovieRequestApp:
+    """
+    Build the app without starting anything, so that it can be built once and forked,
+    e.g. `gunicorn --preload 'app.main:create_app()'`.
+    Each worker then starts its own resources with `init_worker`.
+    """
+    app = MovieRequestApp(__name__)
+    if JINJA_CACHE_DIR:
+        os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+        app.jinja_options = {
+            **app.jinja_options,
+            "bytecode_cache": FileSystemBytecodeCache(JINJA_CACHE_DIR),
+        }
     app.secret_key = os.getenv("MOVIE_REQUEST_SERVER_SECRET")
     app.register_blueprint(main_bp)
+    metrics.init_app(app, main_bp.name)
+    profiling.init_app(app, main_bp.name)
+    assets.init_app(app)
+    compression.init_app(app)
 
     if os.getenv("MOVIE_REQUEST_SERVER_CLEAR_DB_ON_STARTUP", "false").lower() == "true":
         g_db.drop()
-    g_db.connect()
+        # every torrent of the category is an orphan now
+        g_reconciler.keep_orphans("the database was cleared on startup")
     g_limiter.init_app(app)
+    warm_up(app)
+    return app
+
+
+def init_worker(app: MovieRequestApp):
+    """
+    Start the resources that can't be shared across forks: the background loop
+    with its jobs and threads. Once per process.
+    """
+    if app.worker_pid == os.getpid():
+        return
+    app.worker_pid = os.getpid()
+    g_db.connect()
     atexit.register(lambda: g_db.close())
+    g_background.start()
+    atexit.register(g_background.stop)
+
+
+def init_app():
+    app = create_app()
+    init_worker(app)
     return app
 
-g_app = init_app()
+
+def __getattr__(name: str):
+    # built on first use, so that importing this module starts nothing
+    if name == "g_app":
+        global g_app
+        g_app = init_app()
+        return g_app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 logger = logging.getLogger(__package__)
 
 if __name__ == "__main__":
-    g_app.run(
+    init_app().run(
         debug=True,
         host="0.0.0.0",
         port=int(os.getenv("MOVIE_REQUEST_SERVER_PORT", 5000)),
@@ -0,0 +1,284 @@
+import math
+import time
+import logging
+import threading
+import contextlib
+from abc import ABC, abstractmethod
+from typing import Callable, TypeVar
+
+import httpx
+from flask import Flask, g, request
+
+import app.profiling as profiling
+from app import g_log_queue_handler
+
+logger = logging.getLogger(__name__)
+
+# in seconds, libtorrent metadata resolution can take up to a minute
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class IMetric(ABC):
+    """
+    A metric in the Prometheus text exposition format.
+    Metrics are process-local, each worker process exposes its own values.
+    """
+
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def _samples(self) -> list[tuple[str, dict[str, str], float]]:
+        """
+        (sample name, labels, value) of every sample of the metric.
+        """
+        ...
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for name, labels, value in self._samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(IMetric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            return [
+                (self.name, dict(zip(self.labelnames, key)), value)
+                for key, value in self._values.items()
+            ]
+
+
+class Gauge(IMetric):
+    """
+    Either set explicitly, or computed by `fn` every time the metrics are scraped.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float] | None = None):
+        super().__init__(name, help)
+        self._fn = fn
+        self._value = 0.0
+
+    def set(self, value: float):
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def _samples(self):
+        if self._fn is None:
+            with self._lock:
+                return [(self.name, {}, self._value)]
+        try:
+            return [(self.name, {}, float(self._fn()))]
+        except Exception as e:
+            logger.error(f"Failed to compute gauge {self.name}: {e}")
+            return []
+
+
+class Histogram(IMetric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # label values -> (per bucket counts, sum)
+        self._values: dict[tuple[str, ...], tuple[list[int], float]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def _samples(self):
+        ret = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                labels = dict(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    le = "+Inf" if math.isinf(bound) else _format_value(bound)
+                    ret.append((f"{self.name}_bucket", {**labels, "le": le}, cumulative))
+                ret.append((f"{self.name}_sum", labels, total))
+                ret.append((f"{self.name}_count", labels, cumulative))
+        return ret
+
+
+g_metrics: list[IMetric] = []
+
+MetricT = TypeVar("MetricT", bound=IMetric)
+
+
+def register(metric: MetricT) -> MetricT:
+    g_metrics.append(metric)
+    return metric
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in g_metrics) + "\n"
+
+
+HTTP_REQUEST_DURATION = register(
+    Histogram(
+        "movie_request_http_request_duration_seconds",
+        "Time spent handling a request, until the response (or its first chunk) is ready.",
+        ("endpoint", "method", "status"),
+    )
+)
+HTTP_REQUESTS_IN_FLIGHT = register(
+    Gauge("movie_request_http_requests_in_flight", "Requests currently being handled.")
+)
+UPSTREAM_DURATION = register(
+    Histogram(
+        "movie_request_upstream_duration_seconds",
+        "Time spent calling an upstream service.",
+        ("upstream", "operation"),
+    )
+)
+UPSTREAM_ERRORS = register(
+    Counter(
+        "movie_request_upstream_errors_total",
+        "Failed upstream calls: transport errors, 5xx responses or timeouts.",
+        ("upstream", "operation"),
+    )
+)
+if g_log_queue_handler is not None:
+    register(
+        Gauge(
+            "movie_request_log_records_dropped",
+            "Log records dropped because the logging queue was full, since the start.",
+            fn=lambda: g_log_queue_handler.dropped,
+        )
+    )
+
+
+@contextlib.contextmanager
+def track_upstream(upstream: str, operation: str):
+    """
+    Time an upstream call, exceptions are counted as errors.
+    The call is also recorded as a span of the current trace, see profiling.py.
+    """
+    start = time.perf_counter()
+    try:
+        with profiling.span(f"{upstream} {operation}"):
+            yield
+    except BaseException:
+        UPSTREAM_ERRORS.inc(upstream=upstream, operation=operation)
+        raise
+    finally:
+        UPSTREAM_DURATION.observe(
+            time.perf_counter() - start, upstream=upstream, operation=operation
+        )
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport recording the latency and errors of every call to an upstream,
+    the operation is the request path unless given.
+    """
+
+    def __init__(self, upstream: str, operation: str | None = None, **kwargs):
+        self.upstream = upstream
+        self.operation = operation
+        self._transport = httpx.AsyncHTTPTransport(**kwargs)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        operation = self.operation or request.url.path
+        with track_upstream(self.upstream, operation):
+            response = await self._transport.handle_async_request(request)
+        if response.status_code >= 500:
+            UPSTREAM_ERRORS.inc(upstream=self.upstream, operation=operation)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def init_app(app: Flask, blueprint: str):
+    """
+    Record the latency of the requests handled by `blueprint`.
+    """
+
+    @app.before_request
+    def _start_timer():
+        if request.blueprint != blueprint:
+            return
+        g.metrics_start = time.perf_counter()
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+
+    @app.teardown_request
+    def _stop_timer(error: BaseException | None = None):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return
+        HTTP_REQUESTS_IN_FLIGHT.dec()
+        status = g.pop("metrics_status", 500 if error is not None else 200)
+        HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - start,
+            endpoint=request.endpoint or "",
+            method=request.method,
+            status=str(status),
+        )
+
+    @app.after_request
+    def _record_status(response):
+        if "metrics_start" in g:
+            g.metrics_status = response.status_code
+        return response
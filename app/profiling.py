@@ -0,0 +1,299 @@
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import logging
+import pathlib
+import threading
+import contextlib
+import contextvars
+from dataclasses import dataclass, field
+from typing import Any
+
+from flask import Flask, Response, g, request
+
+from app import g_log_file_name
+
+logger = logging.getLogger(__name__)
+
+# requests with `X-Profile: <token>` are profiled, empty disables the header
+PROFILE_TOKEN = os.getenv("MOVIE_REQUEST_SERVER_PROFILE_TOKEN", "")
+PROFILE_HEADER = "X-Profile"
+# with a valid X-Profile header, also sample the stacks of the request while it runs
+PROFILE_STACKS_HEADER = "X-Profile-Stacks"
+# fraction of the requests profiled without the header
+PROFILE_SAMPLE_RATE = float(os.getenv("MOVIE_REQUEST_SERVER_PROFILE_SAMPLE_RATE", 0))
+# requests and jobs taking longer than this are dumped, 0 disables
+SLOW_REQUEST_S = float(os.getenv("MOVIE_REQUEST_SERVER_SLOW_REQUEST_S", 10))
+PROFILE_DIR = pathlib.Path(
+    os.getenv(
+        "MOVIE_REQUEST_SERVER_PROFILE_DIR",
+        os.path.join(os.path.dirname(g_log_file_name), "profiles"),
+    )
+)
+# oldest dumps are deleted beyond this
+PROFILE_MAX_FILES = 200
+STACK_SAMPLE_INTERVAL_S = 0.005
+# besides the request's own thread, async views and jobs run on the background loop
+SAMPLED_THREAD_NAMES = ("background",)
+
+
+@dataclass
+class Span:
+    name: str
+    # relative to the start of the trace
+    start_s: float
+    duration_s: float
+    thread: str
+    error: str | None = None
+    attrs: dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "start_ms": round(self.start_s * 1000, 3),
+            "duration_ms": round(self.duration_s * 1000, 3),
+            "thread": self.thread,
+            "error": self.error,
+            **({"attrs": self.attrs} if self.attrs else {}),
+        }
+
+
+class StackSampler:
+    """
+    Statistical profiler: samples the stacks of some threads at a fixed interval
+    and counts them in the folded format of flamegraph.pl.
+    """
+
+    def __init__(self, thread_ids: set[int], interval_s: float = STACK_SAMPLE_INTERVAL_S):
+        self.thread_ids = thread_ids
+        self.interval_s = interval_s
+        self.counts: dict[str, int] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.__run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self) -> str:
+        return "\n".join(
+            f"{stack} {count}"
+            for stack, count in sorted(self.counts.items(), key=lambda item: -item[1])
+        )
+
+    def __run(self):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        while not self._stop.wait(self.interval_s):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id not in self.thread_ids:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack = ";".join([names.get(thread_id, str(thread_id))] + frames[::-1])
+                self.counts[stack] = self.counts.get(stack, 0) + 1
+
+
+@dataclass(eq=False)
+class Trace:
+    name: str
+    # why the trace is dumped regardless of its duration: header, sampled or empty
+    reason: str = ""
+    id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    parent_id: str | None = None
+    started_at: float = field(default_factory=time.time)
+    start: float = field(default_factory=time.perf_counter)
+    duration_s: float | None = None
+    spans: list[Span] = field(default_factory=list)
+    info: dict[str, Any] = field(default_factory=dict)
+    sampler: StackSampler | None = None
+
+    @property
+    def finished(self) -> bool:
+        return self.duration_s is not None
+
+    def totals(self) -> dict[str, dict]:
+        """
+        Time spent per span name, e.g. all the guessit calls of a search.
+        """
+        ret: dict[str, dict] = {}
+        for span in self.spans:
+            total = ret.setdefault(span.name, {"count": 0, "total_ms": 0.0})
+            total["count"] += 1
+            total["total_ms"] = round(total["total_ms"] + span.duration_s * 1000, 3)
+        return ret
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "reason": self.reason,
+            "started_at": self.started_at,
+            "duration_ms": None if self.duration_s is None else round(self.duration_s * 1000, 3),
+            **self.info,
+            "totals": self.totals(),
+            "spans": [span.to_dict() for span in self.spans],
+        }
+
+
+# shared by reference with the tasks and threads the trace's context is copied to
+g_current_trace: contextvars.ContextVar[Trace | None] = contextvars.ContextVar(
+    "movie_request_trace", default=None
+)
+
+
+def current_trace() -> Trace | None:
+    trace = g_current_trace.get()
+    return None if trace is None or trace.finished else trace
+
+
+@contextlib.contextmanager
+def span(name: str, **attrs):
+    """
+    Record a span in the current trace, does nothing outside of a trace.
+    """
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        trace.spans.append(
+            Span(
+                name=name,
+                start_s=start - trace.start,
+                duration_s=time.perf_counter() - start,
+                thread=threading.current_thread().name,
+                error=error,
+                attrs=attrs,
+            )
+        )
+
+
+def start_trace(
+    name: str,
+    reason: str = "",
+    sample_stacks: bool = False,
+    parent: Trace | None = None,
+) -> Trace | None:
+    """
+    Start a trace in the current context, None if it wouldn't be dumped anyway.
+    The trace inherits the reason of its parent, the current trace by default.
+    """
+    parent = parent or current_trace()
+    if not reason and parent is not None:
+        reason = parent.reason
+    if not reason and SLOW_REQUEST_S <= 0:
+        g_current_trace.set(None)
+        return None
+    trace = Trace(name, reason, parent_id=None if parent is None else parent.id)
+    if sample_stacks:
+        thread_ids = {threading.get_ident()} | {
+            t.ident for t in threading.enumerate() if t.name in SAMPLED_THREAD_NAMES and t.ident
+        }
+        trace.sampler = StackSampler(thread_ids)
+        trace.sampler.start()
+    g_current_trace.set(trace)
+    return trace
+
+
+def finish_trace(trace: Trace, **info):
+    if trace.finished:
+        return
+    trace.duration_s = time.perf_counter() - trace.start
+    trace.info.update(info)
+    if trace.sampler is not None:
+        trace.sampler.stop()
+    if g_current_trace.get() is trace:
+        g_current_trace.set(None)
+
+    slow = SLOW_REQUEST_S > 0 and trace.duration_s >= SLOW_REQUEST_S
+    if slow:
+        logger.warning(f"Slow {trace.name} took {trace.duration_s:.2f} s, see trace {trace.id}")
+    if slow or trace.reason:
+        dump(trace, "slow" if slow and not trace.reason else trace.reason)
+
+
+def dump(trace: Trace, reason: str):
+    try:
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        stem = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(trace.started_at))}-{trace.id}"
+        (PROFILE_DIR / f"{stem}.json").write_text(
+            json.dumps({**trace.to_dict(), "reason": reason}, indent=2, default=str)
+        )
+        if trace.sampler is not None:
+            (PROFILE_DIR / f"{stem}.folded").write_text(trace.sampler.folded())
+
+        dumps = sorted(PROFILE_DIR.iterdir())
+        for path in dumps[: max(0, len(dumps) - PROFILE_MAX_FILES)]:
+            path.unlink(missing_ok=True)
+    except Exception as e:
+        logger.error(f"Failed to dump trace {trace.id}: {e}")
+
+
+def server_timing(trace: Trace) -> str:
+    """
+    Server-Timing header with the time per span name, shown by the browser dev tools.
+    """
+    return ", ".join(
+        f'{i};desc="{name}";dur={total["total_ms"]}'
+        for i, (name, total) in enumerate(trace.totals().items())
+    )
+
+
+def init_app(app: Flask, blueprint: str):
+    """
+    Trace the requests handled by `blueprint`.
+    """
+
+    @app.before_request
+    def _start_trace():
+        if request.blueprint != blueprint:
+            return
+        reason = ""
+        if PROFILE_TOKEN and request.headers.get(PROFILE_HEADER) == PROFILE_TOKEN:
+            reason = "header"
+        elif PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            reason = "sampled"
+        g.profile_trace = start_trace(
+            f"{request.method} {request.path}",
+            reason,
+            sample_stacks=reason == "header" and bool(request.headers.get(PROFILE_STACKS_HEADER)),
+        )
+
+    @app.after_request
+    def _finish_trace(response: Response) -> Response:
+        trace: Trace | None = g.pop("profile_trace", None)
+        if trace is None:
+            return response
+        if trace.reason == "header":
+            response.headers["X-Profile-Id"] = trace.id
+            response.headers["Server-Timing"] = server_timing(trace)
+        info = {
+            "endpoint": request.endpoint,
+            "method": request.method,
+            "path": request.full_path,
+            "status": response.status_code,
+        }
+        if response.mimetype == "text/event-stream":
+            # open for minutes by design, only the time until the stream starts is measured
+            finish_trace(trace, **info)
+        else:
+            # streamed bodies are rendered after this, the trace ends once they are sent
+            response.call_on_close(lambda: finish_trace(trace, **info))
+        return response
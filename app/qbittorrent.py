@@ -3,7 +3,11 @@ import os
 import logging
 import contextlib
 import enum
+import json
+import collections
+import threading
 import asyncio
+import time
 import pathlib
 import tempfile
 from typing import Any
@@ -12,6 +16,9 @@ from requests_toolbelt.multipart.encoder import MultipartEncoder
 
 from typing import TypedDict
 
+import app.metrics as metrics
+from app.background import LoopSemaphore
+
 logger = logging.getLogger(__name__)
 
 # libtorrent requires the following sys-level deps on windows
@@ -39,8 +46,21 @@ QBITTORRENT_CATEGORY = os.getenv("QBITTORRENT_CATEGORY", "")
 logger.info(f"libtorrent version: {lt.version}")  # type: ignore
 logger.info(f"QBITTORRENT_URL: {QBITTORRENT_URL}")
 
-# this might still not work correctly on windows
-g_lt_session = lt.session({"listen_interfaces": "0.0.0.0:6881"})  # type: ignore
+# created on first use by each process, a session owns sockets and threads
+# that must not be shared by forked workers
+g_lt_session = None
+g_lt_session_pid: int | None = None
+g_lt_session_lock = threading.Lock()
+
+
+def get_lt_session():
+    global g_lt_session, g_lt_session_pid
+    with g_lt_session_lock:
+        if g_lt_session is None or g_lt_session_pid != os.getpid():
+            # this might still not work correctly on windows
+            g_lt_session = lt.session({"listen_interfaces": "0.0.0.0:6881"})  # type: ignore
+            g_lt_session_pid = os.getpid()
+        return g_lt_session
 
 
 @contextlib.asynccontextmanager
@@ -52,25 +72,29 @@ async def tmp_torrent_session(magnet_link: str, timeout_s: float = 15):
     info = lt.parse_magnet_uri(magnet_link)  # type: ignore
     info.save_path = tempfile.gettempdir()
 
+    session = get_lt_session()
     handle = None
     try:
-        handle = g_lt_session.add_torrent(info)
+        handle = session.add_torrent(info)
         timer = 0
         ret = None
-        while (ret := handle.torrent_file()) is None and timer < timeout_s:
-            await asyncio.sleep(1)
-            timer += 1
+        with metrics.track_upstream("libtorrent", "metadata"):
+            while (ret := handle.torrent_file()) is None and timer < timeout_s:
+                await asyncio.sleep(1)
+                timer += 1
         if ret is None:
+            metrics.UPSTREAM_ERRORS.inc(upstream="libtorrent", operation="metadata")
             logger.error(f"Failed to get metadata for magnet link: {magnet_link}")
         yield ret
     finally:
         if handle:
-            g_lt_session.remove_torrent(handle)
+            session.remove_torrent(handle)
 
 
 @contextlib.asynccontextmanager
 async def async_client():
     async with httpx.AsyncClient(
+        transport=metrics.InstrumentedTransport("qbittorrent"),
         base_url=QBITTORRENT_URL,
         headers={
             "Content-Type": "application/json",
@@ -170,24 +194,58 @@ async def get_torrent_list(
     filter: GetTorrentListFilter = GetTorrentListFilter.ALL,
     hashes: list[str] | None = None,
     category: str | None = None,
+    tag: str | None = None,
 ) -> list[TorrentInfo] | None:
     try:
         async with async_client() as client:
-            params = {"filter": str(filter)}
+            params = {"filter": filter.value}
             if hashes:
                 params["hashes"] = "|".join(hashes)
             if category:
                 params["category"] = category
+            if tag:
+                params["tag"] = tag
             response = await client.get("/torrents/info", params=params)
             if response.status_code != 200:
                 logger.error(f"Error fetching torrent list: {response.status_code}")
                 return None
-            return response.json()
+            torrents: list[TorrentInfo] = response.json()
+            now = time.monotonic()
+            for torrent in torrents:
+                g_torrent_cache[torrent["hash"]] = (now, torrent)
+            if filter == GetTorrentListFilter.ALL and not category and not tag:
+                # the torrents missing from the list were deleted
+                fetched = {torrent["hash"] for torrent in torrents}
+                for infohash in set(hashes or g_torrent_cache) - fetched:
+                    g_torrent_cache.pop(infohash, None)
+            return torrents
     except Exception as e:
         logger.error(f"Error fetching torrent list: {e}")
         return None
 
 
+# the latest known state of every torrent fetched by get_torrent_list
+# hash -> (fetch time, info)
+g_torrent_cache: dict[str, tuple[float, TorrentInfo]] = {}
+
+
+async def get_cached_torrent_list(
+    hashes: list[str], max_age_s: float = 2
+) -> list[TorrentInfo] | None:
+    """
+    Same as get_torrent_list, but serves the torrents from the cache
+    if all of them were fetched less than `max_age_s` ago.
+    """
+    now = time.monotonic()
+    ret = []
+    for infohash in hashes:
+        cached = g_torrent_cache.get(infohash)
+        if cached is None or now - cached[0] > max_age_s:
+            return await get_torrent_list(hashes=hashes)
+        ret.append(cached[1])
+    return ret
+
+
 async def add_torrent(
     *,
     torrent_links: str | list[str],
@@ -210,14 +268,59 @@ async def add_torrent(
             logger.info(f"Torrents already added: {torrent_hashes}")
             return True
 
+    fields = {
+        "urls": "\n".join(torrent_hashes),
+        "savepath": save_path,
+        **kwargs,
+    }
+    return await _post_add(list(fields.items()), torrent_links)
+
+
+async def add_torrents(
+    *,
+    torrent_hashes: list[str],
+    save_path: str,
+    torrent_files: dict[str, bytes] | None = None,
+    **kwargs: dict[str, Any],
+) -> bool:
+    """
+    Add already resolved torrents in a single call, the ones already added are skipped.
+    :param torrent_files: hash -> content of the torrent file, uploaded instead of
+    adding the torrent by hash so that qbittorrent doesn't fetch the metadata again
+    """
+    torrent_files = torrent_files or {}
+    existing = await get_torrent_list(hashes=torrent_hashes)
+    if existing is None:
+        return False
+    existing_hashes = {torrent["hash"].lower() for torrent in existing}
+    torrent_hashes = [h for h in torrent_hashes if h.lower() not in existing_hashes]
+    if not torrent_hashes:
+        logger.info(f"Torrents already added: {sorted(existing_hashes)}")
+        return True
+
+    fields: list[tuple[str, Any]] = [("savepath", save_path), *kwargs.items()]
+    urls = [h for h in torrent_hashes if h not in torrent_files]
+    if urls:
+        fields.append(("urls", "\n".join(urls)))
+    for infohash in torrent_hashes:
+        if infohash in torrent_files:
+            fields.append(
+                (
+                    "torrents",
+                    (
+                        f"{infohash}.torrent",
+                        torrent_files[infohash],
+                        "application/x-bittorrent",
+                    ),
+                )
+            )
+    return await _post_add(fields, torrent_hashes)
+
+
+async def _post_add(fields: list[tuple[str, Any]], torrents: list[str]) -> bool:
     try:
-        fields = {
-            "urls": "\n".join(torrent_hashes),
-            "savepath": save_path,
-            **kwargs,
-        }
         if QBITTORRENT_CATEGORY:
-            fields["category"] = QBITTORRENT_CATEGORY
+            fields = [*fields, ("category", QBITTORRENT_CATEGORY)]
 
         encoder = MultipartEncoder(fields=fields)
         body = encoder.to_string()
@@ -232,13 +335,13 @@ async def add_torrent(
             )
             if response.status_code != 200 and "fail" not in response.text.lower():
                 logger.error(
-                    f"Error adding torrents {torrent_links}: {response.status_code} {response.text}"
+                    f"Error adding torrents {torrents}: {response.status_code} {response.text}"
                 )
                 return False
-            logger.info(f"Torrents {torrent_links} added successfully: {response.text}")
+            logger.info(f"Torrents {torrents} added successfully: {response.text}")
             return True
     except Exception as e:
-        logger.error(f"Error adding torrents {torrent_links}: {e}")
+        logger.error(f"Error adding torrents {torrents}: {e}")
         return False
 
 
@@ -294,6 +397,146 @@ async def delete_torrent(
         return False
 
 
+async def _torrents_action(
+    endpoints: tuple[str, ...],
+    torrent_hashes: list[str] | str,
+    **fields: str,
+) -> bool:
+    """
+    Post a form to a /torrents/<endpoint> API that takes a list of hashes.
+    Endpoints are tried in order while qbittorrent reports them as missing (404),
+    because some APIs got renamed across qbittorrent versions.
+    """
+    if isinstance(torrent_hashes, str):
+        torrent_hashes = [torrent_hashes]
+    if not torrent_hashes:
+        logger.error(f"No torrent hashes provided for {endpoints[0]}")
+        return False
+
+    try:
+        async with async_client() as client:
+            for endpoint in endpoints:
+                response = await client.post(
+                    f"/torrents/{endpoint}",
+                    data={"hashes": "|".join(torrent_hashes), **fields},
+                    headers={
+                        "Content-Type": "application/x-www-form-urlencoded",
+                    },
+                )
+                if response.status_code == 404:
+                    continue
+                if response.status_code != 200:
+                    logger.error(
+                        f"Error calling {endpoint} on torrents {torrent_hashes}: {response.status_code} {response.text}"
+                    )
+                    return False
+                return True
+            logger.error(f"qBittorrent does not support any of {endpoints}")
+            return False
+    except Exception as e:
+        logger.error(f"Error calling {endpoints[0]} on torrents {torrent_hashes}: {e}")
+        return False
+
+
+async def pause_torrents(torrent_hashes: list[str] | str) -> bool:
+    # qbittorrent 5 renamed pause/resume to stop/start
+    return await _torrents_action(("pause", "stop"), torrent_hashes)
+
+
+async def resume_torrents(torrent_hashes: list[str] | str) -> bool:
+    return await _torrents_action(("resume", "start"), torrent_hashes)
+
+
+async def set_download_limit(torrent_hashes: list[str] | str, limit: int) -> bool:
+    """
+    :param limit: download limit in bytes/s, 0 means unlimited
+    """
+    return await _torrents_action(
+        ("setDownloadLimit",), torrent_hashes, limit=str(limit)
+    )
+
+
+def has_tag(torrent: TorrentInfo, tag: str) -> bool:
+    return tag in (t.strip() for t in torrent.get("tags", "").split(","))
+
+
+async def add_tags(torrent_hashes: list[str] | str, tags: str) -> bool:
+    """
+    :param tags: comma separated, created if missing
+    """
+    return await _torrents_action(("addTags",), torrent_hashes, tags=tags)
+
+
+async def remove_tags(torrent_hashes: list[str] | str, tags: str) -> bool:
+    return await _torrents_action(("removeTags",), torrent_hashes, tags=tags)
+
+
+async def top_priority(torrent_hashes: list[str] | str) -> bool:
+    """
+    Move the torrents to the top of the download queue, keeping their relative order.
+    qbittorrent answers 409 when queueing is disabled.
+    """
+    return await _torrents_action(("topPrio",), torrent_hashes)
+
+
+async def set_share_limits(
+    torrent_hashes: list[str] | str, ratio_limit: float, seeding_time_limit_min: int
+) -> bool:
+    """
+    qbittorrent stops seeding the torrents once either limit is reached, -2 means
+    qbittorrent's global limit and -1 no limit.
+    """
+    return await _torrents_action(
+        ("setShareLimits",),
+        torrent_hashes,
+        ratioLimit=str(ratio_limit),
+        seedingTimeLimit=str(seeding_time_limit_min),
+        # required since qbittorrent 4.6, ignored before
+        inactiveSeedingTimeLimit="-2",
+    )
+
+
+async def get_preferences() -> dict | None:
+    try:
+        async with async_client() as client:
+            response = await client.get("/app/preferences")
+            if response.status_code != 200:
+                logger.error(f"Error fetching preferences: {response.status_code}")
+                return None
+            return response.json()
+    except Exception as e:
+        logger.error(f"Error fetching preferences: {e}")
+        return None
+
+
+async def set_preferences(preferences: dict) -> bool:
+    try:
+        async with async_client() as client:
+            response = await client.post(
+                "/app/setPreferences",
+                data={"json": json.dumps(preferences)},
+                headers={
+                    "Content-Type": "application/x-www-form-urlencoded",
+                },
+            )
+            if response.status_code != 200:
+                logger.error(
+                    f"Error setting preferences {preferences}: {response.status_code} {response.text}"
+                )
+                return False
+            return True
+    except Exception as e:
+        logger.error(f"Error setting preferences {preferences}: {e}")
+        return False
+
+
+async def set_location(torrent_hashes: list[str] | str, location: str) -> bool:
+    """
+    Move the torrents' files to a new save path, qbittorrent performs the move in the background.
+    """
+    return await _torrents_action(("setLocation",), torrent_hashes, location=location)
+
+
 @dataclass(frozen=True)
 class BasicTorrentInfo:
     title: str
@@ -318,9 +561,109 @@ class BasicTorrentInfo:
         )
 
 
+# parsed torrent files by link, filled by get_torrent_info and prefetch_torrent_info
+TORRENT_INFO_CACHE_TTL_S = float(
+    os.getenv("MOVIE_REQUEST_SERVER_TORRENT_INFO_CACHE_TTL_S", 600)
+)
+TORRENT_INFO_CACHE_SIZE = 1024
+# torrent files fetched at the same time by prefetch_torrent_info
+PREFETCH_CONCURRENCY = int(os.getenv("MOVIE_REQUEST_SERVER_PREFETCH_CONCURRENCY", 4))
+PREFETCH_TIMEOUT_S = 20
+
+# link -> (fetch time, info), least recently used first
+g_torrent_info_cache: collections.OrderedDict[str, tuple[float, BasicTorrentInfo]] = (
+    collections.OrderedDict()
+)
+# async views may run on their own loop in their own thread
+g_torrent_info_cache_lock = threading.Lock()
+# link -> prefetch in progress
+g_torrent_info_prefetches: dict[str, asyncio.Task] = {}
+g_prefetch_semaphore = LoopSemaphore(PREFETCH_CONCURRENCY)
+
+TORRENT_INFO_CACHE_REQUESTS = metrics.register(
+    metrics.Counter(
+        "movie_request_torrent_info_cache_total",
+        "Torrent file lookups by result: hit, prefetching (waited for a prefetch) or miss.",
+        ("result",),
+    )
+)
+
+
+def _is_torrent_file_link(link_or_content: str | bytes) -> bool:
+    return isinstance(link_or_content, str) and link_or_content.startswith(
+        ("http://", "https://")
+    )
+
+
+def _get_cached_torrent_info(link: str) -> BasicTorrentInfo | None:
+    with g_torrent_info_cache_lock:
+        cached = g_torrent_info_cache.get(link)
+        if cached is None:
+            return None
+        if time.monotonic() - cached[0] > TORRENT_INFO_CACHE_TTL_S:
+            del g_torrent_info_cache[link]
+            return None
+        g_torrent_info_cache.move_to_end(link)
+        return cached[1]
+
+
 async def get_torrent_info(
     link_or_content: str | bytes, timeout_s: float = 50
 ) -> BasicTorrentInfo | None:
+    if _is_torrent_file_link(link_or_content):
+        assert isinstance(link_or_content, str)
+        info = _get_cached_torrent_info(link_or_content)
+        if info is not None:
+            TORRENT_INFO_CACHE_REQUESTS.inc(result="hit")
+            return info
+        prefetch = g_torrent_info_prefetches.get(link_or_content)
+        # the task can only be awaited from its own loop
+        if prefetch is not None and prefetch.get_loop() is asyncio.get_running_loop():
+            TORRENT_INFO_CACHE_REQUESTS.inc(result="prefetching")
+            info = await asyncio.shield(prefetch)
+            if info is not None:
+                return info
+        TORRENT_INFO_CACHE_REQUESTS.inc(result="miss")
+    return await _fetch_torrent_info(link_or_content, timeout_s)
+
+
+async def prefetch_torrent_info(links: list[str]):
+    """
+    Fetch and parse torrent files in the background, so that requesting them later
+    doesn't wait for the indexer. At most PREFETCH_CONCURRENCY are fetched at once.
+    """
+    semaphore = g_prefetch_semaphore.get()
+
+    async def _prefetch(link: str) -> BasicTorrentInfo | None:
+        async with semaphore:
+            # a DHT session per link redirecting to a magnet is too much for a guess
+            return await _fetch_torrent_info(
+                link, PREFETCH_TIMEOUT_S, resolve_magnets=False
+            )
+
+    tasks = []
+    for link in links:
+        if (
+            not _is_torrent_file_link(link)
+            or link in g_torrent_info_prefetches
+            or _get_cached_torrent_info(link) is not None
+        ):
+            continue
+        task = asyncio.create_task(_prefetch(link))
+        g_torrent_info_prefetches[link] = task
+        task.add_done_callback(
+            lambda _, link=link: g_torrent_info_prefetches.pop(link, None)
+        )
+        tasks.append(task)
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _fetch_torrent_info(
+    link_or_content: str | bytes, timeout_s: float, resolve_magnets: bool = True
+) -> BasicTorrentInfo | None:
+    """
+    Without `resolve_magnets`, links redirecting to a magnet are not looked up on the DHT.
+    """
 
     async def _impl(
         link_or_content: str | bytes, source_link: str, timeout_s: float
@@ -356,6 +699,8 @@ async def get_torrent_info(
             except httpx.UnsupportedProtocol as e:
                 url = e.request.url
                 if url.scheme == "magnet":
+                    if not resolve_magnets:
+                        return None
                     new_url = "magnet:" + url.raw_path.decode().lstrip("/")
                     return await _impl(new_url, link_or_content, timeout_s)
                 logger.exception(f"Unsupported protocol: {url.scheme}")
@@ -364,11 +709,19 @@ async def get_torrent_info(
         logger.error(f"Invalid link or content: {link_or_content}")
         return None
 
-    return await _impl(
+    info = await _impl(
         link_or_content,
         link_or_content if isinstance(link_or_content, str) else "",
         timeout_s,
     )
+    if info is not None and _is_torrent_file_link(link_or_content):
+        assert isinstance(link_or_content, str)
+        with g_torrent_info_cache_lock:
+            g_torrent_info_cache[link_or_content] = (time.monotonic(), info)
+            g_torrent_info_cache.move_to_end(link_or_content)
+            while len(g_torrent_info_cache) > TORRENT_INFO_CACHE_SIZE:
+                g_torrent_info_cache.popitem(last=False)
+    return info
 
 
 async def get_torrent_hash(link_or_content: str | bytes, timeout_s: float = 50) -> str:
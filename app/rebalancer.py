@@ -0,0 +1,207 @@
+import os
+import time
+import shutil
+import asyncio
+import logging
+from dataclasses import dataclass
+
+import app.qbittorrent as qbittorrent
+import app.storage as storage
+
+logger = logging.getLogger(__name__)
+
+# 0 disables the periodic rebalancing, a plan can still be requested on demand
+REBALANCE_INTERVAL_S = float(os.getenv("MOVIE_REQUEST_SERVER_REBALANCE_INTERVAL_S", 0))
+# only log the plan instead of moving anything
+REBALANCE_DRY_RUN = (
+    os.getenv("MOVIE_REQUEST_SERVER_REBALANCE_DRY_RUN", "false").lower() == "true"
+)
+# max bytes moved per rebalancing run
+REBALANCE_BUDGET_BYTES = int(
+    float(os.getenv("MOVIE_REQUEST_SERVER_REBALANCE_BUDGET_GB", 100)) * 1024**3
+)
+# max number of torrents being moved by qbittorrent at the same time
+REBALANCE_MAX_CONCURRENT_MOVES = int(
+    os.getenv("MOVIE_REQUEST_SERVER_REBALANCE_MAX_CONCURRENT_MOVES", 1)
+)
+# don't bother if the free space ratio of the fullest and emptiest mount differ less than this
+REBALANCE_THRESHOLD = float(os.getenv("MOVIE_REQUEST_SERVER_REBALANCE_THRESHOLD", 0.1))
+# how often to poll qbittorrent while waiting for a free move slot
+REBALANCE_POLL_INTERVAL_S = 5
+
+
+@dataclass(frozen=True)
+class PlannedMove:
+    infohash: str
+    name: str
+    size: int
+    source: str
+    destination: str
+
+    def to_dict(self) -> dict:
+        return {
+            "infohash": self.infohash,
+            "name": self.name,
+            "size": self.size,
+            "source": self.source,
+            "destination": self.destination,
+        }
+
+
+def plan_moves(
+    torrents: list[qbittorrent.TorrentInfo],
+    usage: dict[storage.MountPoint, tuple[int, int]],
+    budget_bytes: int = REBALANCE_BUDGET_BYTES,
+    threshold: float = REBALANCE_THRESHOLD,
+) -> list[PlannedMove]:
+    """
+    Plan moves of completed torrents from the fullest to the emptiest mount point.
+    :param usage: (free bytes, total bytes) per mount point
+    """
+    free = {mount_point: usage[mount_point][0] for mount_point in usage}
+    total = {mount_point: usage[mount_point][1] for mount_point in usage}
+    if len(free) < 2:
+        return []
+
+    completed: dict[storage.MountPoint, list[qbittorrent.TorrentInfo]] = {
+        mount_point: [] for mount_point in free
+    }
+    for torrent in torrents:
+        if torrent.get("progress", 0) < 1 or torrent.get("state") in (
+            qbittorrent.TorrentState.MOVING,
+            qbittorrent.TorrentState.ERROR,
+            qbittorrent.TorrentState.MISSING_FILES,
+        ):
+            continue
+        mount_point = storage.find_mount_point(torrent.get("save_path", ""))
+        if mount_point in completed:
+            completed[mount_point].append(torrent)
+
+    def _free_ratio(mount_point: storage.MountPoint) -> float:
+        return free[mount_point] / total[mount_point] if total[mount_point] else 0
+
+    ret: list[PlannedMove] = []
+    while budget_bytes > 0:
+        fullest = min(free, key=_free_ratio)
+        emptiest = max(free, key=_free_ratio)
+        if _free_ratio(emptiest) - _free_ratio(fullest) < threshold:
+            break
+
+        # biggest torrent that fits the budget and doesn't make the destination the fuller one
+        pick = None
+        for torrent in sorted(
+            completed[fullest], key=lambda t: t.get("size", 0), reverse=True
+        ):
+            size = torrent.get("size", 0)
+            if size <= 0 or size > budget_bytes:
+                continue
+            src_ratio = (free[fullest] + size) / total[fullest]
+            dst_ratio = (free[emptiest] - size) / total[emptiest]
+            if dst_ratio >= src_ratio:
+                pick = torrent
+                break
+        if pick is None:
+            break
+
+        size = pick.get("size", 0)
+        completed[fullest].remove(pick)
+        free[fullest] += size
+        free[emptiest] -= size
+        budget_bytes -= size
+        ret.append(
+            PlannedMove(
+                infohash=pick["hash"],
+                name=pick.get("name", ""),
+                size=size,
+                source=pick.get("save_path", ""),
+                destination=storage.rebase_save_path(
+                    pick.get("save_path", ""), fullest, emptiest
+                ),
+            )
+        )
+    return ret
+
+
+def get_mount_usage() -> dict[storage.MountPoint, tuple[int, int]]:
+    ret = {}
+    for mount_point in storage.MOUNT_POINTS:
+        try:
+            usage = shutil.disk_usage(mount_point.movie_request_server_path)
+            ret[mount_point] = (usage.free, usage.total)
+        except FileNotFoundError:
+            continue  # skip if mount point is missing
+    return ret
+
+
+async def plan() -> list[PlannedMove] | None:
+    """
+    Compute a rebalancing plan without moving anything.
+    Returns None if qbittorrent cannot be reached.
+    """
+    torrents = await qbittorrent.get_torrent_list(
+        filter=qbittorrent.GetTorrentListFilter.COMPLETED,
+        category=qbittorrent.QBITTORRENT_CATEGORY or None,
+    )
+    if torrents is None:
+        return None
+    return plan_moves(torrents, get_mount_usage())
+
+
+async def _count_moving() -> int | None:
+    torrents = await qbittorrent.get_torrent_list(
+        category=qbittorrent.QBITTORRENT_CATEGORY or None,
+    )
+    if torrents is None:
+        return None
+    return sum(
+        1 for t in torrents if t.get("state") == qbittorrent.TorrentState.MOVING
+    )
+
+
+async def execute(moves: list[PlannedMove], timeout_s: float = 3600) -> list[str]:
+    """
+    Ask qbittorrent to move the torrents, keeping at most
+    `REBALANCE_MAX_CONCURRENT_MOVES` moves in flight.
+    Returns the infohashes of the torrents that were moved.
+    """
+    ret = []
+    deadline = time.monotonic() + timeout_s
+    for move in moves:
+        while True:
+            moving = await _count_moving()
+            if moving is not None and moving < REBALANCE_MAX_CONCURRENT_MOVES:
+                break
+            if time.monotonic() > deadline:
+                logger.warning(
+                    f"Rebalancer timed out waiting for a move slot, {len(moves) - len(ret)} moves left"
+                )
+                return ret
+            await asyncio.sleep(REBALANCE_POLL_INTERVAL_S)
+
+        logger.info(
+            f"Moving torrent {move.name} ({move.infohash}) from {move.source} to {move.destination}"
+        )
+        if await qbittorrent.set_location(move.infohash, move.destination):
+            ret.append(move.infohash)
+        # give qbittorrent a moment to report the torrent as moving
+        await asyncio.sleep(1)
+    return ret
+
+
+async def rebalance():
+    moves = await plan()
+    if not moves:
+        return
+    total = sum(move.size for move in moves)
+    logger.info(f"Rebalancing plan: {len(moves)} moves, {total} bytes")
+    if REBALANCE_DRY_RUN:
+        for move in moves:
+            logger.info(f"[dry-run] {move.to_dict()}")
+        return
+    await execute(moves)
+
+
+if __name__ == "__main__":
+    # print the current plan
+    for move in asyncio.run(plan()) or []:
+        print(move.to_dict())
@@ -0,0 +1,154 @@
+import os
+import time
+import logging
+from dataclasses import dataclass, field
+
+import app.db as db
+import app.qbittorrent as qbittorrent
+
+logger = logging.getLogger(__name__)
+
+# 0 disables the reconciliation
+RECONCILE_INTERVAL_S = float(os.getenv("MOVIE_REQUEST_SERVER_RECONCILE_INTERVAL_S", 3600))
+# what to do with the requests whose torrent is gone from qbittorrent: "report" or "remove"
+RECONCILE_DANGLING = os.getenv("MOVIE_REQUEST_SERVER_RECONCILE_DANGLING", "report").lower()
+# what to do with the torrents of the category nobody requested: "report" or "delete",
+# deleting also deletes their files and requires QBITTORRENT_CATEGORY.
+# never deletes after the database was cleared on startup, nor while it has no request
+RECONCILE_ORPHANS = os.getenv("MOVIE_REQUEST_SERVER_RECONCILE_ORPHANS", "report").lower()
+# mismatches are only repaired after being seen for this long, by this process
+RECONCILE_GRACE_S = float(os.getenv("MOVIE_REQUEST_SERVER_RECONCILE_GRACE_H", 24)) * 3600
+# max number of requests removed and torrents deleted per run
+RECONCILE_MAX_REPAIRS = int(os.getenv("MOVIE_REQUEST_SERVER_RECONCILE_MAX_REPAIRS", 20))
+
+
+@dataclass
+class ReconcileReport:
+    # requests whose torrent is not in qbittorrent
+    dangling: list[str] = field(default_factory=list)
+    # torrents of the category without a request
+    orphans: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    deleted: list[str] = field(default_factory=list)
+    checked_at: float = field(default_factory=time.time)
+
+    def to_dict(self) -> dict:
+        return {
+            "dangling": self.dangling,
+            "orphans": self.orphans,
+            "removed": self.removed,
+            "deleted": self.deleted,
+            "checked_at": self.checked_at,
+        }
+
+
+class Reconciler:
+    """
+    Diffs the requests in the database against the torrents in qbittorrent,
+    and repairs the mismatches that persist past a grace period.
+    """
+
+    def __init__(self, database: db.IDatabase):
+        self._db = database
+        # hash -> when the mismatch was first seen
+        self._dangling_since: dict[str, float] = {}
+        self._orphan_since: dict[str, float] = {}
+        self._report: ReconcileReport | None = None
+        self._delete_orphans = RECONCILE_ORPHANS == "delete"
+
+    @property
+    def report(self) -> ReconcileReport | None:
+        return self._report
+
+    def keep_orphans(self, reason: str):
+        """
+        Only report the orphaned torrents from now on, e.g. when the requests were lost.
+        """
+        if self._delete_orphans:
+            logger.warning(f"Orphaned torrents won't be deleted: {reason}")
+        self._delete_orphans = False
+
+    async def check(self):
+        # all categories, a requested torrent moved to another category is not dangling
+        torrents = await qbittorrent.get_torrent_list()
+        if torrents is None:
+            logger.warning("Reconciliation could not fetch the torrent list")
+            return
+        category = qbittorrent.QBITTORRENT_CATEGORY
+        torrent_hashes = {torrent["hash"].lower() for torrent in torrents}
+        requested = {
+            req.torrent.infohash.lower() for req in await self._db.get_all_requests()
+        }
+
+        now = time.monotonic()
+        report = ReconcileReport(
+            dangling=sorted(requested - torrent_hashes),
+            orphans=sorted(
+                torrent["hash"].lower()
+                for torrent in torrents
+                if torrent["hash"].lower() not in requested
+                and (not category or torrent.get("category") == category)
+            ),
+        )
+        self._dangling_since = {
+            h: self._dangling_since.get(h, now) for h in report.dangling
+        }
+        self._orphan_since = {h: self._orphan_since.get(h, now) for h in report.orphans}
+        if report.dangling or report.orphans:
+            logger.warning(
+                f"Reconciliation found {len(report.dangling)} requests without a torrent "
+                f"and {len(report.orphans)} torrents without a request"
+            )
+
+        if RECONCILE_DANGLING == "remove":
+            report.removed = await self.__remove_dangling(
+                self.__expired(self._dangling_since, now)
+            )
+        if self._delete_orphans:
+            if not category:
+                logger.warning(
+                    "Orphaned torrents are not deleted without a QBITTORRENT_CATEGORY"
+                )
+            elif not requested:
+                # a lost or replaced database would orphan every torrent
+                logger.warning("Orphaned torrents are not deleted, there is no request")
+            else:
+                report.deleted = await self.__delete_orphans(
+                    self.__expired(self._orphan_since, now)
+                )
+        self._report = report
+
+    @staticmethod
+    def __expired(since: dict[str, float], now: float) -> list[str]:
+        return [h for h, t in since.items() if now - t >= RECONCILE_GRACE_S][
+            :RECONCILE_MAX_REPAIRS
+        ]
+
+    async def __remove_dangling(self, hashes: list[str]) -> list[str]:
+        """
+        Cancel the requests of every user for the given torrents.
+        """
+        if not hashes:
+            return []
+        remaining = set(hashes)
+        removed = set()
+        for user, torrents in (await self._db.get_requests_by_user()).items():
+            for torrent in torrents:
+                if torrent.infohash.lower() in remaining:
+                    if await self._db.cancel_request(user, torrent):
+                        removed.add(torrent.infohash.lower())
+        for infohash in removed:
+            self._dangling_since.pop(infohash, None)
+        if removed:
+            logger.info(f"Removed the requests of {len(removed)} missing torrents: {sorted(removed)}")
+        return sorted(removed)
+
+    async def __delete_orphans(self, hashes: list[str]) -> list[str]:
+        if not hashes:
+            return []
+        if not await qbittorrent.delete_torrent(torrent_hashes=hashes, delete_files=True):
+            return []
+        for infohash in hashes:
+            self._orphan_since.pop(infohash, None)
+        logger.info(f"Deleted {len(hashes)} torrents nobody requested: {hashes}")
+        return hashes
@@ -1,17 +1,50 @@
+import asyncio
 import inspect
+import json
+import time
+import hashlib
+import queue
 import logging
 import functools
 import os
-from .extensions import g_db, g_limiter
-from dataclasses import dataclass, field
+import limits
+from .extensions import (
+    g_db,
+    g_limiter,
+    g_watchdog,
+    g_reconciler,
+    g_duplicates,
+    g_search_index,
+    g_background,
+    g_status_feed,
+    g_jobs,
+    g_shared_state,
+    limiter_key_func,
+)
+from .jobs import Job, JobError
+from .duplicates import IndexedRequest
+from typing import Callable
 import contextlib
 
-from flask import Blueprint, redirect, render_template, request, session
+from flask import (
+    Blueprint,
+    Response,
+    current_app,
+    g,
+    make_response,
+    redirect,
+    render_template,
+    request,
+    session,
+)
 import app.jackett as jackett
 import app.jellyfin as jellyfin
 import app.qbittorrent as qbittorrent
 import app.db as db
 import app.storage as storage
+import app.rebalancer as rebalancer
+import app.metrics as metrics
+import app.profiling as profiling
 
 main_bp = Blueprint("main", __name__)
 
@@ -38,33 +71,130 @@ def login_required(f):
 
     return wrapper
 
-@dataclass
-class TranscientUserData:
-    # a set of torrent titles that are being processed by /api/request (note this is not infohashes)
-    # we store the title instead of infohashes because the latter is not available when this info is needed
-    # this is not perfect, but in the worst case we accidentally block the ability to make request for a different torrent with the same title temporarily
-    pending_requests: set[str] = field(default_factory=set)
-    ref_count: int = 0
+# how long an in-flight request blocks duplicates if its worker dies without releasing it
+INFLIGHT_REQUEST_TTL_S = 600
+INFLIGHT_REQUEST_PREFIX = "inflight/"
 
 
-# a dict to store some transcient user data
-# such as the torrent request status
-g_transcient_user_data: dict[str, TranscientUserData] = {}
+def inflight_request_key(user_id: str, infohash: str = "") -> str:
+    return f"{INFLIGHT_REQUEST_PREFIX}{user_id}/{infohash}"
 
 
-@contextlib.contextmanager
-def transient_user_data(user_id: str):
-    """Context manager to handle transient user data."""
-    data = g_transcient_user_data.setdefault(user_id, TranscientUserData())
+def get_inflight_requests(user_id: str) -> set[str]:
+    """
+    Infohashes of the torrents the user's request jobs are currently processing, across all workers.
+    """
+    prefix = inflight_request_key(user_id)
+    return {key[len(prefix) :] for key in g_shared_state.scan(prefix)}
+
+
+async def get_owned_requests(user: jellyfin.JellyfinSession) -> set[str]:
+    """
+    Infohashes of the torrents the user requested.
+    """
+    db_user = db.User(id=user["id"], username=user["username"])
+    return {req.torrent.infohash.lower() for req in await g_db.get_requests(db_user)}
+
+
+def find_joinable(
+    metadata: jackett.MetadataDict, infohash: str | None, owned: set[str]
+) -> list[IndexedRequest]:
+    """
+    Requests of other releases of the same media, which the user did not make yet.
+    """
+    return [
+        req
+        for req in g_duplicates.find(metadata, exclude=infohash)
+        if req.infohash not in owned
+    ]
 
+
+@contextlib.contextmanager
+def inflight_request(user_id: str, infohash: str):
+    """
+    Claim a torrent for a request of the user across all workers.
+    Yields whether the claim succeeded, i.e. no other request for it is in flight.
+    """
+    key = inflight_request_key(user_id, infohash)
+    claimed = g_shared_state.set_if_absent(key, "1", INFLIGHT_REQUEST_TTL_S)
     try:
-        data.ref_count += 1
-        yield data
+        yield claimed
     finally:
-        # Clean up the data after use
-        data.ref_count -= 1
-        if data.ref_count == 0:
-            del g_transcient_user_data[user_id]
+        if claimed:
+            g_shared_state.delete(key)
+
+
+metrics.register(
+    metrics.Gauge(
+        "movie_request_inflight_requests",
+        "Torrent requests being processed, across all workers.",
+        lambda: len(g_shared_state.scan(INFLIGHT_REQUEST_PREFIX)),
+    )
+)
+
+
+# part of every fragment etag, so that a restart with updated templates invalidates cached fragments
+g_fragment_etag_salt = str(time.time())
+
+
+def fragment_etag(*parts) -> str:
+    """
+    Compute an etag from the data a fragment is rendered from.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(g_fragment_etag_salt.encode())
+    digest.update(json.dumps(parts, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def conditional_fragment(etag: str, render: Callable[[], str]) -> Response:
+    """
+    Respond with 304 if the client already has the fragment, otherwise render it.
+    """
+    # compressed responses carry a weak etag, see compression.py
+    if request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+    else:
+        with profiling.span("render"):
+            resp = make_response(render())
+    resp.set_etag(etag)
+    # the fragments are per user and must be revalidated every time
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+
+# min size of the chunks of streamed fragments
+FRAGMENT_STREAM_CHUNK_SIZE = 16 * 1024
+
+
+def stream_fragment(template_name: str, **context) -> Response:
+    """
+    Render a fragment in chunks so that the client receives the first rows
+    before the whole template is rendered.
+    The chunks are rendered after the view returned, outside of the request context
+    (stream_with_context doesn't work in async views), so everything the template
+    needs must be passed in `context`.
+    """
+    flask_app = current_app._get_current_object()  # type: ignore
+    template = flask_app.jinja_env.get_template(template_name)
+    flask_app.update_template_context(context)
+
+    def _generate():
+        chunk: list[str] = []
+        size = 0
+        with profiling.span("render", template=template_name):
+            for part in template.generate(**context):
+                chunk.append(part)
+                size += len(part)
+                if size >= FRAGMENT_STREAM_CHUNK_SIZE:
+                    yield "".join(chunk)
+                    chunk.clear()
+                    size = 0
+            if chunk:
+                yield "".join(chunk)
+
+    return Response(_generate(), mimetype="text/html")
+
 
 @main_bp.route("/")
 def index():
@@ -80,116 +210,338 @@ def login_page():
     return render_template("login.html")
 
 
+# torrent files of the top search results by seeders prefetched, 0 disables the prefetch
+SEARCH_PREFETCH_TOP_N = int(os.getenv("MOVIE_REQUEST_SERVER_SEARCH_PREFETCH_TOP_N", 10))
+# results shown by the "recent" search, which only looks up the local search index
+SEARCH_RECENT_LIMIT = 100
+TYPEAHEAD_LIMIT = 10
+
+
+def search_entries(jackett_entries: list[dict], owned: set[str]) -> list[dict]:
+    """
+    The entries of search_res.html for the results of a Jackett search. Blocking.
+    """
+    entries = []
+    for jackett_entry in jackett_entries:
+        link = jackett_entry.get("MagnetUri", None)
+        if not link:
+            link = jackett_entry.get("Link", None)
+        title = jackett_entry.get("Title", None)
+
+        if not link or not title:
+            logger.warning("ignored invalid jackett entry: %s", jackett_entry)
+            continue
+
+        entry = {}
+        entry["GuessedMetadata"] = jackett.guess_metadata(title)
+        if "Seeders" in jackett_entry:
+            entry["Seeders"] = jackett_entry["Seeders"]
+            if "Peers" in jackett_entry:
+                entry["Leechers"] = jackett_entry["Peers"]
+
+        entry["Info"] = qbittorrent.BasicTorrentInfo(
+            title=jackett_entry["Title"],
+            size=jackett_entry["Size"],
+            infohash=jackett_entry["InfoHash"],
+            link=link,
+        )
+        # other releases of the same media already requested
+        entry["Duplicates"] = find_joinable(
+            entry["GuessedMetadata"], entry["Info"].infohash, owned
+        )
+        entries.append(entry)
+    return entries
+
+
 @main_bp.route("/fragment/search", methods=["POST"])
 @login_required
 @g_limiter.limit("1/second")
 async def search(user: jellyfin.JellyfinSession):
-    body = request.get_json()
+    # in ASGI mode the views run on the background loop, see MovieRequestApp:
+    # reading the body, guessing and rendering happen off the loop
+    body = await asyncio.to_thread(request.get_json)
     if not isinstance(body, dict):
-        logger.error(f"Invalid search request body: {body}")
+        logger.error("Invalid search request body: %s", body)
         return "Invalid request body", 400
 
     search_type = body.get("type", None)
     query = body.get("query", None)
 
-    if not query:
+    # an empty "recent" search lists the last seen results
+    if not query and search_type != "recent":
         return "Please provide a non-empty query", 400
 
+    # no offer to join a request the user already made
+    owned = await get_owned_requests(user)
     entries: list[dict] = []
     if search_type == "magnet":
         # direct link is the same as sending a request
         info = await qbittorrent.get_torrent_info(query)
         if info is None:
             return "Invalid magnet link", 400
+        metadata = await asyncio.to_thread(jackett.guess_metadata, info.title)
         entries.append(
             {
-                "GuessedMetadata": jackett.guess_metadata(info.title),
+                "GuessedMetadata": metadata,
                 "Info": info,
+                "Duplicates": find_joinable(metadata, info.infohash, owned),
             }
         )
     elif search_type == "text":
         jackett_entries = await jackett.search(query)
         if jackett_entries is not None:
-            for jackett_entry in jackett_entries:
-                link = jackett_entry.get("MagnetUri", None)
-                if not link:
-                    link = jackett_entry.get("Link", None)
-                title = jackett_entry.get("Title", None)
-
-                if not link or not title:
-                    logger.warning(f"ignored invalid jackett entry: {jackett_entry}")
-                    continue
-
-                entry = {}
-                entry["GuessedMetadata"] = jackett.guess_metadata(title)
-                if "Seeders" in jackett_entry:
-                    entry["Seeders"] = jackett_entry["Seeders"]
-                    if "Peers" in jackett_entry:
-                        entry["Leechers"] = jackett_entry["Peers"]
-
-                entry["Info"] = qbittorrent.BasicTorrentInfo(
-                    title=jackett_entry["Title"],
-                    size=jackett_entry["Size"],
-                    infohash=jackett_entry["InfoHash"],
-                    link=link,
-                )
-                entries.append(entry)
+            # guessit takes ~15 ms per title, the loop also runs the other views and the jobs
+            entries = await asyncio.to_thread(search_entries, jackett_entries, owned)
+            # off the request, the index is only read by later searches
+            if entries:
+                g_background.submit(asyncio.to_thread(g_search_index.record, entries))
+    elif search_type == "recent":
+        entries = await asyncio.to_thread(
+            g_search_index.search, query or "", SEARCH_RECENT_LIMIT
+        )
+        for entry in entries:
+            entry["Duplicates"] = find_joinable(
+                entry["GuessedMetadata"], entry["Info"].infohash, owned
+            )
     else:
-        logger.error(f"Invalid search type: {search_type}")
+        logger.error("Invalid search type: %s", search_type)
         return "Invalid search type", 400
 
-    with transient_user_data(user["id"]) as user_data:
-        return render_template(
-            "fragments/search_res.html",
-            query=query,
-            entries=entries,
-            user_data=user_data,
-        )
+    # fetch the torrent files of the likely clicks now, see qbittorrent.prefetch_torrent_info
+    prefetch_links = [
+        entry["Info"].link
+        for entry in sorted(entries, key=lambda e: -e.get("Seeders", 0))[
+            :SEARCH_PREFETCH_TOP_N
+        ]
+    ]
+    if prefetch_links:
+        g_background.submit(qbittorrent.prefetch_torrent_info(prefetch_links))
+
+    return stream_fragment(
+        "fragments/search_res.html",
+        query=query,
+        entries=entries,
+        pending_requests=await asyncio.to_thread(get_inflight_requests, user["id"]),
+    )
+
+
+@main_bp.route("/api/search/typeahead", methods=["GET"])
+@login_required
+def search_typeahead(user: jellyfin.JellyfinSession):
+    """
+    Titles of the results seen by previous searches, without querying Jackett.
+    """
+    query = request.args.get("q", "")
+    if not query.strip():
+        return {"suggestions": []}
+    return {"suggestions": g_search_index.suggest(query, TYPEAHEAD_LIMIT)}
+
+
+# torrent fields displayed by qbittorrent_stats.html
+STATS_FRAGMENT_FIELDS = ("hash", "name", "total_size", "dlspeed", "progress", "eta")
+
+# sort key query param -> torrent field
+STATS_SORT_KEYS = {
+    "name": "name",
+    "size": "total_size",
+    "dlspeed": "dlspeed",
+    "progress": "progress",
+    "eta": "eta",
+    "added": "added_on",
+}
+STATS_PAGE_SIZE = 50
+STATS_MAX_PAGE_SIZE = 200
 
 
 @main_bp.route("/fragment/qbittorrent/stats", methods=["GET"])
 @login_required
-@g_limiter.limit("1/second")
+# served from the torrent cache, and reloaded by the table controls and the status events
+@g_limiter.limit("10/second")
 async def qbittorrent_stats(user: jellyfin.JellyfinSession):
+    """
+    Query params:
+    - page: 1-based page number
+    - per_page: number of rows per page
+    - sort: one of STATS_SORT_KEYS, newest first by default
+    - order: asc or desc
+    - q: case-insensitive filter on the torrent name and state
+    """
+    page = request.args.get("page", 1, type=int)
+    per_page = request.args.get("per_page", STATS_PAGE_SIZE, type=int)
+    per_page = max(1, min(per_page, STATS_MAX_PAGE_SIZE))
+    sort = request.args.get("sort", "added")
+    if sort not in STATS_SORT_KEYS:
+        return "Invalid sort key", 400
+    order = request.args.get("order", "desc" if sort == "added" else "asc")
+    query = request.args.get("q", "").strip().casefold()
+
     requests = await g_db.get_requests(
         db.User(id=user["id"], username=user["username"])
     )
     entries = []
     if requests:
-        entries = await qbittorrent.get_torrent_list(
-            hashes=[req.torrent.infohash for req in requests],
-        )
-    with transient_user_data(user["id"]) as user_data:
-        return render_template(
-            "fragments/qbittorrent_stats.html", entries=entries, user_data=user_data
+        entries = (
+            await qbittorrent.get_cached_torrent_list(
+                [req.torrent.infohash for req in requests],
+            )
+            or []
         )
 
+    if query:
+        entries = [
+            entry
+            for entry in entries
+            if query in entry.get("name", "").casefold()
+            or query in entry.get("state", "").casefold()
+        ]
+    sort_field = STATS_SORT_KEYS[sort]
+
+    def sort_key(entry: qbittorrent.TorrentInfo):
+        value = entry.get(sort_field, 0)
+        return value.casefold() if isinstance(value, str) else value
+
+    entries = sorted(entries, key=sort_key, reverse=order == "desc")
+
+    total = len(entries)
+    pages = max(1, (total + per_page - 1) // per_page)
+    page = max(1, min(page, pages))
+    entries = entries[(page - 1) * per_page : page * per_page]
+
+    etag = fragment_etag(
+        [req.torrent.infohash for req in requests],
+        [page, per_page, sort, order, query, total],
+        [
+            [entry.get(name) for name in STATS_FRAGMENT_FIELDS]
+            for entry in entries
+        ],
+    )
+    return await asyncio.to_thread(
+        conditional_fragment,
+        etag,
+        lambda: render_template(
+            "fragments/qbittorrent_stats.html",
+            entries=entries,
+            total=total,
+            page=page,
+            pages=pages,
+            sort=sort,
+            order=order,
+        ),
+    )
+
+
+# send a comment every so often so that proxies don't close idle event streams
+EVENT_STREAM_KEEPALIVE_S = 15
+# every open stream holds a server thread, past this many clients fall back to polling,
+# keep it well below the threads of the server (gunicorn threads, ASGI_THREADS)
+EVENT_STREAM_MAX = int(os.getenv("MOVIE_REQUEST_SERVER_EVENT_STREAM_MAX", 8))
+# streams are closed after this long, EventSource reconnects on its own
+EVENT_STREAM_MAX_AGE_S = float(
+    os.getenv("MOVIE_REQUEST_SERVER_EVENT_STREAM_MAX_AGE_S", 300)
+)
+
+
+@main_bp.route("/events/qbittorrent/stats", methods=["GET"])
+@login_required
+def qbittorrent_stats_events(user: jellyfin.JellyfinSession):
+    """
+    Server-sent events with the changes of the user's torrents.
+    `update` carries the changed fields of each row, `reload` means rows were added or removed.
+    """
+    sub = g_status_feed.subscribe(
+        db.User(id=user["id"], username=user["username"]), EVENT_STREAM_MAX
+    )
+    if sub is None:
+        return "Too many event streams, poll instead", 503, {"Retry-After": "60"}
+
+    def _stream():
+        deadline = time.monotonic() + EVENT_STREAM_MAX_AGE_S
+        try:
+            yield "retry: 5000\n\n"
+            while (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    event, payload = sub.events.get(
+                        timeout=min(EVENT_STREAM_KEEPALIVE_S, remaining)
+                    )
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        finally:
+            g_status_feed.unsubscribe(sub)
+
+    return Response(
+        _stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 
 @main_bp.route("/fragment/user", methods=["GET"])
 @login_required
 async def user(user: jellyfin.JellyfinSession):
-    return render_template("fragments/user.html", user=user)
+    return await asyncio.to_thread(
+        conditional_fragment,
+        fragment_etag(user),
+        lambda: render_template("fragments/user.html", user=user),
+    )
+
+
+# if set, /metrics requires an `Authorization: Bearer <token>` header
+METRICS_TOKEN = os.getenv("MOVIE_REQUEST_SERVER_METRICS_TOKEN", "")
+
+
+@main_bp.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """
+    Metrics of this worker process, in the Prometheus text format.
+    """
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return "Unauthorized", 401
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@main_bp.route("/api/storage/status", methods=["GET"])
+@login_required
+def storage_status(user: jellyfin.JellyfinSession):
+    return {"mounts": [status.to_dict() for status in g_watchdog.get_status()]}
+
+
+@main_bp.route("/api/storage/reconcile/status", methods=["GET"])
+@login_required
+def storage_reconcile_status(user: jellyfin.JellyfinSession):
+    report = g_reconciler.report
+    return {"report": report.to_dict() if report else None}
+
+
+@main_bp.route("/api/storage/rebalance/plan", methods=["GET"])
+@login_required
+async def storage_rebalance_plan(user: jellyfin.JellyfinSession):
+    moves = await rebalancer.plan()
+    if moves is None:
+        return "Failed to fetch torrent list", 500
+    return {"moves": [move.to_dict() for move in moves]}
 
 
 @main_bp.route("/api/login", methods=["POST"])
 async def login():
-    body = request.get_json()
+    body = await asyncio.to_thread(request.get_json)
     if not isinstance(body, dict):
-        logger.error(f"Invalid login request body: {body}")
+        logger.error("Invalid login request body: %s", body)
         return "Invalid request body", 400
 
     username = body.get("username", None)
     password = body.get("password", None)
 
     if username is None or password is None:
-        logger.error(f"Missing username or password: {body}")
+        logger.error("Missing username or password: %s", body)
         return "Missing username or password", 400
 
     resp = await jellyfin.login(username, password)
     if not resp:
         return "Login failed", 401
 
-    logger.info(f"Jellyfin User {username} logged in successfully")
+    logger.info("Jellyfin User %s logged in successfully", username)
     return "Login successful", 200
 
 
@@ -199,70 +551,390 @@ def logout():
     return redirect("/")
 
 
-@main_bp.route("/api/request", methods=["POST"])
-@login_required
-@g_limiter.limit("20/day")
-async def request_torrent(user: jellyfin.JellyfinSession):
-    body = request.get_json()
-    if not isinstance(body, dict):
-        logger.error(f"Invalid request body: {body}")
-        return "Invalid request body", 400
+async def process_request_job(job: Job) -> str:
+    """
+    Resolve, place and add a requested torrent, then record the request in DB.
+    Runs on the background loop, see `request_torrent`.
+    """
+    db_user: db.User = job.params["user"]
+    torrent_link = job.params["torrent_link"]
+    torrent_size = job.params["torrent_size"]
 
-    torrent_title = body.get("torrentTitle", None)
-    torrent_link = body.get("torrentLink", None)
-    torrent_size = body.get("torrentSize", None)
-    if torrent_link is None or torrent_size is None:
-        logger.error(f"Missing required params: {body}")
-        return "Missing required params", 400
+    g_jobs.update(job, step="resolving")
+    torrent_hash = await qbittorrent.get_torrent_hash(torrent_link)
+    if not torrent_hash:
+        logger.error("Failed to get torrent hash for %s", torrent_link)
+        raise JobError("Failed to get torrent hash", 500)
 
-    logger.debug(f"User {user['username']} is about to request torrent: {torrent_link}")
-
-    with transient_user_data(user["id"]) as user_data:
-        # record the ongoing request in the transient user data
-        if torrent_title is not None:
-            user_data.pending_requests.add(torrent_title)
-
-        torrent_hash = await qbittorrent.get_torrent_hash(torrent_link)
-        if not torrent_hash:
-            logger.error(f"Failed to get torrent hash for {torrent_link}")
-            return "Failed to get torrent hash", 500
-
-        if torrent_hash in user_data.pending_requests:
+    with inflight_request(db_user.id, torrent_hash) as claimed:
+        if not claimed:
             logger.warning(
-                f"User {user['username']} already has a pending request for torrent {torrent_hash}."
+                "User %s already has a pending request for torrent %s.",
+                db_user.username,
+                torrent_hash,
             )
-            return "Torrent already requested", 400
+            raise JobError("Torrent already requested", 400)
 
-        db_user = db.User(id=user["id"], username=user["username"])
         if await g_db.has_request(db_user, db.Torrent(torrent_hash)):
             logger.warning(
-                f"User {user['username']} already has a DB request for torrent {torrent_hash}."
+                "User %s already has a DB request for torrent %s.",
+                db_user.username,
+                torrent_hash,
             )
-            return "Torrent already requested", 400
+            raise JobError("Torrent already requested", 400)
 
         # add the torrent to qBittorrent
-        best_path = storage.get_best_path(torrent_size)
+        g_jobs.update(job, step="placing")
+        active_downloads = await storage.get_active_downloads()
+        best_path = storage.get_best_path(torrent_size, active_downloads)
         if best_path is None:
             logger.error(
-                f"No disk can hold torrent {torrent_hash} with file size {torrent_size} bytes"
+                "No disk can hold torrent %s with file size %s bytes",
+                torrent_hash,
+                torrent_size,
             )
-            return "No disk can hold the file", 500
+            raise JobError("No disk can hold the file", 500)
         os.makedirs(best_path, exist_ok=True)
-        logger.debug(f"add download job for {torrent_hash} to {best_path}")
+        logger.debug("add download job for %s to %s", torrent_hash, best_path)
+        g_jobs.update(job, step="adding")
         if not await qbittorrent.add_torrent(
             torrent_links=torrent_link,
             save_path=best_path,
             exist_ok=True,
         ):
-            return "Failed to add torrent", 500
+            raise JobError("Failed to add torrent", 500)
 
         # record the request in DB
         await g_db.make_request(db_user, db.Torrent(torrent_hash))
+        await g_duplicates.add(
+            torrent_hash, job.params["torrent_title"] or torrent_hash, torrent_size
+        )
+        logger.info(
+            "User %s made a request for torrent %s", db_user.username, torrent_hash
+        )
+
+    return "Request created successfully"
+
+
+# requests per user, shared by the single and the bulk requests
+REQUEST_LIMIT = "20/day"
+
+
+def remaining_requests() -> int:
+    """
+    Requests the current user can still make within REQUEST_LIMIT.
+    """
+    stats = g_limiter.limiter.get_window_stats(
+        limits.parse(REQUEST_LIMIT), limiter_key_func(), "request"
+    )
+    return stats.remaining
+
+
+@main_bp.route("/api/request", methods=["POST"])
+@login_required
+# the offers to join another release don't count
+@g_limiter.shared_limit(
+    REQUEST_LIMIT,
+    scope="request",
+    deduct_when=lambda response: response.status_code != 409,
+)
+async def request_torrent(user: jellyfin.JellyfinSession):
+    """
+    Queue a request job and return its id right away,
+    resolving a magnet link alone can take longer than the worker timeout.
+    """
+    body = await asyncio.to_thread(request.get_json)
+    if not isinstance(body, dict):
+        logger.error("Invalid request body: %s", body)
+        return "Invalid request body", 400
+
+    torrent_title = body.get("torrentTitle", None)
+    torrent_link = body.get("torrentLink", None)
+    torrent_size = body.get("torrentSize", None)
+    if torrent_link is None or torrent_size is None:
+        logger.error("Missing required params: %s", body)
+        return "Missing required params", 400
+
+    logger.debug(
+        "User %s is about to request torrent: %s", user["username"], torrent_link
+    )
+
+    # offer to join the request of another release of the same media instead
+    if torrent_title and not body.get("allowDuplicate", False):
+        metadata = await asyncio.to_thread(jackett.guess_metadata, torrent_title)
+        duplicates = find_joinable(
+            metadata, body.get("torrentHash"), await get_owned_requests(user)
+        )
+        if duplicates:
+            return {
+                "message": "Another release of this media is already requested",
+                "duplicates": [req.to_dict() for req in duplicates],
+            }, 409
+
+    pending_jobs = g_jobs.pending(user["id"])
+    if any(job.params.get("torrent_link") == torrent_link for job in pending_jobs):
+        logger.warning(
+            "User %s already has a pending request for %s.",
+            user["username"],
+            torrent_link,
+        )
+        return "Torrent already requested", 400
+
+    job = g_jobs.submit(
+        user["id"],
+        process_request_job,
+        {
+            "user": db.User(id=user["id"], username=user["username"]),
+            "torrent_title": torrent_title,
+            "torrent_link": torrent_link,
+            "torrent_size": torrent_size,
+        },
+    )
+    if job is None:
+        return "Too many pending requests, try again later", 503
+
+    return job.to_dict(), 202, {"Location": f"/api/request/job/{job.id}"}
+
+
+@main_bp.route("/api/request/join", methods=["POST"])
+@login_required
+async def join_request(user: jellyfin.JellyfinSession):
+    """
+    Join the request of a torrent another user already made.
+    It is in qBittorrent already, so unlike `request_torrent` nothing is resolved nor added,
+    the request is only recorded by its infohash.
+    """
+    body = await asyncio.to_thread(request.get_json)
+    if not isinstance(body, dict) or not isinstance(body.get("torrentHash"), str):
+        logger.error("Invalid join request body: %s", body)
+        return "Invalid request body", 400
+
+    torrent_hash = body["torrentHash"].lower()
+    torrent = next(
+        (
+            req.torrent
+            for req in await g_db.get_all_requests()
+            if req.torrent.infohash.lower() == torrent_hash
+        ),
+        None,
+    )
+    if torrent is None:
+        return "Request not found", 404
+
+    db_user = db.User(id=user["id"], username=user["username"])
+    with inflight_request(db_user.id, torrent.infohash) as claimed:
+        if not claimed or await g_db.has_request(db_user, torrent):
+            logger.warning(
+                "User %s already requested torrent %s.", db_user.username, torrent_hash
+            )
+            return "Torrent already requested", 400
+        await g_db.make_request(db_user, torrent)
+    g_duplicates.join(torrent.infohash)
+
+    logger.info("User %s joined the request for torrent %s", db_user.username, torrent_hash)
+    return "Request joined successfully", 200
+
+
+# max number of magnets, links and torrent files of a bulk request
+BULK_REQUEST_MAX_ITEMS = int(os.getenv("MOVIE_REQUEST_SERVER_BULK_REQUEST_MAX_ITEMS", 50))
+# torrents of a bulk request resolved at the same time
+BULK_REQUEST_CONCURRENCY = int(
+    os.getenv("MOVIE_REQUEST_SERVER_BULK_REQUEST_CONCURRENCY", 4)
+)
+
+
+def get_bulk_request_items() -> list[dict]:
+    """
+    Items of a bulk request: the `links` field, a list in JSON or one per line in a form,
+    and the uploaded `torrents` files.
+    Parsed once per request, for its cost and for the job.
+    """
+    if "bulk_request_items" not in g:
+        g.bulk_request_items = _parse_bulk_request_items()
+    return g.bulk_request_items
+
+
+def _parse_bulk_request_items() -> list[dict]:
+    body = request.get_json(silent=True)
+    if isinstance(body, dict):
+        links = body.get("links", [])
+        if not isinstance(links, list):
+            links = []
+    else:
+        links = request.form.get("links", "").splitlines()
+
+    ret = [
+        {"source": link.strip(), "link": link.strip(), "content": None}
+        for link in links
+        if isinstance(link, str) and link.strip()
+    ]
+    for file in request.files.getlist("torrents"):
+        ret.append({"source": file.filename or "", "link": None, "content": file.read()})
+    return ret
+
+
+def bulk_request_cost() -> int:
+    """
+    One per item, the items past the remaining requests of the day are refused by the job.
+    """
+    return max(1, min(len(get_bulk_request_items()), remaining_requests()))
+
+
+async def process_bulk_request_job(job: Job) -> str:
+    """
+    `process_request_job` for many torrents: resolved concurrently, placed in one pass,
+    added to qBittorrent in one call per save path and recorded in one DB transaction.
+    """
+    db_user: db.User = job.params["user"]
+    items: list[dict] = job.params["items"]
+    refused: list[dict] = job.params.get("refused", [])
+    results = [
+        {
+            "source": item["source"],
+            "infohash": "",
+            "title": "",
+            "state": "pending",
+            "message": "",
+        }
+        for item in items + refused
+    ]
+
+    def _fail(result: dict, message: str):
+        result.update(state="failed", message=message)
+
+    for result in results[len(items) :]:
+        _fail(result, "Daily request limit reached")
+
+    g_jobs.update(job, step="resolving", results=results)
+    semaphore = asyncio.Semaphore(BULK_REQUEST_CONCURRENCY)
+
+    async def _resolve(item: dict) -> qbittorrent.BasicTorrentInfo | None:
+        async with semaphore:
+            try:
+                return await qbittorrent.get_torrent_info(
+                    item["content"] or item["link"]
+                )
+            except Exception as e:
+                # e.g. libtorrent rejecting a malformed magnet, only fails this item
+                logger.warning("Failed to resolve %s: %s", item["source"], e)
+                return None
+
+    infos = await asyncio.gather(*(_resolve(item) for item in items))
+
+    with contextlib.ExitStack() as claims:
+        # index of the items still to be requested
+        accepted: list[int] = []
+        for i, info in enumerate(infos):
+            if info is None:
+                _fail(results[i], "Failed to get torrent hash")
+                continue
+            results[i].update(infohash=info.infohash, title=info.title)
+            if not claims.enter_context(inflight_request(db_user.id, info.infohash)):
+                # also the items of this request listing the same torrent twice
+                _fail(results[i], "Torrent already requested")
+                continue
+            if await g_db.has_request(db_user, db.Torrent(info.infohash)):
+                _fail(results[i], "Torrent already requested")
+                continue
+            accepted.append(i)
+
+        g_jobs.update(job, step="placing", results=results)
+        active_downloads = await storage.get_active_downloads()
+        paths = storage.plan_placements(
+            [infos[i].size for i in accepted], active_downloads  # type: ignore
+        )
+        by_path: dict[str, list[int]] = {}
+        for i, path in zip(accepted, paths):
+            if path is None:
+                _fail(results[i], "No disk can hold the file")
+            else:
+                by_path.setdefault(path, []).append(i)
+
+        g_jobs.update(job, step="adding", results=results)
+        added: list[int] = []
+        for path, indices in by_path.items():
+            os.makedirs(path, exist_ok=True)
+            if await qbittorrent.add_torrents(
+                torrent_hashes=[infos[i].infohash for i in indices],  # type: ignore
+                save_path=path,
+                torrent_files={
+                    infos[i].infohash: items[i]["content"]  # type: ignore
+                    for i in indices
+                    if items[i]["content"] is not None
+                },
+            ):
+                added.extend(indices)
+            else:
+                for i in indices:
+                    _fail(results[i], "Failed to add torrent")
+
+        # record the requests in DB
+        await g_db.make_requests(
+            db_user, [db.Torrent(infos[i].infohash) for i in added]  # type: ignore
+        )
+        for i in added:
+            info = infos[i]
+            assert info is not None
+            await g_duplicates.add(info.infohash, info.title, info.size)
+            results[i]["state"] = "requested"
         logger.info(
-            f"User {user['username']} made a request for torrent {torrent_hash}"
+            "User %s made a bulk request for %d of %d torrents",
+            db_user.username,
+            len(added),
+            len(results),
         )
 
-    return "Request created successfully", 201
+    g_jobs.update(job, results=results)
+    if not added:
+        raise JobError("No torrent could be requested", 400)
+    return f"Requested {len(added)} of {len(results)} torrents"
+
+
+@main_bp.route("/api/request/bulk", methods=["POST"])
+@login_required
+# only the queued jobs count, not the invalid requests
+@g_limiter.shared_limit(
+    REQUEST_LIMIT,
+    scope="request",
+    cost=bulk_request_cost,
+    deduct_when=lambda response: response.status_code == 202,
+)
+async def bulk_request_torrents(user: jellyfin.JellyfinSession):
+    """
+    Queue a job requesting many torrents at once, see `request_torrent`.
+    The outcome of every item is in the results of the job,
+    the ones past the remaining requests of the day are refused.
+    """
+    # reads the uploaded files
+    items = await asyncio.to_thread(get_bulk_request_items)
+    if not items:
+        return "Please provide links or torrent files", 400
+    if len(items) > BULK_REQUEST_MAX_ITEMS:
+        return f"At most {BULK_REQUEST_MAX_ITEMS} torrents per request", 400
+
+    budget = remaining_requests()
+    job = g_jobs.submit(
+        user["id"],
+        process_bulk_request_job,
+        {
+            "user": db.User(id=user["id"], username=user["username"]),
+            "items": items[:budget],
+            "refused": items[budget:],
+        },
+    )
+    if job is None:
+        return "Too many pending requests, try again later", 503
+
+    return job.to_dict(), 202, {"Location": f"/api/request/job/{job.id}"}
+
+
+@main_bp.route("/api/request/job/<job_id>", methods=["GET"])
+@login_required
+def request_job_status(user: jellyfin.JellyfinSession, job_id: str):
+    job = g_jobs.get(job_id)
+    if job is None or job.owner != user["id"]:
+        return "Job not found", 404
+    return job.to_dict()
 
 
 @main_bp.route("/api/request/delete/<torrent_hash>", methods=["DELETE"])
@@ -272,6 +944,6 @@ async def delete_request(user: jellyfin.JellyfinSession, torrent_hash: str):
         db.User(id=user["id"], username=user["username"]), db.Torrent(torrent_hash)
     )
     if not res:
-        logger.error(f"Failed to delete request for {torrent_hash}")
+        logger.error("Failed to delete request for %s", torrent_hash)
         return "Request not found", 404
     return "Request deleted successfully", 200
@@ -0,0 +1,219 @@
+import os
+import re
+import json
+import time
+import logging
+import sqlite3
+import threading
+import contextlib
+from pathlib import Path
+
+import app.qbittorrent as qbittorrent
+
+logger = logging.getLogger(__name__)
+
+SEARCH_INDEX_PATH = os.getenv(
+    "MOVIE_REQUEST_SERVER_SEARCH_INDEX_PATH", "_cache/search_index.sqlite3"
+)
+# results not seen in a search for this long are evicted
+SEARCH_INDEX_MAX_AGE_S = float(
+    os.getenv("MOVIE_REQUEST_SERVER_SEARCH_INDEX_MAX_AGE_H", 24 * 30)
+) * 3600
+# the least recently seen results are evicted past this many
+SEARCH_INDEX_MAX_ENTRIES = int(
+    os.getenv("MOVIE_REQUEST_SERVER_SEARCH_INDEX_MAX_ENTRIES", 200000)
+)
+SEARCH_INDEX_EVICT_INTERVAL_S = 3600
+
+
+def fts_query(query: str) -> str | None:
+    """
+    FTS5 query matching the titles containing every word of `query`,
+    the last one as a prefix since the user may still be typing it.
+    """
+    words = re.findall(r"\w+", query.lower())
+    if not words:
+        return None
+    # quoted so that words like "and" or "near" are not operators
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+class SearchIndex:
+    """
+    Full-text index of the results returned by Jackett, so that titles already seen
+    can be suggested without querying the indexers.
+    Shared by the workers of the server through the sqlite file.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        # executescript runs in autocommit, every statement is idempotent
+        self.__conn().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                infohash TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                link TEXT NOT NULL,
+                seeders INTEGER,
+                leechers INTEGER,
+                metadata TEXT NOT NULL,
+                seen_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS results_seen_at ON results (seen_at);
+            CREATE VIRTUAL TABLE IF NOT EXISTS results_fts USING fts5(
+                title, content='results', content_rowid='rowid'
+            );
+            CREATE TRIGGER IF NOT EXISTS results_ai AFTER INSERT ON results BEGIN
+                INSERT INTO results_fts (rowid, title) VALUES (new.rowid, new.title);
+            END;
+            CREATE TRIGGER IF NOT EXISTS results_ad AFTER DELETE ON results BEGIN
+                INSERT INTO results_fts (results_fts, rowid, title)
+                VALUES ('delete', old.rowid, old.title);
+            END;
+            CREATE TRIGGER IF NOT EXISTS results_au AFTER UPDATE OF title ON results
+            BEGIN
+                INSERT INTO results_fts (results_fts, rowid, title)
+                VALUES ('delete', old.rowid, old.title);
+                INSERT INTO results_fts (rowid, title) VALUES (new.rowid, new.title);
+            END;
+            """
+        )
+
+    def __conn(self) -> sqlite3.Connection:
+        # connections must not cross threads, nor forks
+        conn, pid = getattr(self._local, "conn", (None, None))
+        if conn is None or pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = (conn, os.getpid())
+        return conn
+
+    @contextlib.contextmanager
+    def __transaction(self):
+        conn = self.__conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def record(self, entries: list[dict]):
+        """
+        Index the entries of a search, as built by routes.search.
+        Blocking, meant to run off the request.
+        """
+        now = time.time()
+        rows = [
+            (
+                entry["Info"].infohash.lower(),
+                entry["Info"].title,
+                entry["Info"].size,
+                entry["Info"].link,
+                entry.get("Seeders"),
+                entry.get("Leechers"),
+                # guessit puts languages and countries in the metadata
+                json.dumps(dict(entry.get("GuessedMetadata", {})), default=str),
+                now,
+            )
+            for entry in entries
+            if entry["Info"].infohash
+        ]
+        if not rows:
+            return
+        with self.__transaction() as conn:
+            conn.executemany(
+                "INSERT INTO results "
+                "(infohash, title, size, link, seeders, leechers, metadata, seen_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(infohash) DO UPDATE SET title = excluded.title, "
+                "size = excluded.size, link = excluded.link, "
+                "seeders = excluded.seeders, leechers = excluded.leechers, "
+                "metadata = excluded.metadata, seen_at = excluded.seen_at",
+                rows,
+            )
+
+    def search(self, query: str, limit: int = 50) -> list[dict]:
+        """
+        The indexed results matching `query` best, or the last seen ones if it is empty.
+        Entries are shaped like the ones of routes.search.
+        """
+        match = fts_query(query)
+        conn = self.__conn()
+        columns = "r.title, r.infohash, r.size, r.link, r.seeders, r.leechers, r.metadata"
+        if match is None:
+            rows = conn.execute(
+                f"SELECT {columns} FROM results r ORDER BY r.seen_at DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        else:
+            # best match first, then the most seeded
+            rows = conn.execute(
+                f"SELECT {columns} FROM results_fts f JOIN results r ON r.rowid = f.rowid "
+                "WHERE results_fts MATCH ? ORDER BY f.rank, r.seeders DESC LIMIT ?",
+                (match, limit),
+            ).fetchall()
+
+        ret = []
+        for title, infohash, size, link, seeders, leechers, metadata in rows:
+            entry = {
+                "GuessedMetadata": json.loads(metadata),
+                "Info": qbittorrent.BasicTorrentInfo(
+                    title=title, infohash=infohash, size=size, link=link
+                ),
+            }
+            if seeders is not None:
+                entry["Seeders"] = seeders
+            if leechers is not None:
+                entry["Leechers"] = leechers
+            ret.append(entry)
+        return ret
+
+    def suggest(self, query: str, limit: int = 10) -> list[str]:
+        """
+        Distinct media titles of the indexed results matching `query`, for typeahead.
+        """
+        ret: list[str] = []
+        seen = set()
+        for entry in self.search(query, limit=limit * 10):
+            metadata = entry["GuessedMetadata"]
+            title = metadata.get("title")
+            if not isinstance(title, str):
+                continue
+            if "year" in metadata:
+                title = f"{title} {metadata['year']}"
+            if title.lower() in seen:
+                continue
+            seen.add(title.lower())
+            ret.append(title)
+            if len(ret) >= limit:
+                break
+        return ret
+
+    def count(self) -> int:
+        return self.__conn().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def evict(self) -> int:
+        """
+        Drop the results not seen for too long, and the oldest past the max count.
+        """
+        with self.__transaction() as conn:
+            evicted = conn.execute(
+                "DELETE FROM results WHERE seen_at < ?",
+                (time.time() - SEARCH_INDEX_MAX_AGE_S,),
+            ).rowcount
+            evicted += conn.execute(
+                "DELETE FROM results WHERE rowid IN ("
+                "SELECT rowid FROM results ORDER BY seen_at DESC LIMIT -1 OFFSET ?)",
+                (SEARCH_INDEX_MAX_ENTRIES,),
+            ).rowcount
+        if evicted:
+            logger.info(f"Evicted {evicted} results from the search index")
+        return evicted
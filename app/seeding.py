@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import logging
+from dataclasses import dataclass
+
+import app.qbittorrent as qbittorrent
+
+logger = logging.getLogger(__name__)
+
+# 0 disables the seeding policy
+SEEDING_INTERVAL_S = float(os.getenv("MOVIE_REQUEST_SERVER_SEEDING_INTERVAL_S", 300))
+# the average upload rate of a torrent is measured over this long
+SEEDING_RATE_WINDOW_S = float(
+    os.getenv("MOVIE_REQUEST_SERVER_SEEDING_RATE_WINDOW_MIN", 60)
+) * 60
+# qbittorrent's max_ratio_act value for pausing (stopping) the torrent,
+# the other actions remove the torrent or keep seeding
+QBITTORRENT_SHARE_LIMIT_ACTION_STOP = 0
+SEEDING_STATES = {
+    qbittorrent.TorrentState.UPLOADING,
+    qbittorrent.TorrentState.STALLED_UP,
+    qbittorrent.TorrentState.QUEUED_UP,
+}
+
+
+@dataclass(frozen=True)
+class SeedingPolicy:
+    # stop seeding at this share ratio, negative leaves it to qbittorrent's global limit
+    ratio: float = -1
+    # stop seeding after this many minutes, negative leaves it to qbittorrent's global limit
+    seeding_time_min: int = -1
+    # stop seeding when uploading slower than this on average, 0 disables
+    min_upload_bytes: int = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.has_share_limits or self.min_upload_bytes > 0
+
+    @property
+    def has_share_limits(self) -> bool:
+        return self.ratio >= 0 or self.seeding_time_min >= 0
+
+    def is_done(self, torrent: qbittorrent.TorrentInfo) -> bool:
+        return (self.ratio >= 0 and torrent.get("ratio", 0) >= self.ratio) or (
+            self.seeding_time_min >= 0
+            and torrent.get("seeding_time", 0) >= self.seeding_time_min * 60
+        )
+
+
+def parse_policies(value: str, default: SeedingPolicy) -> dict[str, SeedingPolicy]:
+    """
+    :param value: JSON object, category -> {"ratio", "seeding_time_min", "min_upload_kbps"},
+    missing fields come from `default`. Malformed policies are logged and ignored
+    """
+    try:
+        config = json.loads(value or "{}")
+    except json.JSONDecodeError as e:
+        logger.error(f"Ignoring the seeding policies, invalid JSON: {e}")
+        return {}
+    if not isinstance(config, dict):
+        logger.error(f"Ignoring the seeding policies, expected a JSON object: {value}")
+        return {}
+
+    ret = {}
+    for category, fields in config.items():
+        try:
+            ret[category] = SeedingPolicy(
+                ratio=float(fields.get("ratio", default.ratio)),
+                seeding_time_min=int(
+                    fields.get("seeding_time_min", default.seeding_time_min)
+                ),
+                min_upload_bytes=int(
+                    float(fields.get("min_upload_kbps", default.min_upload_bytes / 1024))
+                    * 1024
+                ),
+            )
+        except (AttributeError, TypeError, ValueError) as e:
+            logger.error(f"Ignoring the seeding policy of category {category}: {fields} ({e})")
+    return ret
+
+
+# applies to the categories without a policy of their own
+SEEDING_DEFAULT_POLICY = SeedingPolicy(
+    ratio=float(os.getenv("MOVIE_REQUEST_SERVER_SEEDING_RATIO", -1)),
+    seeding_time_min=int(os.getenv("MOVIE_REQUEST_SERVER_SEEDING_TIME_MIN", -1)),
+    min_upload_bytes=int(
+        float(os.getenv("MOVIE_REQUEST_SERVER_SEEDING_MIN_UPLOAD_KBPS", 0)) * 1024
+    ),
+)
+SEEDING_POLICIES = parse_policies(
+    os.getenv("MOVIE_REQUEST_SERVER_SEEDING_POLICIES", ""), SEEDING_DEFAULT_POLICY
+)
+
+SEEDING_ENABLED = any(
+    policy.enabled for policy in [SEEDING_DEFAULT_POLICY, *SEEDING_POLICIES.values()]
+)
+
+
+def get_policy(category: str) -> SeedingPolicy:
+    return SEEDING_POLICIES.get(category, SEEDING_DEFAULT_POLICY)
+
+
+class SeedingManager:
+    """
+    Stops seeding the completed torrents once they reached the ratio, seeding time or
+    upload rate target of their category. Stopped torrents keep their files for Jellyfin.
+    """
+
+    def __init__(self):
+        # whether qbittorrent stops the torrents itself when reaching their share limits
+        self._share_limits_stop: bool | None = None
+        # hash -> (start of the upload rate window, uploaded bytes at that time)
+        self._windows: dict[str, tuple[float, int]] = {}
+
+    async def check(self):
+        if not SEEDING_ENABLED:
+            return
+        if self._share_limits_stop is None:
+            preferences = await qbittorrent.get_preferences()
+            if preferences is None:
+                return
+            action = preferences.get("max_ratio_act", QBITTORRENT_SHARE_LIMIT_ACTION_STOP)
+            self._share_limits_stop = action == QBITTORRENT_SHARE_LIMIT_ACTION_STOP
+            if not self._share_limits_stop:
+                # qbittorrent would remove the torrents, or keep seeding them
+                logger.warning(
+                    f"qBittorrent's share limit action is {action}, "
+                    "seeding is only stopped by the periodic check"
+                )
+
+        torrents = await qbittorrent.get_torrent_list(
+            filter=qbittorrent.GetTorrentListFilter.COMPLETED,
+            category=qbittorrent.QBITTORRENT_CATEGORY or None,
+        )
+        if torrents is None:
+            logger.warning("Seeding policy could not fetch the torrent list")
+            return
+
+        now = time.monotonic()
+        seeding = {
+            torrent["hash"]
+            for torrent in torrents
+            if torrent.get("state") in SEEDING_STATES
+        }
+        self._windows = {h: w for h, w in self._windows.items() if h in seeding}
+
+        # (ratio, seeding time) -> hashes whose share limits are different
+        share_limits: dict[tuple[float, int], list[str]] = {}
+        to_stop: list[str] = []
+        for torrent in torrents:
+            # force-started torrents are left alone
+            if torrent["hash"] not in seeding:
+                continue
+            policy = get_policy(torrent.get("category", ""))
+
+            if policy.has_share_limits and self._share_limits_stop:
+                limits = (
+                    policy.ratio if policy.ratio >= 0 else -2,
+                    policy.seeding_time_min if policy.seeding_time_min >= 0 else -2,
+                )
+                if (
+                    abs(torrent.get("ratio_limit", -2) - limits[0]) > 1e-3
+                    or torrent.get("seeding_time_limit", -2) != limits[1]
+                ):
+                    share_limits.setdefault(limits, []).append(torrent["hash"])
+
+            if policy.is_done(torrent) or self.__is_slow(torrent, policy, now):
+                to_stop.append(torrent["hash"])
+
+        for (ratio, seeding_time), hashes in share_limits.items():
+            await qbittorrent.set_share_limits(hashes, ratio, seeding_time)
+        if to_stop and await qbittorrent.pause_torrents(to_stop):
+            for infohash in to_stop:
+                self._windows.pop(infohash, None)
+            logger.info(f"Stopped seeding {len(to_stop)} torrents: {to_stop}")
+
+    def __is_slow(
+        self, torrent: qbittorrent.TorrentInfo, policy: SeedingPolicy, now: float
+    ) -> bool:
+        """
+        Whether the torrent uploaded slower than the policy's minimum over the last window.
+        """
+        if policy.min_upload_bytes <= 0:
+            return False
+        uploaded = torrent.get("uploaded", 0)
+        window = self._windows.setdefault(torrent["hash"], (now, uploaded))
+        elapsed = now - window[0]
+        if elapsed < SEEDING_RATE_WINDOW_S:
+            return False
+        if (uploaded - window[1]) / elapsed < policy.min_upload_bytes:
+            return True
+        self._windows[torrent["hash"]] = (now, uploaded)
+        return False
@@ -0,0 +1,326 @@
+import os
+import time
+import sqlite3
+import contextlib
+import pathlib
+import logging
+import threading
+from abc import ABC, abstractmethod
+
+from limits.storage import Storage
+
+logger = logging.getLogger(__name__)
+
+# memory:// for process-local state
+# sqlite:///relative/path.db or sqlite:////absolute/path.db to share the state between workers
+SHARED_STATE_URI = os.getenv("MOVIE_REQUEST_SERVER_SHARED_STATE_URI", "memory://")
+
+
+class ISharedState(ABC):
+    """
+    Key-value store with atomic counters and TTLs, shared by all the workers of the server.
+    TTLs are in seconds, None means the key never expires.
+    """
+
+    @abstractmethod
+    def incr(
+        self,
+        key: str,
+        amount: int = 1,
+        ttl_s: float | None = None,
+        refresh_ttl: bool = False,
+    ) -> int:
+        """
+        Atomically increment a counter and return the new value.
+        The TTL is set when the counter is created, or on every call if `refresh_ttl` is set.
+        """
+        ...
+
+    @abstractmethod
+    def get(self, key: str) -> str | None: ...
+
+    @abstractmethod
+    def get_expiry(self, key: str) -> float | None:
+        """
+        Unix time at which the key expires, None if it doesn't exist or never expires.
+        """
+        ...
+
+    @abstractmethod
+    def set_if_absent(self, key: str, value: str, ttl_s: float | None = None) -> bool:
+        """
+        Atomically set a key if it doesn't exist (or expired).
+        Returns whether the key was set.
+        """
+        ...
+
+    @abstractmethod
+    def delete(self, key: str) -> bool: ...
+
+    @abstractmethod
+    def scan(self, prefix: str) -> dict[str, str]:
+        """
+        All the live keys starting with `prefix` and their values.
+        """
+        ...
+
+    @abstractmethod
+    def clear(self) -> int: ...
+
+    @abstractmethod
+    def purge_expired(self) -> int: ...
+
+
+class MemorySharedState(ISharedState):
+    """
+    Process-local implementation, only correct with a single worker process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> (value, expires_at)
+        self._data: dict[str, tuple[str, float | None]] = {}
+
+    def __live(self, key: str) -> tuple[str, float | None] | None:
+        item = self._data.get(key)
+        if item is not None and item[1] is not None and item[1] <= time.time():
+            del self._data[key]
+            return None
+        return item
+
+    def incr(
+        self,
+        key: str,
+        amount: int = 1,
+        ttl_s: float | None = None,
+        refresh_ttl: bool = False,
+    ) -> int:
+        with self._lock:
+            expires_at = None if ttl_s is None else time.time() + ttl_s
+            item = self.__live(key)
+            if item is None:
+                value = amount
+            else:
+                value = int(item[0]) + amount
+                if not refresh_ttl:
+                    expires_at = item[1]
+            self._data[key] = (str(value), expires_at)
+            return value
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            item = self.__live(key)
+            return None if item is None else item[0]
+
+    def get_expiry(self, key: str) -> float | None:
+        with self._lock:
+            item = self.__live(key)
+            return None if item is None else item[1]
+
+    def set_if_absent(self, key: str, value: str, ttl_s: float | None = None) -> bool:
+        with self._lock:
+            if self.__live(key) is not None:
+                return False
+            self._data[key] = (value, None if ttl_s is None else time.time() + ttl_s)
+            return True
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def scan(self, prefix: str) -> dict[str, str]:
+        with self._lock:
+            ret = {}
+            for key in list(self._data):
+                if key.startswith(prefix) and (item := self.__live(key)) is not None:
+                    ret[key] = item[0]
+            return ret
+
+    def clear(self) -> int:
+        with self._lock:
+            ret = len(self._data)
+            self._data.clear()
+            return ret
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            before = len(self._data)
+            for key in list(self._data):
+                self.__live(key)
+            return before - len(self._data)
+
+
+class SqliteSharedState(ISharedState):
+    """
+    Implementation on top of a SQLite file, shared by all the processes that open it.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = pathlib.Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self.__transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+
+    def __conn(self) -> sqlite3.Connection:
+        # connections must not cross threads, nor forks
+        conn, pid = getattr(self._local, "conn", (None, None))
+        if conn is None or pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = (conn, os.getpid())
+        return conn
+
+    @contextlib.contextmanager
+    def __transaction(self):
+        conn = self.__conn()
+        # take the write lock right away so that read-modify-write is atomic
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def __delete_if_expired(conn: sqlite3.Connection, key: str):
+        conn.execute(
+            "DELETE FROM state WHERE key = ? AND expires_at <= ?", (key, time.time())
+        )
+
+    def incr(
+        self,
+        key: str,
+        amount: int = 1,
+        ttl_s: float | None = None,
+        refresh_ttl: bool = False,
+    ) -> int:
+        expires_at = None if ttl_s is None else time.time() + ttl_s
+        with self.__transaction() as conn:
+            self.__delete_if_expired(conn, key)
+            conn.execute(
+                "INSERT INTO state (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + excluded.value"
+                + (", expires_at = excluded.expires_at" if refresh_ttl else ""),
+                (key, amount, expires_at),
+            )
+            (value,) = conn.execute(
+                "SELECT value FROM state WHERE key = ?", (key,)
+            ).fetchone()
+            return int(value)
+
+    def __select(self, key: str) -> tuple[str, float | None] | None:
+        return (
+            self.__conn()
+            .execute(
+                "SELECT value, expires_at FROM state "
+                "WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, time.time()),
+            )
+            .fetchone()
+        )
+
+    def get(self, key: str) -> str | None:
+        row = self.__select(key)
+        return None if row is None else str(row[0])
+
+    def get_expiry(self, key: str) -> float | None:
+        row = self.__select(key)
+        return None if row is None else row[1]
+
+    def set_if_absent(self, key: str, value: str, ttl_s: float | None = None) -> bool:
+        with self.__transaction() as conn:
+            self.__delete_if_expired(conn, key)
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, None if ttl_s is None else time.time() + ttl_s),
+            )
+            return cursor.rowcount == 1
+
+    def delete(self, key: str) -> bool:
+        with self.__transaction() as conn:
+            return conn.execute("DELETE FROM state WHERE key = ?", (key,)).rowcount > 0
+
+    def scan(self, prefix: str) -> dict[str, str]:
+        # escape LIKE wildcards in the prefix
+        pattern = (
+            prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        )
+        rows = (
+            self.__conn()
+            .execute(
+                "SELECT key, value FROM state WHERE key LIKE ? ESCAPE '\\' "
+                "AND (expires_at IS NULL OR expires_at > ?)",
+                (pattern, time.time()),
+            )
+            .fetchall()
+        )
+        return {key: str(value) for key, value in rows}
+
+    def clear(self) -> int:
+        with self.__transaction() as conn:
+            return conn.execute("DELETE FROM state").rowcount
+
+    def purge_expired(self) -> int:
+        with self.__transaction() as conn:
+            return conn.execute(
+                "DELETE FROM state WHERE expires_at <= ?", (time.time(),)
+            ).rowcount
+
+
+def _sqlite_path(uri: str) -> str:
+    # sqlite:///relative/path.db -> relative/path.db, sqlite:////abs.db -> /abs.db
+    return uri[len("sqlite:///") :]
+
+
+def create_shared_state(uri: str) -> ISharedState:
+    if uri.startswith("memory://"):
+        return MemorySharedState()
+    if uri.startswith("sqlite:///"):
+        return SqliteSharedState(_sqlite_path(uri))
+    raise ValueError(f"Unsupported shared state uri: {uri}")
+
+
+class SqliteLimiterStorage(Storage):
+    """
+    flask_limiter (limits) storage for sqlite:// uris, backed by SqliteSharedState.
+    """
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri: str, wrap_exceptions: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self._state = SqliteSharedState(_sqlite_path(uri))
+
+    @property
+    def base_exceptions(self) -> type[Exception] | tuple[type[Exception], ...]:
+        return sqlite3.Error
+
+    def incr(
+        self, key: str, expiry: int, elastic_expiry: bool = False, amount: int = 1
+    ) -> int:
+        return self._state.incr(key, amount, expiry, refresh_ttl=elastic_expiry)
+
+    def get(self, key: str) -> int:
+        return int(self._state.get(key) or 0)
+
+    def get_expiry(self, key: str) -> float:
+        return self._state.get_expiry(key) or time.time()
+
+    def check(self) -> bool:
+        try:
+            self._state.get("")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self) -> int | None:
+        return self._state.clear()
+
+    def clear(self, key: str) -> None:
+        self._state.delete(key)
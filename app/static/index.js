@@ -1,6 +1,7 @@
 async function loadUserProfile() {
     const res = await fetch('/fragment/user', {
         method: 'GET',
+        cache: 'no-cache',
         headers: { 'Content-Type': 'application/json' }
     });
     if (res.ok) {
@@ -41,32 +42,182 @@ async function onClick_searchBtn(btn) {
     }
 }
 
+// suggestions come from the results of previous searches, Jackett is only queried on Run
+let searchTypeaheadTimer = null;
+let searchTypeaheadController = null;
+
+function onInput_searchInput(inputElem) {
+    clearTimeout(searchTypeaheadTimer);
+    if (document.getElementById('searchType').value === 'magnet') {
+        return;
+    }
+    searchTypeaheadTimer = setTimeout(() => fetchSearchSuggestions(inputElem.value), 150);
+}
+
+async function fetchSearchSuggestions(query) {
+    // only the suggestions of the latest input are shown
+    if (searchTypeaheadController) {
+        searchTypeaheadController.abort();
+    }
+    searchTypeaheadController = new AbortController();
+    const datalist = document.getElementById('searchSuggestions');
+    try {
+        const res = await fetch(`/api/search/typeahead?${new URLSearchParams({ q: query })}`, {
+            signal: searchTypeaheadController.signal
+        });
+        if (!res.ok) {
+            return;
+        }
+        const { suggestions } = await res.json();
+        datalist.replaceChildren(...suggestions.map(suggestion => {
+            const option = document.createElement('option');
+            option.value = suggestion;
+            return option;
+        }));
+    } catch (e) {
+        if (e.name !== 'AbortError') {
+            console.error('Failed to fetch search suggestions', e);
+        }
+    }
+}
+
+// etag of the stats fragment currently displayed
+let qbittorrentStatsEtag = null;
+// page, sorting and filtering of the stats table, applied server-side
+const qbittorrentStatsQuery = { page: 1, sort: 'added', order: 'desc', q: '' };
+let qbittorrentStatsFilterTimer = null;
+let qbittorrentStatsRetryTimer = null;
+
+function setQBitTorrentStatsPage(page) {
+    qbittorrentStatsQuery.page = page;
+    fetchQBitTorrentStats();
+}
+
+function sortQBitTorrentStats(sort) {
+    if (qbittorrentStatsQuery.sort === sort) {
+        qbittorrentStatsQuery.order = qbittorrentStatsQuery.order === 'asc' ? 'desc' : 'asc';
+    } else {
+        qbittorrentStatsQuery.sort = sort;
+        qbittorrentStatsQuery.order = 'asc';
+    }
+    qbittorrentStatsQuery.page = 1;
+    fetchQBitTorrentStats();
+}
+
+function onKeyup_qbittorrentStatsFilter(inputElem) {
+    clearTimeout(qbittorrentStatsFilterTimer);
+    qbittorrentStatsFilterTimer = setTimeout(() => {
+        qbittorrentStatsQuery.q = inputElem.value.trim();
+        qbittorrentStatsQuery.page = 1;
+        fetchQBitTorrentStats();
+    }, 300);
+}
+
 async function fetchQBitTorrentStats() {
-    const res = await fetch('/fragment/qbittorrent/stats', {
+    const headers = { 'Content-Type': 'application/json' };
+    if (qbittorrentStatsEtag) {
+        headers['If-None-Match'] = qbittorrentStatsEtag;
+    }
+    const params = new URLSearchParams(qbittorrentStatsQuery);
+    // bypass the browser cache so that a 304 reaches us and the table is left untouched
+    const res = await fetch(`/fragment/qbittorrent/stats?${params}`, {
         method: 'GET',
-        headers: { 'Content-Type': 'application/json' }
+        cache: 'no-store',
+        headers
     });
-    if (res.ok) {
-        const html = await res.text();
-        document.getElementById('qbittorrent-stats-holder').innerHTML = html;
-        filterTable(document.getElementById('qbittorrent-stats-filter'));
+    if (res.status === 304) return;
+    if (res.status === 429) {
+        // rate limited, retry once with the latest page, sorting and filter
+        clearTimeout(qbittorrentStatsRetryTimer);
+        const retryAfterS = Number(res.headers.get('Retry-After')) || 1;
+        qbittorrentStatsRetryTimer = setTimeout(fetchQBitTorrentStats, retryAfterS * 1000);
+        return;
     }
+    if (!res.ok) {
+        console.error(`Failed to fetch the torrent stats: ${res.status} ${await res.text()}`);
+        return;
+    }
+    qbittorrentStatsEtag = res.headers.get('ETag');
+    const html = await res.text();
+    document.getElementById('qbittorrent-stats-holder').innerHTML = html;
 }
 
-async function onClick_torrentRequestBtn(torrentTitle, torrentLink, torrentSize, btn) {
-    btn.disabled = true;
-    const originalText = btn.innerText;
-    btn.innerText = "Working...";
+async function waitForRequestJob(jobId) {
+    while (true) {
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        const res = await fetch(`/api/request/job/${jobId}`, { cache: 'no-store' });
+        if (!res.ok) {
+            return { state: 'failed', message: await res.text() };
+        }
+        const job = await res.json();
+        if (job.state === 'done' || job.state === 'failed') {
+            return job;
+        }
+    }
+}
+
+async function postTorrentRequest(body) {
     const res = await fetch('/api/request', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ torrentTitle, torrentLink, torrentSize })
+        body: JSON.stringify(body)
+    });
+    if (res.status !== 409) return res;
+
+    // another release of the same media is already requested, offer to join it
+    const duplicate = (await res.json()).duplicates[0];
+    const join = confirm(
+        `"${duplicate.name}" is already requested by ${duplicate.ref_count} user(s). ` +
+        `Join that request instead of downloading another release?`
+    );
+    if (join) {
+        return postJoinRequest(duplicate.infohash);
+    }
+    return postTorrentRequest({ ...body, allowDuplicate: true });
+}
+
+// the torrent is already in qBittorrent, the request is recorded right away
+async function postJoinRequest(torrentHash) {
+    return fetch('/api/request/join', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ torrentHash })
     });
+}
 
+async function handleTorrentRequestResponse(res) {
     if (!res.ok) {
         const errorMessage = await res.text();
         alert(`Error submitting request: ${errorMessage}`);
+        return;
     }
+    if (res.status === 202) {
+        // the request is processed in the background
+        const job = await waitForRequestJob((await res.json()).id);
+        if (job.state === 'failed') {
+            alert(`Error submitting request: ${job.message}`);
+            return;
+        }
+    }
+    await fetchQBitTorrentStats();
+}
+
+async function onClick_torrentRequestBtn(torrentTitle, torrentLink, torrentSize, btn, torrentHash = null) {
+    btn.disabled = true;
+    const originalText = btn.innerText;
+    btn.innerText = "Working...";
+    await handleTorrentRequestResponse(
+        await postTorrentRequest({ torrentTitle, torrentLink, torrentSize, torrentHash })
+    );
+    btn.disabled = false;
+    btn.innerText = originalText;
+}
+
+async function onClick_joinRequestBtn(torrentHash, btn) {
+    btn.disabled = true;
+    const originalText = btn.innerText;
+    btn.innerText = "Working...";
+    await handleTorrentRequestResponse(await postJoinRequest(torrentHash));
     btn.disabled = false;
     btn.innerText = originalText;
 }
@@ -121,9 +272,66 @@ function filterTable(inputElem) {
     }
 }
 
+function formatProgress(progress) {
+    const bars = Math.floor(progress * 10);
+    const bar = Array.from({ length: 10 }, (_, i) => i < bars ? '#' : '-').join(' ');
+    return `${(progress * 100).toFixed(1)}% <code>[ ${bar} ]</code>`;
+}
+
+function patchQBitTorrentStatsRow(update) {
+    const row = document.querySelector(`#qbittorrent-stats-table tr[data-hash="${update.hash}"]`);
+    // not on the current page
+    if (!row) return true;
+    if (update.progress === 1.0) {
+        // completed rows have a different layout
+        return false;
+    }
+    row.querySelector('[data-field="dlspeed"]').textContent =
+        update.dlspeed ? `${(update.dlspeed / 1024).toFixed(2)} KB/s` : 'Unknown';
+    row.querySelector('[data-field="progress"]').innerHTML = formatProgress(update.progress);
+    row.querySelector('[data-field="eta"]').textContent = `${Math.floor(update.eta / 60)} min`;
+    return true;
+}
+
+function subscribeQBitTorrentStats() {
+    if (!window.EventSource) return false;
+
+    const source = new EventSource('/events/qbittorrent/stats');
+    source.addEventListener('update', (e) => {
+        const updates = JSON.parse(e.data);
+        const patched = updates.every(patchQBitTorrentStatsRow);
+        if (!patched) {
+            fetchQBitTorrentStats();
+        }
+    });
+    source.addEventListener('reload', () => fetchQBitTorrentStats());
+    let opened = false;
+    source.addEventListener('open', () => {
+        // the server closes streams after a while, catch up on what was missed since
+        if (opened) {
+            fetchQBitTorrentStats();
+        }
+        opened = true;
+    });
+    source.addEventListener('error', () => {
+        // refused (e.g. 503, too many streams), EventSource doesn't retry those
+        if (source.readyState === EventSource.CLOSED) {
+            pollQBitTorrentStats();
+        }
+    });
+    return true;
+}
+
+function pollQBitTorrentStats() {
+    setInterval(fetchQBitTorrentStats, 5000);
+}
+
 document.addEventListener('DOMContentLoaded', async () => {
     await loadUserProfile();
     await fetchQBitTorrentStats();
 
-    setInterval(fetchQBitTorrentStats, 5000);
+    if (!subscribeQBitTorrentStats()) {
+        // no server-sent events support, fall back to polling
+        pollQBitTorrentStats();
+    }
 });
@@ -0,0 +1,129 @@
+import os
+import queue
+import logging
+import threading
+from dataclasses import dataclass, field
+
+import app.db as db
+import app.qbittorrent as qbittorrent
+
+logger = logging.getLogger(__name__)
+
+STATUS_FEED_INTERVAL_S = float(
+    os.getenv("MOVIE_REQUEST_SERVER_STATUS_FEED_INTERVAL_S", 2)
+)
+# max number of undelivered events per subscriber before it is asked to reload
+STATUS_FEED_QUEUE_SIZE = 64
+
+# torrent fields pushed to the clients, see qbittorrent_stats.html
+STATUS_FIELDS = ("progress", "dlspeed", "eta", "state")
+
+
+@dataclass(eq=False)
+class Subscription:
+    user: db.User
+    # (event name, payload)
+    events: queue.Queue[tuple[str, object]] = field(
+        default_factory=lambda: queue.Queue(STATUS_FEED_QUEUE_SIZE)
+    )
+    # the torrents the subscriber currently displays, None until the first poll
+    hashes: set[str] | None = None
+
+    def publish(self, event: str, payload: object):
+        try:
+            self.events.put_nowait((event, payload))
+        except queue.Full:
+            # the client is too slow, drop everything and let it fetch a fresh table
+            logger.warning(f"Status feed queue of {self.user.username} is full")
+            with self.events.mutex:
+                self.events.queue.clear()
+            self.events.put_nowait(("reload", None))
+
+
+class StatusFeed:
+    """
+    Polls qbittorrent once for all the connected clients and fans out
+    the changed torrent fields to each of them.
+    """
+
+    def __init__(self, database: db.IDatabase):
+        self._db = database
+        self._lock = threading.Lock()
+        self._subscriptions: set[Subscription] = set()
+        self._last: dict[str, dict] = {}
+
+    def subscribe(
+        self, user: db.User, max_subscriptions: int | None = None
+    ) -> Subscription | None:
+        """
+        Returns None if `max_subscriptions` are already connected.
+        """
+        sub = Subscription(user)
+        with self._lock:
+            if (
+                max_subscriptions is not None
+                and len(self._subscriptions) >= max_subscriptions
+            ):
+                return None
+            self._subscriptions.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subscriptions.discard(sub)
+
+    def notify(self, user_id: str, event: str, payload: object):
+        """
+        Push an event to all the connected clients of a user.
+        """
+        with self._lock:
+            subscriptions = [s for s in self._subscriptions if s.user.id == user_id]
+        for sub in subscriptions:
+            sub.publish(event, payload)
+
+    async def poll(self):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        if not subscriptions:
+            self._last.clear()
+            return
+
+        user_hashes: dict[db.User, set[str]] = {}
+        for sub in subscriptions:
+            if sub.user not in user_hashes:
+                requests = await self._db.get_requests(sub.user)
+                user_hashes[sub.user] = {req.torrent.infohash for req in requests}
+
+        all_hashes = set().union(*user_hashes.values())
+        current: dict[str, dict] = {}
+        if all_hashes:
+            torrents = await qbittorrent.get_torrent_list(hashes=sorted(all_hashes))
+            if torrents is None:
+                return
+            for torrent in torrents:
+                current[torrent["hash"]] = {
+                    name: torrent.get(name) for name in STATUS_FIELDS
+                }
+
+        changed = {
+            infohash: {"hash": infohash, **fields}
+            for infohash, fields in current.items()
+            if self._last.get(infohash) != fields
+        }
+        self._last = current
+
+        for sub in subscriptions:
+            hashes = user_hashes[sub.user]
+            if sub.hashes is not None and hashes != sub.hashes:
+                # rows were added or removed, the client has to re-render the table
+                sub.publish("reload", None)
+            elif sub.hashes is None:
+                # first poll since the client connected, sync all of its rows
+                updates = [{"hash": h, **current[h]} for h in hashes if h in current]
+                if updates:
+                    sub.publish("update", updates)
+            else:
+                updates = [changed[h] for h in hashes if h in changed]
+                if updates:
+                    sub.publish("update", updates)
+            sub.hashes = hashes
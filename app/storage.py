@@ -2,11 +2,27 @@ import logging
 import shutil
 import os
 import json
+import random
+import itertools
+import posixpath
+from dataclasses import dataclass
+
+import app.qbittorrent as qbittorrent
 
 logger = logging.getLogger(__name__)
 
 
-def parse_mount_points(storage_config_file: str) -> list[tuple[str, str]]:
+@dataclass(frozen=True)
+class MountPoint:
+    qbittorrent_path: str
+    movie_request_server_path: str
+    # relative preference used by the weighted strategy
+    weight: float = 1.0
+    # max number of concurrent downloads on this mount, None means unlimited
+    max_active_downloads: int | None = None
+
+
+def parse_mount_points(storage_config_file: str) -> list[MountPoint]:
     """
     Parse the mount points from the environment variable.
     """
@@ -21,7 +37,19 @@ def parse_mount_points(storage_config_file: str) -> list[tuple[str, str]]:
                     f"Mount point {movie_request_server_path} does not exist, ignoring"
                 )
                 continue
-            ret.append((qbittorrent_path.strip(), movie_request_server_path.strip()))
+            max_active_downloads = storage_config.get("max_active_downloads", None)
+            ret.append(
+                MountPoint(
+                    qbittorrent_path=qbittorrent_path.strip(),
+                    movie_request_server_path=movie_request_server_path.strip(),
+                    weight=float(storage_config.get("weight", 1.0)),
+                    max_active_downloads=(
+                        None
+                        if max_active_downloads is None
+                        else int(max_active_downloads)
+                    ),
+                )
+            )
             logger.info(f"Loaded Mount point: {storage_config}")
 
     if not ret:
@@ -39,32 +67,230 @@ QBITTORRENT_DOWNLOAD_SUBFOLDER = os.getenv("QBITTORRENT_DOWNLOAD_SUBFOLDER", "")
 if QBITTORRENT_DOWNLOAD_SUBFOLDER:
     logger.info(f"Download subfolder: {QBITTORRENT_DOWNLOAD_SUBFOLDER}")
 
-def get_best_path(file_size_bytes: int) -> str | None:
+
+def _normalize_path(path: str) -> str:
+    # qbittorrent may run on windows, so compare paths case-insensitively with "/" separators
+    return path.replace("\\", "/").rstrip("/").casefold() + "/"
+
+
+def find_mount_point(qbittorrent_save_path: str) -> MountPoint | None:
     """
-    Choose a disk mount point that has enough space to store a file of given size.
-    Picks the one with the most free space among eligible ones.
+    Find the mount point that contains a qbittorrent save path.
+    Picks the most specific one if mount points are nested.
     """
-    candidates = []
+    save_path = _normalize_path(qbittorrent_save_path)
+    ret = None
+    for mount_point in MOUNT_POINTS:
+        mount_path = _normalize_path(mount_point.qbittorrent_path)
+        if save_path.startswith(mount_path):
+            if ret is None or len(mount_path) > len(
+                _normalize_path(ret.qbittorrent_path)
+            ):
+                ret = mount_point
+    return ret
+
+
+def relative_to_mount(qbittorrent_save_path: str, mount_point: MountPoint) -> str:
+    """
+    Strip the qbittorrent mount path from a qbittorrent save path.
+    """
+    path = qbittorrent_save_path.replace("\\", "/")
+    mount_path = mount_point.qbittorrent_path.replace("\\", "/").rstrip("/")
+    assert _normalize_path(path).startswith(
+        _normalize_path(mount_path)
+    ), f"{qbittorrent_save_path} is not in {mount_point.qbittorrent_path}"
+    return path[len(mount_path) :].strip("/")
+
+
+def rebase_save_path(
+    qbittorrent_save_path: str, src: MountPoint, dst: MountPoint
+) -> str:
+    """
+    Translate a qbittorrent save path on mount `src` to the same location on mount `dst`.
+    """
+    relative_path = relative_to_mount(qbittorrent_save_path, src)
+    if not relative_path:
+        return dst.qbittorrent_path
+    return posixpath.join(dst.qbittorrent_path.replace("\\", "/"), relative_path)
+
+
+# torrent states that are (or will soon be) writing to disk
+ACTIVE_DOWNLOAD_STATES = {
+    qbittorrent.TorrentState.DOWNLOADING,
+    qbittorrent.TorrentState.FORCED_DL,
+    qbittorrent.TorrentState.META_DL,
+    qbittorrent.TorrentState.STALLED_DL,
+    qbittorrent.TorrentState.QUEUED_DL,
+    qbittorrent.TorrentState.ALLOCATING,
+    qbittorrent.TorrentState.CHECKING_DL,
+}
+
+
+async def get_active_downloads() -> dict[MountPoint, int] | None:
+    """
+    Count the active downloads per mount point based on the qbittorrent save paths.
+    Returns None if qbittorrent cannot be reached.
+    """
+    torrents = await qbittorrent.get_torrent_list(
+        filter=qbittorrent.GetTorrentListFilter.DOWNLOADING,
+    )
+    if torrents is None:
+        return None
+
+    ret = {mount_point: 0 for mount_point in MOUNT_POINTS}
+    for torrent in torrents:
+        if torrent.get("state") not in ACTIVE_DOWNLOAD_STATES:
+            continue
+        mount_point = find_mount_point(torrent.get("save_path", ""))
+        if mount_point is not None:
+            ret[mount_point] += 1
+    return ret
+
+
+@dataclass(frozen=True)
+class PlacementCandidate:
+    mount_point: MountPoint
+    free_bytes: int
+    active_downloads: int
+
+
+def _most_free(candidates: list[PlacementCandidate]) -> PlacementCandidate:
+    return max(candidates, key=lambda c: c.free_bytes)
 
-    for qbittorrent_path, movie_request_server_path in MOUNT_POINTS:
+
+def _free_space_weighted(candidates: list[PlacementCandidate]) -> PlacementCandidate:
+    # random pick proportional to free space, so that concurrent requests spread over disks
+    weights = [c.free_bytes * c.mount_point.weight for c in candidates]
+    if sum(weights) <= 0:
+        return _most_free(candidates)
+    return random.choices(candidates, weights=weights, k=1)[0]
+
+
+def _least_active(candidates: list[PlacementCandidate]) -> PlacementCandidate:
+    return min(candidates, key=lambda c: (c.active_downloads, -c.free_bytes))
+
+
+g_round_robin_counter = itertools.count()
+
+
+def _round_robin(candidates: list[PlacementCandidate]) -> PlacementCandidate:
+    # candidates are in config order, so this cycles through the eligible mounts
+    return candidates[next(g_round_robin_counter) % len(candidates)]
+
+
+PLACEMENT_STRATEGIES = {
+    "most_free": _most_free,
+    "free_space_weighted": _free_space_weighted,
+    "least_active": _least_active,
+    "round_robin": _round_robin,
+}
+
+PLACEMENT_STRATEGY = os.getenv(
+    "MOVIE_REQUEST_SERVER_PLACEMENT_STRATEGY", "most_free"
+).lower()
+if PLACEMENT_STRATEGY not in PLACEMENT_STRATEGIES:
+    logger.error(
+        f"Unknown placement strategy {PLACEMENT_STRATEGY}, falling back to most_free"
+    )
+    PLACEMENT_STRATEGY = "most_free"
+logger.info(f"Placement strategy: {PLACEMENT_STRATEGY}")
+
+
+def _free_bytes() -> dict[MountPoint, int]:
+    ret = {}
+    for mount_point in MOUNT_POINTS:
         try:
-            usage = shutil.disk_usage(movie_request_server_path)
-            if usage.free >= file_size_bytes:
-                candidates.append((usage.free, qbittorrent_path))
+            ret[mount_point] = shutil.disk_usage(
+                mount_point.movie_request_server_path
+            ).free
         except FileNotFoundError:
             continue  # skip if mount point is missing
+    return ret
+
+
+def _pick_mount_point(
+    file_size_bytes: int,
+    free_bytes: dict[MountPoint, int],
+    active_downloads: dict[MountPoint, int],
+    strategy: str | None,
+) -> MountPoint | None:
+    candidates = [
+        PlacementCandidate(
+            mount_point=mount_point,
+            free_bytes=free,
+            active_downloads=active_downloads.get(mount_point, 0),
+        )
+        for mount_point, free in free_bytes.items()
+        if free >= file_size_bytes
+    ]
 
     if not candidates:
         return None  # No disk can hold the file
 
-    # Return the mount point with most free space
-    candidates.sort(reverse=True)
-    ret = candidates[0][1]
+    uncapped = [
+        c
+        for c in candidates
+        if c.mount_point.max_active_downloads is None
+        or c.active_downloads < c.mount_point.max_active_downloads
+    ]
+    if uncapped:
+        candidates = uncapped
+    else:
+        logger.warning("All mount points reached their download cap, ignoring caps")
+
+    pick = PLACEMENT_STRATEGIES[strategy or PLACEMENT_STRATEGY]
+    return pick(candidates).mount_point
+
+
+def _download_path(mount_point: MountPoint) -> str:
+    ret = mount_point.qbittorrent_path
     if QBITTORRENT_DOWNLOAD_SUBFOLDER:
         return os.path.join(ret, QBITTORRENT_DOWNLOAD_SUBFOLDER)
     return ret
 
 
+def get_best_path(
+    file_size_bytes: int,
+    active_downloads: dict[MountPoint, int] | None = None,
+    strategy: str | None = None,
+) -> str | None:
+    """
+    Choose a disk mount point that has enough space to store a file of given size.
+    Mount points that reached their `max_active_downloads` are skipped unless all of them did.
+    The pick among eligible ones is delegated to the placement strategy.
+    :param active_downloads: number of active downloads per mount point, see `get_active_downloads`
+    :param strategy: name of the placement strategy, defaults to `PLACEMENT_STRATEGY`
+    """
+    mount_point = _pick_mount_point(
+        file_size_bytes, _free_bytes(), active_downloads or {}, strategy
+    )
+    return None if mount_point is None else _download_path(mount_point)
+
+
+def plan_placements(
+    file_sizes_bytes: list[int],
+    active_downloads: dict[MountPoint, int] | None = None,
+    strategy: str | None = None,
+) -> list[str | None]:
+    """
+    `get_best_path` for several files at once, each pick accounts for the space
+    and the download slot taken by the previous ones.
+    """
+    free_bytes = _free_bytes()
+    active_downloads = dict(active_downloads or {})
+    ret: list[str | None] = []
+    for file_size_bytes in file_sizes_bytes:
+        mount_point = _pick_mount_point(
+            file_size_bytes, free_bytes, active_downloads, strategy
+        )
+        if mount_point is None:
+            ret.append(None)
+            continue
+        free_bytes[mount_point] -= file_size_bytes
+        active_downloads[mount_point] = active_downloads.get(mount_point, 0) + 1
+        ret.append(_download_path(mount_point))
+    return ret
+
 if __name__ == "__main__":
     # Example usage
     print(MOUNT_POINTS)
@@ -0,0 +1,267 @@
+import os
+import time
+import enum
+import shutil
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable
+
+import app.qbittorrent as qbittorrent
+import app.storage as storage
+
+logger = logging.getLogger(__name__)
+
+WATCHDOG_INTERVAL_S = float(
+    os.getenv("MOVIE_REQUEST_SERVER_WATCHDOG_INTERVAL_S", 60)
+)
+# free space to keep on every mount
+WATCHDOG_RESERVE_BYTES = int(
+    float(os.getenv("MOVIE_REQUEST_SERVER_WATCHDOG_RESERVE_GB", 5)) * 1024**3
+)
+# pause downloads if the mount is projected to fill up within this time
+WATCHDOG_HORIZON_S = float(os.getenv("MOVIE_REQUEST_SERVER_WATCHDOG_HORIZON_S", 3600))
+# download limit applied to the throttled torrents before they get paused
+WATCHDOG_RATE_LIMIT_BYTES = int(
+    float(os.getenv("MOVIE_REQUEST_SERVER_WATCHDOG_RATE_LIMIT_KBPS", 1024)) * 1024
+)
+# paused torrents are resumed once the mount stayed below critical for this many checks,
+# or as soon as everything fits. resuming refills the mount, so they would pause again
+WATCHDOG_RESUME_CHECKS = int(os.getenv("MOVIE_REQUEST_SERVER_WATCHDOG_RESUME_CHECKS", 5))
+# number of free space samples used to compute the growth rate
+WATCHDOG_HISTORY_SIZE = 10
+
+
+class PressureLevel(str, enum.Enum):
+    # remaining bytes of the active downloads fit on the mount
+    OK = "ok"
+    # remaining bytes do not fit, but the mount won't fill up within the horizon
+    # the lowest priority downloads are rate-limited
+    WARNING = "warning"
+    # the mount will fill up within the horizon
+    # the lowest priority downloads are paused
+    CRITICAL = "critical"
+
+
+@dataclass
+class MountStatus:
+    mount: str
+    free_bytes: int = 0
+    growth_bytes_per_s: float = 0
+    remaining_bytes: int = 0
+    time_to_full_s: float | None = None
+    level: PressureLevel = PressureLevel.OK
+    throttled: list[str] = field(default_factory=list)
+    changed_at: float = field(default_factory=time.time)
+
+    def to_dict(self) -> dict:
+        return {
+            "mount": self.mount,
+            "free_bytes": self.free_bytes,
+            "growth_bytes_per_s": self.growth_bytes_per_s,
+            "remaining_bytes": self.remaining_bytes,
+            "time_to_full_s": self.time_to_full_s,
+            "level": self.level.value,
+            "throttled": self.throttled,
+            "changed_at": self.changed_at,
+        }
+
+
+class DiskWatchdog:
+    """
+    Samples the free space of every mount point and throttles the downloads on it
+    before qbittorrent runs out of space.
+    """
+
+    def __init__(self):
+        self._samples: dict[storage.MountPoint, deque[tuple[float, int]]] = {}
+        self._status: dict[storage.MountPoint, MountStatus] = {}
+        # consecutive checks of each mount below the critical level
+        self._calm_checks: dict[storage.MountPoint, int] = {}
+        # torrents currently paused or rate-limited by the watchdog
+        self._paused: set[str] = set()
+        self._limited: set[str] = set()
+        self._listeners: list[Callable[[MountStatus], None]] = []
+        # download limit a torrent gets back when the watchdog stops limiting it
+        self._base_limit: Callable[[str], int] = lambda infohash: 0
+
+    def subscribe(self, listener: Callable[[MountStatus], None]):
+        """
+        Register a callback invoked whenever the pressure level of a mount changes.
+        """
+        self._listeners.append(listener)
+
+    def set_base_limit(self, base_limit: Callable[[str], int]):
+        """
+        Register the download limit set by others on a torrent, e.g. its fair share.
+        """
+        self._base_limit = base_limit
+
+    @property
+    def limited(self) -> set[str]:
+        """
+        Torrents currently rate-limited by the watchdog.
+        """
+        return set(self._limited)
+
+    def get_status(self) -> list[MountStatus]:
+        return list(self._status.values())
+
+    async def check(self):
+        torrents = await qbittorrent.get_torrent_list(
+            category=qbittorrent.QBITTORRENT_CATEGORY or None
+        )
+        if torrents is None:
+            logger.warning("Disk watchdog could not fetch the torrent list")
+            return
+
+        known_hashes = {torrent["hash"] for torrent in torrents}
+        self._paused &= known_hashes
+        self._limited &= known_hashes
+
+        torrents_by_mount: dict[storage.MountPoint, list[qbittorrent.TorrentInfo]] = {
+            mount_point: [] for mount_point in storage.MOUNT_POINTS
+        }
+        for torrent in torrents:
+            mount_point = storage.find_mount_point(torrent.get("save_path", ""))
+            if mount_point is not None:
+                torrents_by_mount[mount_point].append(torrent)
+
+        now = time.monotonic()
+        for mount_point, mount_torrents in torrents_by_mount.items():
+            await self.__check_mount(mount_point, mount_torrents, now)
+
+    async def __check_mount(
+        self,
+        mount_point: storage.MountPoint,
+        torrents: list[qbittorrent.TorrentInfo],
+        now: float,
+    ):
+        try:
+            usage = shutil.disk_usage(mount_point.movie_request_server_path)
+        except FileNotFoundError:
+            logger.warning(
+                f"Mount point {mount_point.movie_request_server_path} is missing"
+            )
+            return
+
+        samples = self._samples.setdefault(
+            mount_point, deque(maxlen=WATCHDOG_HISTORY_SIZE)
+        )
+        samples.append((now, usage.free))
+
+        # torrents paused by us still count, or they would be resumed on the next check
+        downloading = [
+            torrent
+            for torrent in torrents
+            if torrent.get("state") in storage.ACTIVE_DOWNLOAD_STATES
+            or torrent["hash"] in self._paused
+        ]
+        remaining = sum(torrent.get("amount_left", 0) for torrent in downloading)
+        usable = usage.free - WATCHDOG_RESERVE_BYTES
+
+        growth = sum(torrent.get("dlspeed", 0) for torrent in downloading)
+        if len(samples) >= 2:
+            (t0, free0), (t1, free1) = samples[0], samples[-1]
+            if t1 > t0:
+                growth = max(growth, (free0 - free1) / (t1 - t0))
+
+        time_to_full = None
+        if growth > 0:
+            time_to_full = max(0, usable) / growth
+
+        if remaining <= usable:
+            level = PressureLevel.OK
+        elif usable <= 0 or (
+            time_to_full is not None and time_to_full < WATCHDOG_HORIZON_S
+        ):
+            level = PressureLevel.CRITICAL
+        else:
+            level = PressureLevel.WARNING
+
+        # throttle the lowest priority torrents until the rest fits
+        victims: list[str] = []
+        if level != PressureLevel.OK:
+            by_priority = sorted(
+                downloading,
+                key=lambda t: (t.get("priority", 0), t.get("added_on", 0)),
+                reverse=True,
+            )
+            for torrent in by_priority:
+                if remaining <= usable:
+                    break
+                victims.append(torrent["hash"])
+                remaining -= torrent.get("amount_left", 0)
+
+        mount_hashes = {torrent["hash"] for torrent in torrents}
+        to_pause = victims if level == PressureLevel.CRITICAL else []
+        to_limit = victims if level == PressureLevel.WARNING else []
+        if level == PressureLevel.CRITICAL:
+            self._calm_checks[mount_point] = 0
+        else:
+            self._calm_checks[mount_point] = self._calm_checks.get(mount_point, 0) + 1
+        if (
+            level == PressureLevel.WARNING
+            and self._calm_checks[mount_point] < WATCHDOG_RESUME_CHECKS
+        ):
+            # keep the paused torrents paused for a while, the others are only rate-limited
+            to_pause = sorted(self._paused & mount_hashes)
+            to_limit = [h for h in to_limit if h not in self._paused]
+        await self.__apply(mount_hashes, to_pause, to_limit)
+
+        prev = self._status.get(mount_point)
+        changed = prev is None or prev.level != level
+        status = MountStatus(
+            mount=mount_point.movie_request_server_path,
+            free_bytes=usage.free,
+            growth_bytes_per_s=growth,
+            remaining_bytes=sum(t.get("amount_left", 0) for t in downloading),
+            time_to_full_s=time_to_full,
+            level=level,
+            throttled=victims,
+            changed_at=time.time() if changed or prev is None else prev.changed_at,
+        )
+        self._status[mount_point] = status
+
+        if changed:
+            logger.log(
+                logging.INFO if level == PressureLevel.OK else logging.WARNING,
+                f"Mount {status.mount} pressure level changed to {level.value}: "
+                f"free={usage.free} remaining={status.remaining_bytes} throttled={victims}",
+            )
+            for listener in self._listeners:
+                try:
+                    listener(status)
+                except Exception as e:
+                    logger.exception(f"Disk watchdog listener failed: {e}")
+
+    async def __apply(
+        self, mount_hashes: set[str], to_pause: list[str], to_limit: list[str]
+    ):
+        """
+        Pause and rate-limit the given torrents of a mount, undo it for the other ones.
+        """
+        to_resume = [h for h in self._paused & mount_hashes if h not in to_pause]
+        to_unlimit = [h for h in self._limited & mount_hashes if h not in to_limit]
+        new_pause = [h for h in to_pause if h not in self._paused]
+        new_limit = [h for h in to_limit if h not in self._limited]
+
+        if to_resume and await qbittorrent.resume_torrents(to_resume):
+            self._paused.difference_update(to_resume)
+        by_limit: dict[int, list[str]] = {}
+        for infohash in to_unlimit:
+            by_limit.setdefault(self._base_limit(infohash), []).append(infohash)
+        for limit, hashes in by_limit.items():
+            if await qbittorrent.set_download_limit(hashes, limit):
+                self._limited.difference_update(hashes)
+        if new_pause and await qbittorrent.pause_torrents(new_pause):
+            self._paused.update(new_pause)
+        by_limit = {}
+        for infohash in new_limit:
+            limit = WATCHDOG_RATE_LIMIT_BYTES
+            if self._base_limit(infohash) > 0:
+                limit = min(limit, self._base_limit(infohash))
+            by_limit.setdefault(limit, []).append(infohash)
+        for limit, hashes in by_limit.items():
+            if await qbittorrent.set_download_limit(hashes, limit):
+                self._limited.update(hashes)
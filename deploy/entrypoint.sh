@@ -5,4 +5,11 @@ _log_dir=$_root_dir/_logs
 
 mkdir -p $_log_dir
 
-uv run gunicorn -c $_root_dir/tool/gunicorn.conf.py 'app.main:init_app()'
\ No newline at end of file
+# fingerprint and precompress the static files
+(cd $_root_dir && uv run python -m app.assets)
+
+if [ "${MOVIE_REQUEST_SERVER_ASGI:-false}" = "true" ]; then
+    uv run uvicorn --env-file $_root_dir/.env --host 0.0.0.0 --port ${MOVIE_REQUEST_SERVER_PORT:-8000} 'app.asgi:g_asgi_app'
+else
+    uv run gunicorn -c $_root_dir/tool/gunicorn.conf.py 'app.main:create_app()'
+fi
@@ -0,0 +1,295 @@
+"""
+Scaling benchmark of the request database: generates synthetic request histories and measures
+load time, save time, memory and the latency of the `IDatabase` operations at each scale.
+
+    python tests/bench_db.py --scales 1000:10000,10000:100000 --json bench_db.json
+    python tests/bench_db.py --backend mypackage.mymodule:MyDatabase
+
+Each scale runs in a fresh process so that the memory figures are not polluted by the previous runs.
+Backends are constructed with a path, `BACKENDS` knows how to seed the built-in ones directly in
+their storage format, others are seeded through `make_request`.
+qBittorrent is not called: the deletion `cancel_request` triggers is replaced by a no-op.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import pathlib
+import argparse
+import tempfile
+import importlib
+import tracemalloc
+import concurrent.futures
+import multiprocessing
+from dataclasses import dataclass, field
+
+ROOT_DIR = pathlib.Path(__file__).parent.parent
+
+
+@dataclass
+class History:
+    """
+    A synthetic request history, torrent popularity follows a power law like real requests do.
+    """
+
+    users: list[tuple[str, str]]
+    # user index -> torrent infohashes
+    requests: dict[int, list[str]] = field(default_factory=dict)
+
+
+def make_history(num_users: int, num_requests: int, seed: int = 0) -> History:
+    rng = random.Random(seed)
+    num_torrents = max(1, num_requests // 2)
+    torrents = [f"{rng.getrandbits(160):040x}" for _ in range(num_torrents)]
+    history = History(users=[(f"{i:032x}", f"user{i}") for i in range(num_users)])
+    pairs: set[tuple[int, int]] = set()
+    while len(pairs) < min(num_requests, num_users * num_torrents):
+        user = rng.randrange(num_users)
+        torrent = min(int(rng.paretovariate(1.2)) - 1, num_torrents - 1)
+        if (user, torrent) in pairs:
+            torrent = rng.randrange(num_torrents)
+        pairs.add((user, torrent))
+    for user, torrent in sorted(pairs):
+        history.requests.setdefault(user, []).append(torrents[torrent])
+    return history
+
+
+def seed_json_database(path: pathlib.Path, history: History):
+    import app.db as db
+
+    requests: dict[str, db.MovieRequest] = {}
+    user_to_torrents = {}
+    for user_index, infohashes in history.requests.items():
+        user = db.User(*history.users[user_index])
+        user_to_torrents[user] = [db.Torrent(h) for h in infohashes]
+        for infohash in infohashes:
+            if infohash in requests:
+                requests[infohash].ref_count += 1
+            else:
+                requests[infohash] = db.MovieRequest(db.Torrent(infohash))
+    path.write_text(
+        db.JsonDB(
+            version=0,
+            all_requests=list(requests.values()),
+            user_to_torrents=user_to_torrents,
+        ).to_json()
+    )
+
+
+# backend name -> (class path, function writing a history in its storage format)
+BACKENDS = {
+    "json": ("app.db:JsonDatabase", seed_json_database),
+}
+
+
+def load_class(path: str):
+    module, _, name = path.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        import resource
+
+        # peak instead of current on platforms without /proc
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(latencies: list[float]) -> dict:
+    latencies = sorted(latencies)
+    if not latencies:
+        return {"count": 0}
+
+    def _percentile(p: float) -> float:
+        return latencies[min(len(latencies) - 1, max(0, round(p / 100 * len(latencies)) - 1))] * 1000
+
+    return {
+        "count": len(latencies),
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "p50_ms": _percentile(50),
+        "p99_ms": _percentile(99),
+    }
+
+
+async def _measure(fn, *args) -> float:
+    start = time.perf_counter()
+    await fn(*args)
+    return time.perf_counter() - start
+
+
+def run_case(backend: str, num_users: int, num_requests: int, ops: int, write_ops: int, seed: int) -> dict:
+    """
+    Runs in its own process, see `main`.
+    """
+    workdir = pathlib.Path(tempfile.mkdtemp(prefix="movie_request_bench_db_"))
+    os.environ.setdefault("MOVIE_REQUEST_SERVER_LOG_FILE", str(workdir / "app.log"))
+    os.environ.setdefault("MOVIE_REQUEST_SERVER_LOG_LEVEL", "WARNING")
+    sys.path.insert(0, str(ROOT_DIR))
+    import app.db as db
+    import app.qbittorrent as qbittorrent
+
+    async def _no_delete(**kwargs) -> bool:
+        return True
+
+    qbittorrent.delete_torrent = _no_delete  # type: ignore
+
+    class_path, seed_fn = BACKENDS.get(backend, (backend, None))
+    database_class = load_class(class_path)
+    path = workdir / "db"
+    history = make_history(num_users, num_requests, seed)
+    users = [db.User(*user) for user in history.users]
+
+    start = time.perf_counter()
+    if seed_fn is not None:
+        seed_fn(path, history)
+    else:
+        seeded = database_class(str(path))
+        seeded.connect()
+
+        async def _seed():
+            for user_index, infohashes in history.requests.items():
+                for infohash in infohashes:
+                    await seeded.make_request(users[user_index], db.Torrent(infohash))
+
+        asyncio.run(_seed())
+        seeded.close()
+    seed_s = time.perf_counter() - start
+    del history
+
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    database: db.IDatabase = database_class(str(path))
+    load_s = time.perf_counter() - start
+    rss_loaded = rss_mb() - rss_before
+
+    # tracing slows the load down, so the allocations are measured on a second instance
+    tracemalloc.start()
+    traced = database_class(str(path))
+    python_mb = tracemalloc.get_traced_memory()[0] / 2**20
+    tracemalloc.stop()
+    del traced
+
+    database.connect()
+
+    rng = random.Random(seed + 1)
+
+    async def _ops() -> dict[str, list[float]]:
+        ret: dict[str, list[float]] = {
+            "has_request": [],
+            "get_requests": [],
+            "make_request": [],
+            "cancel_request": [],
+        }
+        for _ in range(ops):
+            user = rng.choice(users)
+            requests = await database.get_requests(user)
+            torrent = (
+                rng.choice(requests).torrent
+                if requests and rng.random() < 0.5
+                else db.Torrent(f"{rng.getrandbits(160):040x}")
+            )
+            ret["has_request"].append(await _measure(database.has_request, user, torrent))
+            ret["get_requests"].append(await _measure(database.get_requests, user))
+
+        made = []
+        for _ in range(write_ops):
+            user = rng.choice(users)
+            torrent = db.Torrent(f"{rng.getrandbits(160):040x}")
+            ret["make_request"].append(await _measure(database.make_request, user, torrent))
+            made.append((user, torrent))
+        for user, torrent in made:
+            ret["cancel_request"].append(await _measure(database.cancel_request, user, torrent))
+        return ret
+
+    latencies = asyncio.run(_ops())
+
+    start = time.perf_counter()
+    database.close()
+    save_s = time.perf_counter() - start
+
+    return {
+        "backend": backend,
+        "users": num_users,
+        "requests": num_requests,
+        "file_mb": path.stat().st_size / 2**20 if path.is_file() else None,
+        "seed_s": seed_s,
+        "load_s": load_s,
+        "save_s": save_s,
+        "rss_mb": rss_loaded,
+        "python_mb": python_mb,
+        "ops": {name: summarize(values) for name, values in latencies.items()},
+    }
+
+
+def parse_scales(value: str) -> list[tuple[int, int]]:
+    ret = []
+    for scale in value.split(","):
+        users, _, requests = scale.partition(":")
+        ret.append((int(users), int(requests)))
+    return ret
+
+
+def print_table(results: list[dict]):
+    header = (
+        f"{'backend':<10}{'users':>8}{'requests':>10}{'file MB':>9}{'load s':>9}{'save s':>9}"
+        f"{'RSS MB':>9}{'py MB':>8}  op p50/p99 ms"
+    )
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        ops = "  ".join(
+            f"{name} {op['p50_ms']:.2f}/{op['p99_ms']:.2f}"
+            for name, op in r["ops"].items()
+            if op["count"]
+        )
+        print(
+            f"{r['backend']:<10}{r['users']:>8}{r['requests']:>10}{r['file_mb'] or 0:>9.1f}"
+            f"{r['load_s']:>9.3f}{r['save_s']:>9.3f}{r['rss_mb']:>9.1f}{r['python_mb']:>8.1f}  {ops}"
+        )
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--backend",
+        action="append",
+        help=f"one of {sorted(BACKENDS)} or a module:Class path, can be repeated (default: json)",
+    )
+    parser.add_argument(
+        "--scales",
+        default="100:1000,1000:10000,10000:100000",
+        help="comma separated users:requests",
+    )
+    parser.add_argument("--ops", type=int, default=1000, help="number of read operations per scale")
+    parser.add_argument("--write-ops", type=int, default=20, help="number of make/cancel requests per scale")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default="", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = []
+    for backend in args.backend or ["json"]:
+        for num_users, num_requests in parse_scales(args.scales):
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                result = executor.submit(
+                    run_case, backend, num_users, num_requests, args.ops, args.write_ops, args.seed
+                ).result()
+            results.append(result)
+            print_table([result])
+
+    print()
+    print_table(results)
+    if args.json:
+        pathlib.Path(args.json).write_text(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
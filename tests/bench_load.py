@@ -0,0 +1,324 @@
+"""
+End-to-end load benchmark: drives the server with concurrent simulated users
+(search, request, stats polling) against local fake qBittorrent, Jackett and Jellyfin servers,
+and reports throughput and latency percentiles per route.
+
+    python tests/bench_load.py --users 20 --duration 30 --json bench.json
+    python tests/bench_load.py --users 20 --duration 30 --baseline bench.json
+
+By default the server runs in this process (--server werkzeug or uvicorn), which shares the GIL
+with the simulated users. For accurate numbers run the server separately with the environment
+printed by --print-env, and point the benchmark at it with --target.
+The server never loads the .env of the repo, see MOVIE_REQUEST_SERVER_DOTENV_PATH.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import pathlib
+import argparse
+import tempfile
+import threading
+from dataclasses import dataclass, field
+
+import httpx
+
+import fake_upstreams
+from fake_upstreams import UpstreamConfig
+
+UPSTREAMS = ("qbittorrent", "jackett", "jellyfin")
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10, help="number of concurrent simulated users")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load after the users logged in")
+    parser.add_argument("--think-time", type=float, default=1.0, help="mean pause between the actions of a user, in seconds")
+    parser.add_argument("--search-weight", type=float, default=1)
+    parser.add_argument("--stats-weight", type=float, default=4)
+    parser.add_argument("--request-weight", type=float, default=0.5)
+    parser.add_argument("--catalog-size", type=int, default=500, help="number of torrents known to the fake indexer")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--server", choices=("werkzeug", "uvicorn"), default="werkzeug", help="how to run the server in this process")
+    parser.add_argument("--target", default="", help="url of an already running server, see --print-env")
+    parser.add_argument("--print-env", action="store_true", help="start the fakes, print the server environment and wait")
+    parser.add_argument("--json", default="", help="write the results to this file")
+    parser.add_argument("--baseline", default="", help="compare with the results of a previous run, exit with 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative p99 increase or throughput decrease")
+    parser.add_argument("--latency-ms", type=float, default=20, help="default latency of the fake upstreams")
+    parser.add_argument("--jitter-ms", type=float, default=10, help="default latency jitter of the fake upstreams")
+    parser.add_argument("--failure-rate", type=float, default=0, help="default failure rate of the fake upstreams")
+    for name in UPSTREAMS:
+        parser.add_argument(f"--{name}-latency-ms", type=float, default=None)
+        parser.add_argument(f"--{name}-jitter-ms", type=float, default=None)
+        parser.add_argument(f"--{name}-failure-rate", type=float, default=None)
+    parser.add_argument("--search-results", type=int, default=100, help="results per search of the fake indexer")
+    return parser.parse_args(argv)
+
+
+def upstream_config(args: argparse.Namespace, name: str) -> UpstreamConfig:
+    def _get(option: str):
+        value = getattr(args, f"{name}_{option}")
+        return getattr(args, option) if value is None else value
+
+    return UpstreamConfig(
+        latency_ms=_get("latency_ms"),
+        jitter_ms=_get("jitter_ms"),
+        failure_rate=_get("failure_rate"),
+        results=args.search_results,
+    )
+
+
+def start_server(kind: str, env: dict[str, str]) -> str:
+    """
+    Run the server in a thread of this process, returns its url.
+    The app reads its configuration at import time, so it is imported only now.
+    """
+    os.environ.update(env)
+    sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+    if kind == "uvicorn":
+        import socket
+        import uvicorn
+        from app.asgi import g_asgi_app
+
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        server = uvicorn.Server(uvicorn.Config(g_asgi_app, log_level="warning"))
+        threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True).start()
+        while not server.started:
+            time.sleep(0.05)
+        return f"http://127.0.0.1:{port}"
+
+    from werkzeug.serving import make_server
+    from app.main import g_app
+
+    server = make_server("127.0.0.1", 0, g_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+@dataclass
+class RouteStats:
+    latencies: list[float] = field(default_factory=list)
+    # status code (or exception name) -> count
+    statuses: dict[str, int] = field(default_factory=dict)
+
+    def record(self, latency: float, status: str):
+        self.latencies.append(latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+class LoadRun:
+    def __init__(self, args: argparse.Namespace, base_url: str, upstreams: fake_upstreams.FakeUpstreams):
+        self.args = args
+        self.base_url = base_url
+        self.upstreams = upstreams
+        self.stats: dict[str, RouteStats] = {}
+        self.deadline = float("inf")
+
+    async def call(self, route: str, request) -> httpx.Response | None:
+        start = time.perf_counter()
+        try:
+            response = await request
+            status = str(response.status_code)
+        except httpx.HTTPError as e:
+            response = None
+            status = type(e).__name__
+        self.stats.setdefault(route, RouteStats()).record(time.perf_counter() - start, status)
+        return response
+
+    async def request_torrent(self, client: httpx.AsyncClient, rng: random.Random):
+        torrent = rng.choice(self.upstreams.catalog.torrents)
+        start = time.perf_counter()
+        response = await self.call(
+            "POST /api/request",
+            client.post(
+                "/api/request",
+                json={
+                    "torrentTitle": torrent.title,
+                    "torrentLink": f"{self.upstreams.jackett.url}/dl/{torrent.infohash}.torrent",
+                    "torrentSize": torrent.size,
+                },
+            ),
+        )
+        if response is None or response.status_code != 202:
+            return
+        location = response.headers["Location"]
+        job = response.json()
+        while job["state"] in ("queued", "running"):
+            await asyncio.sleep(0.5)
+            response = await self.call("GET /api/request/job/<id>", client.get(location))
+            if response is None or response.status_code != 200:
+                return
+            job = response.json()
+        # the whole request, from submission until the job finished
+        self.stats.setdefault("request job", RouteStats()).record(
+            time.perf_counter() - start, str(job["status_code"])
+        )
+
+    async def simulate_user(self, index: int, logged_in: asyncio.Barrier):
+        rng = random.Random(self.args.seed * 1000 + index)
+        username = f"bench{index}"
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=120) as client:
+            await self.call(
+                "POST /api/login",
+                client.post("/api/login", json={"username": username, "password": username[::-1]}),
+            )
+            await logged_in.wait()
+
+            stats_etag = None
+            actions = ("search", "stats", "request")
+            weights = (self.args.search_weight, self.args.stats_weight, self.args.request_weight)
+            while time.monotonic() < self.deadline:
+                action = rng.choices(actions, weights)[0]
+                if action == "search":
+                    await self.call(
+                        "POST /fragment/search",
+                        client.post(
+                            "/fragment/search",
+                            json={"type": "text", "query": rng.choice(fake_upstreams.TITLES)},
+                        ),
+                    )
+                elif action == "stats":
+                    headers = {"If-None-Match": stats_etag} if stats_etag else {}
+                    response = await self.call(
+                        "GET /fragment/qbittorrent/stats",
+                        client.get("/fragment/qbittorrent/stats", headers=headers),
+                    )
+                    if response is not None and response.status_code == 200:
+                        stats_etag = response.headers.get("ETag")
+                else:
+                    await self.request_torrent(client, rng)
+                if self.args.think_time > 0:
+                    await asyncio.sleep(rng.expovariate(1 / self.args.think_time))
+
+    async def run(self) -> float:
+        # the login is measured, then the clock starts once everyone is logged in
+        logged_in = asyncio.Barrier(self.args.users + 1)
+        users = [
+            asyncio.create_task(self.simulate_user(i, logged_in))
+            for i in range(self.args.users)
+        ]
+        await logged_in.wait()
+        start = time.monotonic()
+        self.deadline = start + self.args.duration
+        await asyncio.gather(*users)
+        return time.monotonic() - start
+
+
+def summarize(stats: dict[str, RouteStats], elapsed: float) -> dict[str, dict]:
+    ret = {}
+    for route, route_stats in sorted(stats.items()):
+        latencies = route_stats.latencies
+        errors = sum(
+            count
+            for status, count in route_stats.statuses.items()
+            if not status.isdigit() or int(status) >= 500
+        )
+        ret[route] = {
+            "count": len(latencies),
+            "throughput": len(latencies) / elapsed if elapsed > 0 else 0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "max_ms": max(latencies, default=0) * 1000,
+            "errors": errors,
+            "statuses": route_stats.statuses,
+        }
+    return ret
+
+
+def print_table(results: dict[str, dict]):
+    header = f"{'route':<36}{'count':>8}{'req/s':>9}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}  statuses"
+    print(header)
+    print("-" * len(header))
+    for route, r in results.items():
+        statuses = " ".join(f"{s}:{n}" for s, n in sorted(r["statuses"].items()))
+        print(
+            f"{route:<36}{r['count']:>8}{r['throughput']:>9.2f}{r['p50_ms']:>10.1f}"
+            f"{r['p99_ms']:>10.1f}{r['max_ms']:>10.1f}{r['errors']:>8}  {statuses}"
+        )
+
+
+def find_regressions(results: dict[str, dict], baseline: dict[str, dict], tolerance: float) -> list[str]:
+    ret = []
+    for route, r in results.items():
+        base = baseline.get(route)
+        if base is None:
+            continue
+        if base["p99_ms"] > 0 and r["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            ret.append(f"{route}: p99 {base['p99_ms']:.1f} ms -> {r['p99_ms']:.1f} ms")
+        if base["throughput"] > 0 and r["throughput"] < base["throughput"] * (1 - tolerance):
+            ret.append(f"{route}: throughput {base['throughput']:.2f} -> {r['throughput']:.2f} req/s")
+    return ret
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    upstreams = fake_upstreams.create_upstreams(
+        *(upstream_config(args, name) for name in UPSTREAMS),
+        catalog_size=args.catalog_size,
+        seed=args.seed,
+    )
+    upstreams.start()
+    root = pathlib.Path(tempfile.mkdtemp(prefix="movie_request_bench_"))
+    env = upstreams.environ(root)
+
+    if args.print_env:
+        for key, value in env.items():
+            print(f"{key}={value}")
+        print("# fakes are running, press Ctrl+C to stop", file=sys.stderr)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            return 0
+
+    base_url = args.target or start_server(args.server, env)
+    run = LoadRun(args, base_url, upstreams)
+    elapsed = asyncio.run(run.run())
+    upstreams.stop()
+
+    results = summarize(run.stats, elapsed)
+    print(f"{args.users} users, {elapsed:.1f} s against {base_url}")
+    print_table(results)
+    print(
+        "upstream calls: "
+        + ", ".join(f"{s.name} {s.calls} ({s.failures} failed)" for s in upstreams.servers)
+    )
+
+    if args.json:
+        pathlib.Path(args.json).write_text(
+            json.dumps(
+                {
+                    "args": vars(args),
+                    "elapsed": elapsed,
+                    "routes": results,
+                    "upstream_calls": {s.name: s.calls for s in upstreams.servers},
+                },
+                indent=2,
+            )
+        )
+    if args.baseline:
+        baseline = json.loads(pathlib.Path(args.baseline).read_text())["routes"]
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+import os
+import sys
+import time
+import pathlib
+import tempfile
+import subprocess
+from typing import Callable
+from dataclasses import dataclass, field
+
+import pytest
+
+import fake_upstreams
+from fake_upstreams import FakeUpstreams, UpstreamConfig
+
+LIVE_SERVER = pathlib.Path(__file__).parent / "live_server.py"
+LIVE_SERVER_START_TIMEOUT_S = 60
+
+# the unit tests import app modules, which read their configuration at import:
+# files in a temporary directory, and upstreams that are never started
+UNIT_ROOT = pathlib.Path(tempfile.mkdtemp(prefix="movie-request-tests-"))
+os.environ.update(
+    fake_upstreams.create_upstreams(*(UpstreamConfig() for _ in range(3))).environ(UNIT_ROOT)
+)
+
+import app.qbittorrent as qbittorrent  # noqa: E402, configured above
+
+
+@pytest.fixture
+def upstreams() -> FakeUpstreams:
+    """
+    Fake qBittorrent, Jackett and Jellyfin servers answering right away, in this process.
+    """
+    ret = fake_upstreams.create_upstreams(
+        *(UpstreamConfig(latency_ms=0, jitter_ms=0, failure_rate=0) for _ in range(3)),
+        catalog_size=50,
+    )
+    ret.start()
+    yield ret
+    ret.stop()
+
+
+@pytest.fixture
+def live_server(
+    upstreams: FakeUpstreams, tmp_path: pathlib.Path
+) -> Callable[..., str]:
+    """
+    Start the server against `upstreams` and return its url, e.g.
+    `live_server("uvicorn", MOVIE_REQUEST_SERVER_EVENT_STREAM_MAX="2")`.
+    Its files (db, logs, profiles) are in `tmp_path`.
+    """
+    processes: list[subprocess.Popen] = []
+
+    def _start(kind: str = "werkzeug", **env: str) -> str:
+        url_file = tmp_path / f"server-{len(processes)}.url"
+        process = subprocess.Popen(
+            [sys.executable, str(LIVE_SERVER), kind, str(url_file)],
+            cwd=tmp_path,
+            env={**os.environ, **upstreams.environ(tmp_path), **env},
+        )
+        processes.append(process)
+        deadline = time.monotonic() + LIVE_SERVER_START_TIMEOUT_S
+        while not url_file.exists():
+            assert process.poll() is None, "the server exited on startup"
+            assert time.monotonic() < deadline, "the server did not start in time"
+            time.sleep(0.05)
+        return url_file.read_text()
+
+    yield _start
+    for process in processes:
+        process.kill()
+        process.wait()
+
+
+@dataclass
+class QbittorrentStub:
+    # hash -> torrent info, updated by the actions
+    torrents: dict[str, dict] = field(default_factory=dict)
+    # (endpoint, hashes, fields) of every action
+    actions: list[tuple[str, list[str], dict]] = field(default_factory=list)
+
+    def add(self, infohash: str, **fields) -> dict:
+        self.torrents[infohash] = {
+            "hash": infohash,
+            "state": qbittorrent.TorrentState.DOWNLOADING,
+            "dl_limit": 0,
+            "dlspeed": 0,
+            "amount_left": 0,
+            "tags": "",
+            **fields,
+        }
+        return self.torrents[infohash]
+
+    def tags(self, infohash: str) -> set[str]:
+        return {t for t in self.torrents[infohash]["tags"].split(", ") if t}
+
+    async def get_torrent_list(self, filter=None, hashes=None, category=None, tag=None):
+        return [
+            dict(torrent)
+            for torrent in self.torrents.values()
+            if (hashes is None or torrent["hash"] in hashes)
+            and (category is None or torrent.get("category") == category)
+            and (tag is None or tag in self.tags(torrent["hash"]))
+        ]
+
+    async def torrents_action(self, endpoints, torrent_hashes, **fields):
+        if isinstance(torrent_hashes, str):
+            torrent_hashes = [torrent_hashes]
+        self.actions.append((endpoints[0], list(torrent_hashes), fields))
+        for infohash in torrent_hashes:
+            torrent = self.torrents[infohash]
+            match endpoints[0]:
+                case "pause":
+                    torrent["state"] = qbittorrent.TorrentState.PAUSED_DL
+                case "resume":
+                    torrent["state"] = qbittorrent.TorrentState.DOWNLOADING
+                case "setDownloadLimit":
+                    torrent["dl_limit"] = int(fields["limit"])
+                case "addTags":
+                    torrent["tags"] = ", ".join(sorted(self.tags(infohash) | {fields["tags"]}))
+                case "removeTags":
+                    torrent["tags"] = ", ".join(sorted(self.tags(infohash) - {fields["tags"]}))
+                case "setLocation":
+                    torrent["save_path"] = fields["location"]
+        return True
+
+    async def delete_torrent(self, *, torrent_links=None, torrent_hashes=None, delete_files=False):
+        if isinstance(torrent_hashes, str):
+            torrent_hashes = [torrent_hashes]
+        self.actions.append(("delete", list(torrent_hashes), {"deleteFiles": delete_files}))
+        for infohash in torrent_hashes:
+            self.torrents.pop(infohash, None)
+        return True
+
+
+@pytest.fixture
+def fake_qbittorrent(monkeypatch) -> QbittorrentStub:
+    """
+    In-memory torrents behind the qbittorrent helpers, for the unit tests.
+    """
+    ret = QbittorrentStub()
+    monkeypatch.setattr(qbittorrent, "get_torrent_list", ret.get_torrent_list)
+    monkeypatch.setattr(qbittorrent, "_torrents_action", ret.torrents_action)
+    monkeypatch.setattr(qbittorrent, "delete_torrent", ret.delete_torrent)
+    return ret
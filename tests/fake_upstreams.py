@@ -0,0 +1,622 @@
+"""
+Local stand-ins for the subsets of the qBittorrent v2, Jackett and Jellyfin APIs the server uses,
+with configurable latency and failure rates. See bench_load.py.
+"""
+
+import json
+import time
+import random
+import hashlib
+import pathlib
+import threading
+from dataclasses import dataclass, field
+
+from flask import Flask, Response, abort, request
+from werkzeug.serving import make_server
+
+TITLES = (
+    "The Matrix", "Blade Runner", "Alien", "Heat", "Arrival", "Dune", "Sicario",
+    "Interstellar", "Parasite", "Oldboy", "Memento", "Prisoners", "Drive", "Tenet",
+    "Gattaca", "Solaris", "Stalker", "Ran", "Ikiru", "Akira",
+)
+RESOLUTIONS = ("720p", "1080p", "2160p")
+SOURCES = ("BluRay", "WEB-DL", "WEBRip", "HDTV")
+CODECS = ("x264", "x265", "H.264", "HEVC")
+GROUPS = ("FGT", "SPARKS", "RARBG", "NTb", "KONTRAST")
+
+JACKETT_API_KEY = "fake-jackett-key"
+JELLYFIN_API_KEY = "fake-jellyfin-key"
+
+# torrent piece length, only affects the size of the generated .torrent files
+PIECE_LENGTH = 16 * 1024 * 1024
+
+
+def bencode(value) -> bytes:
+    if isinstance(value, int):
+        return b"i%de" % value
+    if isinstance(value, str):
+        value = value.encode()
+    if isinstance(value, bytes):
+        return b"%d:%s" % (len(value), value)
+    if isinstance(value, list):
+        return b"l" + b"".join(bencode(v) for v in value) + b"e"
+    if isinstance(value, dict):
+        items = sorted((k.encode() if isinstance(k, str) else k, v) for k, v in value.items())
+        return b"d" + b"".join(bencode(k) + bencode(v) for k, v in items) + b"e"
+    raise TypeError(f"Cannot bencode {type(value)}")
+
+
+@dataclass
+class FakeTorrent:
+    title: str
+    size: int
+    infohash: str
+    content: bytes
+    seeders: int
+    leechers: int
+
+
+def make_torrent(title: str, size: int, seeders: int, leechers: int) -> FakeTorrent:
+    num_pieces = (size + PIECE_LENGTH - 1) // PIECE_LENGTH
+    info = {
+        "name": title,
+        "length": size,
+        "piece length": PIECE_LENGTH,
+        "pieces": hashlib.sha1(title.encode()).digest() * num_pieces,
+    }
+    return FakeTorrent(
+        title=title,
+        size=size,
+        infohash=hashlib.sha1(bencode(info)).hexdigest(),
+        content=bencode({"info": info}),
+        seeders=seeders,
+        leechers=leechers,
+    )
+
+
+class Catalog:
+    """
+    The torrents known to the fake indexer.
+    """
+
+    def __init__(self, size: int = 500, seed: int = 0):
+        rng = random.Random(seed)
+        self.torrents: list[FakeTorrent] = []
+        for i in range(size):
+            title = ".".join(
+                [
+                    rng.choice(TITLES).replace(" ", "."),
+                    str(rng.randint(1970, 2025)),
+                    rng.choice(RESOLUTIONS),
+                    rng.choice(SOURCES),
+                    rng.choice(CODECS),
+                ]
+            ) + f"-{rng.choice(GROUPS)}{i}"
+            self.torrents.append(
+                make_torrent(
+                    title,
+                    rng.randint(1, 40) * 512 * 1024 * 1024,
+                    rng.randint(0, 500),
+                    rng.randint(0, 100),
+                )
+            )
+        self.by_hash = {t.infohash: t for t in self.torrents}
+
+    def search(self, query: str, limit: int) -> list[FakeTorrent]:
+        words = query.lower().split()
+        matches = [t for t in self.torrents if all(w in t.title.lower() for w in words)]
+        if not matches:
+            # any query returns results, so that the fragments have a realistic size
+            start = int(hashlib.sha1(query.encode()).hexdigest(), 16) % len(self.torrents)
+            matches = (self.torrents[start:] + self.torrents[:start])
+        return matches[:limit]
+
+
+@dataclass
+class UpstreamConfig:
+    # added to every call
+    latency_ms: float = 0
+    # uniformly random extra latency
+    jitter_ms: float = 0
+    # probability of answering with a 500
+    failure_rate: float = 0
+    # only for the indexer, max number of results per search
+    results: int = 100
+
+
+@dataclass
+class FakeServer:
+    name: str
+    config: UpstreamConfig
+    app: Flask
+    port: int = 0
+    calls: int = 0
+    failures: int = 0
+    _server: object = field(default=None, repr=False)
+    _thread: threading.Thread | None = field(default=None, repr=False)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        self._server = make_server("127.0.0.1", self.port, self.app, threaded=True)
+        self.port = self._server.server_port  # type: ignore
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name=f"fake-{self.name}", daemon=True  # type: ignore
+        )
+        self._thread.start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()  # type: ignore
+            self._server = None
+
+
+def _install_faults(server: FakeServer, rng: random.Random):
+    @server.app.before_request
+    def _faults():
+        server.calls += 1
+        config = server.config
+        delay_ms = config.latency_ms + rng.uniform(0, config.jitter_ms)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+        if config.failure_rate > 0 and rng.random() < config.failure_rate:
+            server.failures += 1
+            abort(500)
+
+
+def create_jackett(catalog: Catalog, config: UpstreamConfig, api_key: str, seed: int = 0) -> FakeServer:
+    app = Flask("fake_jackett")
+    server = FakeServer("jackett", config, app)
+    _install_faults(server, random.Random(seed))
+
+    @app.get("/api/v2.0/indexers/all/results")
+    def results():
+        if request.args.get("apikey") != api_key:
+            abort(401)
+        entries = [
+            {
+                "Title": t.title,
+                "Size": t.size,
+                "InfoHash": t.infohash,
+                "MagnetUri": None,
+                "Link": f"{server.url}/dl/{t.infohash}.torrent",
+                "Seeders": t.seeders,
+                "Peers": t.leechers,
+            }
+            for t in catalog.search(request.args.get("Query", ""), config.results)
+        ]
+        return {"Results": entries}
+
+    @app.get("/dl/<infohash>.torrent")
+    def download(infohash: str):
+        torrent = catalog.by_hash.get(infohash)
+        if torrent is None:
+            abort(404)
+        return Response(torrent.content, mimetype="application/x-bittorrent")
+
+    return server
+
+
+def create_jellyfin(config: UpstreamConfig, seed: int = 0) -> FakeServer:
+    """
+    Any username logs in as long as the password is the username reversed.
+    """
+    app = Flask("fake_jellyfin")
+    server = FakeServer("jellyfin", config, app)
+    _install_faults(server, random.Random(seed))
+
+    @app.post("/Users/AuthenticateByName")
+    def authenticate():
+        body = request.get_json(silent=True) or {}
+        username = body.get("Username", "")
+        if not username or body.get("Pw") != username[::-1]:
+            abort(401)
+        return {
+            "User": {"Id": hashlib.md5(username.encode()).hexdigest(), "Name": username},
+            "AccessToken": hashlib.sha1(username.encode()).hexdigest(),
+        }
+
+    return server
+
+
+@dataclass
+class FakeQBitTorrentState:
+    """
+    Simulated downloads sharing one link. With queueing enabled in the preferences,
+    only the first `max_active_downloads` torrents of the queue download, like qBittorrent.
+    """
+
+    catalog: Catalog
+    # bandwidth shared by the active downloads
+    link_speed: int = 100 * 1024 * 1024
+    # fraction of the link wasted per extra concurrent download (peer connections, disk seeks)
+    contention: float = 0.05
+    # upload rate of every seeding torrent
+    upload_speed: int = 0
+    torrents: dict[str, dict] = field(default_factory=dict)
+    # hashes, first is downloaded first
+    queue: list[str] = field(default_factory=list)
+    preferences: dict = field(
+        default_factory=lambda: {
+            "queueing_enabled": False,
+            "max_active_downloads": 3,
+            "max_ratio_act": 0,
+        }
+    )
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    updated_at: float = field(default_factory=time.time)
+
+    def add(self, infohash: str, save_path: str, **fields):
+        if infohash in self.torrents:
+            return
+        known = self.catalog.by_hash.get(infohash)
+        size = known.size if known else 1024 * 1024 * 1024
+        self.torrents[infohash] = {
+            "hash": infohash,
+            "name": known.title if known else infohash,
+            "size": size,
+            "total_size": size,
+            "save_path": save_path,
+            "added_on": int(time.time()),
+            "category": fields.get("category", ""),
+            "state": "downloading",
+            "dl_limit": 0,
+            "tags": "",
+            "ratio_limit": -2,
+            "seeding_time_limit": -2,
+            "_downloaded": 0.0,
+            "_uploaded": 0.0,
+            "_seeding_time": 0.0,
+            "_speed": 0,
+            "_paused": False,
+        }
+        self.queue.append(infohash)
+
+    def remove(self, infohash: str):
+        self.torrents.pop(infohash, None)
+        if infohash in self.queue:
+            self.queue.remove(infohash)
+
+    def move_to_top(self, hashes: list[str]):
+        # like qBittorrent, the moved torrents keep their relative order
+        moved = [h for h in self.queue if h in hashes]
+        self.queue = moved + [h for h in self.queue if h not in hashes]
+
+    def _waiting(self) -> list[dict]:
+        return [
+            self.torrents[h]
+            for h in self.queue
+            if self.torrents[h]["_downloaded"] < self.torrents[h]["size"]
+        ]
+
+    def _active(self) -> list[dict]:
+        downloading = [
+            t for t in self._waiting() if not t["_paused"] and t["state"] != "moving"
+        ]
+        if self.preferences.get("queueing_enabled"):
+            downloading = downloading[: max(0, self.preferences["max_active_downloads"])]
+        return downloading
+
+    def advance(self):
+        """
+        Advance the simulated downloads until now, piecewise between completions.
+        """
+        now = time.time()
+        remaining_s = now - self.updated_at
+        self.updated_at = now
+        # approximately, torrents completing during this call start seeding next time
+        for torrent in self.torrents.values():
+            if torrent["state"] == "uploading":
+                torrent["_uploaded"] += self.upload_speed * remaining_s
+                torrent["_seeding_time"] += remaining_s
+                self._apply_share_limits(torrent)
+        while True:
+            active = self._active()
+            for torrent in self.torrents.values():
+                torrent["_speed"] = 0
+            if not active:
+                break
+            # the bandwidth left by the rate-limited torrents goes to the others
+            left = self.link_speed / (1 + self.contention * (len(active) - 1))
+            unlimited = list(active)
+            while unlimited:
+                share = left / len(unlimited)
+                limited = [t for t in unlimited if 0 < t["dl_limit"] < share]
+                if not limited:
+                    for torrent in unlimited:
+                        torrent["_speed"] = share
+                    break
+                for torrent in limited:
+                    torrent["_speed"] = torrent["dl_limit"]
+                    left -= torrent["dl_limit"]
+                    unlimited.remove(torrent)
+            if remaining_s <= 0:
+                break
+            # until the first active download completes, then the link is shared again
+            step_s = min(
+                [remaining_s]
+                + [
+                    (t["size"] - t["_downloaded"]) / t["_speed"]
+                    for t in active
+                    if t["_speed"] > 0
+                ]
+            )
+            for torrent in active:
+                torrent["_downloaded"] = min(
+                    torrent["size"], torrent["_downloaded"] + torrent["_speed"] * step_s
+                )
+            remaining_s -= step_s
+
+        active = {t["hash"] for t in self._active()}
+        for torrent in self.torrents.values():
+            if torrent["state"] == "moving":
+                continue
+            done = torrent["_downloaded"] >= torrent["size"]
+            if torrent["_paused"]:
+                torrent["state"] = "pausedUP" if done else "pausedDL"
+            elif done:
+                torrent["state"] = "uploading"
+            else:
+                torrent["state"] = "downloading" if torrent["hash"] in active else "queuedDL"
+
+    def _apply_share_limits(self, torrent: dict):
+        # qBittorrent's global limits (-2) are not modelled
+        ratio = torrent["_uploaded"] / torrent["size"]
+        if self.preferences.get("max_ratio_act") == 0 and (
+            0 <= torrent["ratio_limit"] <= ratio
+            or 0 <= torrent["seeding_time_limit"] * 60 <= torrent["_seeding_time"]
+        ):
+            torrent["_paused"] = True
+
+    def snapshot(self, torrent: dict) -> dict:
+        """
+        The public fields of a torrent, call `advance` first.
+        """
+        downloaded = int(torrent["_downloaded"])
+        left = torrent["size"] - downloaded
+        speed = int(torrent["_speed"])
+        priority = -1
+        if self.preferences.get("queueing_enabled") and left > 0:
+            priority = [t["hash"] for t in self._waiting()].index(torrent["hash"]) + 1
+        return {
+            **{k: v for k, v in torrent.items() if not k.startswith("_")},
+            "priority": priority,
+            "progress": downloaded / torrent["size"],
+            "amount_left": left,
+            "completed": downloaded,
+            "downloaded": downloaded,
+            "completion_on": 0 if left else int(time.time()),
+            "dlspeed": speed,
+            "eta": 8640000 if speed == 0 else left // speed,
+            "uploaded": int(torrent["_uploaded"]),
+            "upspeed": self.upload_speed if torrent["state"] == "uploading" else 0,
+            "ratio": torrent["_uploaded"] / torrent["size"],
+            "seeding_time": int(torrent["_seeding_time"]),
+        }
+
+
+# qBittorrent's /torrents/info filters, by the states they keep
+_QBITTORRENT_FILTERS = {
+    "downloading": {"downloading", "pausedDL", "stalledDL", "queuedDL", "metaDL", "forcedDL"},
+    "seeding": {"uploading", "stalledUP", "queuedUP", "forcedUP"},
+    "completed": {"uploading", "stalledUP", "queuedUP", "forcedUP", "pausedUP"},
+    "paused": {"pausedDL", "pausedUP"},
+    "active": {"downloading", "uploading", "forcedDL", "forcedUP", "metaDL"},
+}
+
+
+def create_qbittorrent(state: FakeQBitTorrentState, config: UpstreamConfig, seed: int = 0) -> FakeServer:
+    app = Flask("fake_qbittorrent")
+    server = FakeServer("qbittorrent", config, app)
+    _install_faults(server, random.Random(seed))
+
+    def _hashes() -> list[str]:
+        value = request.values.get("hashes", "")
+        if value == "all":
+            return list(state.torrents)
+        return [h for h in value.split("|") if h]
+
+    @app.get("/api/v2/torrents/info")
+    def info():
+        # accept both "downloading" and "GetTorrentListFilter.DOWNLOADING"
+        filter_name = request.args.get("filter", "all").rsplit(".", 1)[-1].lower()
+        hashes = set(_hashes())
+        category = request.args.get("category")
+        tag = request.args.get("tag")
+        with state.lock:
+            state.advance()
+            ret = []
+            for infohash, torrent in state.torrents.items():
+                if hashes and infohash not in hashes:
+                    continue
+                if category is not None and torrent["category"] != category:
+                    continue
+                if tag is not None and tag not in _tags(torrent):
+                    continue
+                snapshot = state.snapshot(torrent)
+                states = _QBITTORRENT_FILTERS.get(filter_name)
+                if states is not None and snapshot["state"] not in states:
+                    continue
+                ret.append(snapshot)
+        return Response(json.dumps(ret), mimetype="application/json")
+
+    @app.post("/api/v2/torrents/add")
+    def add():
+        urls = request.form.get("urls", "")
+        save_path = request.form.get("savepath", "")
+        with state.lock:
+            state.advance()
+            for url in urls.splitlines():
+                url = url.strip()
+                if url:
+                    state.add(url.lower(), save_path, category=request.form.get("category", ""))
+            # uploaded torrent files, only the ones of the catalog are known
+            by_content = {t.content: t.infohash for t in state.catalog.torrents}
+            for file in request.files.getlist("torrents"):
+                infohash = by_content.get(file.read())
+                if infohash is None:
+                    return "Fails."
+                state.add(infohash, save_path, category=request.form.get("category", ""))
+        return "Ok."
+
+    @app.post("/api/v2/torrents/delete")
+    def delete():
+        with state.lock:
+            for infohash in _hashes():
+                state.remove(infohash)
+        return ""
+
+    def _set(**changes):
+        with state.lock:
+            # changes apply from now on
+            state.advance()
+            for infohash in _hashes():
+                if infohash in state.torrents:
+                    state.torrents[infohash].update(changes)
+        return ""
+
+    @app.post("/api/v2/torrents/stop")
+    def stop():
+        return _set(_paused=True)
+
+    @app.post("/api/v2/torrents/start")
+    def start():
+        return _set(_paused=False)
+
+    @app.post("/api/v2/torrents/setDownloadLimit")
+    def set_download_limit():
+        return _set(dl_limit=int(request.form.get("limit", 0)))
+
+    def _tags(torrent: dict) -> list[str]:
+        return [t for t in torrent["tags"].split(", ") if t]
+
+    def _retag(change):
+        tags = [t.strip() for t in request.form.get("tags", "").split(",") if t.strip()]
+        with state.lock:
+            for infohash in _hashes():
+                if infohash in state.torrents:
+                    torrent = state.torrents[infohash]
+                    torrent["tags"] = ", ".join(sorted(change(set(_tags(torrent)), tags)))
+        return ""
+
+    @app.post("/api/v2/torrents/addTags")
+    def add_tags():
+        return _retag(lambda current, tags: current | set(tags))
+
+    @app.post("/api/v2/torrents/removeTags")
+    def remove_tags():
+        return _retag(lambda current, tags: current - set(tags))
+
+    @app.post("/api/v2/torrents/setLocation")
+    def set_location():
+        return _set(save_path=request.form.get("location", ""))
+
+    @app.post("/api/v2/torrents/setShareLimits")
+    def set_share_limits():
+        return _set(
+            ratio_limit=float(request.form["ratioLimit"]),
+            seeding_time_limit=int(request.form["seedingTimeLimit"]),
+        )
+
+    @app.post("/api/v2/torrents/topPrio")
+    def top_priority():
+        with state.lock:
+            if not state.preferences.get("queueing_enabled"):
+                abort(409)
+            state.advance()
+            state.move_to_top(_hashes())
+        return ""
+
+    @app.get("/api/v2/app/preferences")
+    def preferences():
+        with state.lock:
+            return dict(state.preferences)
+
+    @app.post("/api/v2/app/setPreferences")
+    def set_preferences():
+        with state.lock:
+            state.advance()
+            state.preferences.update(json.loads(request.form.get("json", "{}")))
+        return ""
+
+    return server
+
+
+@dataclass
+class FakeUpstreams:
+    catalog: Catalog
+    qbittorrent_state: FakeQBitTorrentState
+    qbittorrent: FakeServer
+    jackett: FakeServer
+    jellyfin: FakeServer
+
+    @property
+    def servers(self) -> list[FakeServer]:
+        return [self.qbittorrent, self.jackett, self.jellyfin]
+
+    def start(self):
+        for server in self.servers:
+            server.start()
+
+    def stop(self):
+        for server in self.servers:
+            server.stop()
+
+    def environ(self, root: pathlib.Path, mounts: int = 2) -> dict[str, str]:
+        """
+        Write the config files the server reads and return the environment pointing it at the fakes.
+        """
+        jackett_config = root / "jackett" / "Jackett" / "ServerConfig.json"
+        jackett_config.parent.mkdir(parents=True, exist_ok=True)
+        jackett_config.write_text(
+            json.dumps({"APIKey": JACKETT_API_KEY, "Port": self.jackett.port})
+        )
+        storage_config = []
+        for i in range(mounts):
+            mount = root / "mnt" / str(i)
+            mount.mkdir(parents=True, exist_ok=True)
+            storage_config.append(
+                {
+                    "host_path": str(mount),
+                    "movie_request_server_mount": str(mount),
+                    "qbittorrent_mount": str(mount),
+                }
+            )
+        (root / "storage_config.json").write_text(json.dumps(storage_config))
+        return {
+            "QBITTORRENT_HOST": "127.0.0.1",
+            "QBITTORRENT_PORT": str(self.qbittorrent.port),
+            "JACKETT_HOST": "127.0.0.1",
+            "JACKETT_CONFIG_DIR": str(root / "jackett"),
+            "JELLYFIN_HOST": "127.0.0.1",
+            "JELLYFIN_PORT": str(self.jellyfin.port),
+            "JELLYFIN_API_KEY": JELLYFIN_API_KEY,
+            "MOVIE_REQUEST_SERVER_STORAGE_CONFIG_FILE": str(root / "storage_config.json"),
+            "MOVIE_REQUEST_SERVER_DB_PATH": str(root / "db.json"),
+            "MOVIE_REQUEST_SERVER_LOG_FILE": str(root / "app.log"),
+            "MOVIE_REQUEST_SERVER_SECRET": "bench",
+            "MOVIE_REQUEST_SERVER_JINJA_CACHE_DIR": str(root / "jinja"),
+            "MOVIE_REQUEST_SERVER_SEARCH_INDEX_PATH": str(root / "search_index.sqlite3"),
+            # the .env of the repo would point the server at the real upstreams
+            "MOVIE_REQUEST_SERVER_DOTENV_PATH": "",
+        }
+
+
+def create_upstreams(
+    qbittorrent: UpstreamConfig,
+    jackett: UpstreamConfig,
+    jellyfin: UpstreamConfig,
+    catalog_size: int = 500,
+    seed: int = 0,
+) -> FakeUpstreams:
+    catalog = Catalog(catalog_size, seed)
+    state = FakeQBitTorrentState(catalog)
+    return FakeUpstreams(
+        catalog=catalog,
+        qbittorrent_state=state,
+        qbittorrent=create_qbittorrent(state, qbittorrent, seed),
+        jackett=create_jackett(catalog, jackett, JACKETT_API_KEY, seed),
+        jellyfin=create_jellyfin(jellyfin, seed),
+    )
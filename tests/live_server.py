@@ -0,0 +1,52 @@
+"""
+Serve the app for the tests, configured by the environment, until killed.
+
+    python tests/live_server.py werkzeug|uvicorn <url file>
+
+The url of the server is written to the url file once it listens.
+The app reads its configuration at import, so every test server is its own process,
+see the `live_server` fixture of conftest.py. Also the helpers of the tests talking to it.
+"""
+
+import sys
+import time
+import pathlib
+
+import httpx
+
+import bench_load
+
+
+def login(client: httpx.Client, username: str):
+    """
+    Log in as `username`, the fake Jellyfin accepts its reverse as password.
+    """
+    res = client.post("/api/login", json={"username": username, "password": username[::-1]})
+    assert res.status_code == 200, res.text
+
+
+def wait_for_job(client: httpx.Client, res: httpx.Response) -> dict:
+    """
+    The finished job of a 202 response of /api/request or /api/request/bulk.
+    """
+    assert res.status_code == 202, res.text
+    job = res.json()
+    while job["state"] in ("queued", "running"):
+        time.sleep(0.2)
+        job = client.get(res.headers["Location"]).json()
+    return job
+
+
+def main():
+    kind, url_file = sys.argv[1:3]
+    url = bench_load.start_server(kind, {})
+    # written then renamed, so that the fixture never reads a partial url
+    tmp = pathlib.Path(url_file + ".tmp")
+    tmp.write_text(url)
+    tmp.rename(url_file)
+    while True:
+        time.sleep(3600)
+
+
+if __name__ == "__main__":
+    main()
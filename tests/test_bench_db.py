@@ -0,0 +1,30 @@
+import json
+import pathlib
+import subprocess
+import sys
+
+BENCH_DB = pathlib.Path(__file__).parent / "bench_db.py"
+
+
+def test_bench_db(tmp_path: pathlib.Path):
+    """
+    A tiny run of the database benchmark, every operation must be measured.
+    """
+    results = tmp_path / "bench_db.json"
+    subprocess.run(
+        [
+            sys.executable,
+            str(BENCH_DB),
+            "--scales", "20:100",
+            "--ops", "20",
+            "--write-ops", "3",
+            "--json", str(results),
+        ],
+        cwd=tmp_path,
+        check=True,
+        timeout=120,
+    )
+    (result,) = json.loads(results.read_text())
+    assert result["backend"] == "json"
+    assert result["ops"]["has_request"]["count"] == 20
+    assert result["ops"]["cancel_request"]["count"] == 3
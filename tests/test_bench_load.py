@@ -0,0 +1,37 @@
+import json
+import pathlib
+import subprocess
+import sys
+
+BENCH_LOAD = pathlib.Path(__file__).parent / "bench_load.py"
+
+
+def test_bench_load(tmp_path: pathlib.Path):
+    """
+    A short offline run of the load benchmark, no route may fail with a server error.
+    """
+    results = tmp_path / "bench.json"
+    subprocess.run(
+        [
+            sys.executable,
+            str(BENCH_LOAD),
+            "--users", "3",
+            "--duration", "3",
+            "--think-time", "0.2",
+            "--latency-ms", "0",
+            "--jitter-ms", "0",
+            "--json", str(results),
+        ],
+        cwd=tmp_path,
+        check=True,
+        timeout=120,
+    )
+    results = json.loads(results.read_text())
+    # the server talked to the fakes, not to upstreams configured elsewhere
+    assert results["upstream_calls"]["qbittorrent"] > 0
+    assert results["upstream_calls"]["jackett"] > 0
+    routes = results["routes"]
+    assert routes["POST /api/login"]["statuses"] == {"200": 3}
+    assert routes["POST /fragment/search"]["count"] > 0
+    for route, result in routes.items():
+        assert result["errors"] == 0, f"{route}: {result['statuses']}"
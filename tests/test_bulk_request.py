@@ -0,0 +1,37 @@
+import httpx
+
+from live_server import login, wait_for_job
+
+# see routes.REQUEST_LIMIT
+DAILY_REQUESTS = 20
+
+
+def test_bulk_request_is_capped_at_the_daily_limit(upstreams, live_server):
+    """
+    A bulk request larger than the requests left for the day is accepted up to them.
+    """
+    base_url = live_server()
+    links = [
+        f"{upstreams.jackett.url}/dl/{torrent.infohash}.torrent"
+        for torrent in upstreams.catalog.torrents
+    ]
+
+    with httpx.Client(base_url=base_url, timeout=30) as client:
+        login(client, "bob")
+
+        # one link per line, counted like the job reads them
+        res = client.post("/api/request/bulk", data={"links": "\n".join(links[:3])})
+        job = wait_for_job(client, res)
+        assert [r["state"] for r in job["results"]] == ["requested"] * 3, job
+
+        res = client.post("/api/request/bulk", json={"links": []})
+        assert res.status_code == 400
+
+        job = wait_for_job(client, client.post("/api/request/bulk", json={"links": links[3:30]}))
+        # the others may not fit on the disks of the test
+        refused = [r["message"] == "Daily request limit reached" for r in job["results"]]
+        left = DAILY_REQUESTS - 3
+        assert refused == [False] * left + [True] * (27 - left), job
+
+        res = client.post("/api/request/bulk", json={"links": links[30:31]})
+        assert res.status_code == 429
@@ -0,0 +1,59 @@
+import time
+import pathlib
+import contextlib
+
+import httpx
+
+from live_server import login
+
+# the server's thread pool, two streams are allowed so that two threads are left
+SERVER_THREADS = 4
+EVENT_STREAM_MAX = 2
+EVENT_STREAM_MAX_AGE_S = 2
+
+
+def test_event_streams_leave_threads_for_requests(live_server, tmp_path: pathlib.Path):
+    """
+    Open event streams can't take all the threads of the server.
+    """
+    # a2wsgi serves the app from a bounded thread pool, like gunicorn's gthread workers
+    base_url = live_server(
+        "uvicorn",
+        MOVIE_REQUEST_SERVER_ASGI_THREADS=str(SERVER_THREADS),
+        MOVIE_REQUEST_SERVER_EVENT_STREAM_MAX=str(EVENT_STREAM_MAX),
+        MOVIE_REQUEST_SERVER_EVENT_STREAM_MAX_AGE_S=str(EVENT_STREAM_MAX_AGE_S),
+        # the streams outlive it, but are not slow requests
+        MOVIE_REQUEST_SERVER_SLOW_REQUEST_S=str(EVENT_STREAM_MAX_AGE_S / 2),
+    )
+
+    with httpx.Client(base_url=base_url, timeout=5) as client:
+        login(client, "bob")
+
+        with contextlib.ExitStack() as streams:
+            opened = []
+            for _ in range(EVENT_STREAM_MAX):
+                stream = streams.enter_context(
+                    client.stream("GET", "/events/qbittorrent/stats")
+                )
+                assert stream.status_code == 200
+                chunks = stream.iter_text()
+                assert next(chunks).startswith("retry:")
+                opened.append(chunks)
+
+            refused = client.get("/events/qbittorrent/stats")
+            assert refused.status_code == 503
+
+            for _ in range(SERVER_THREADS * 2):
+                assert client.get("/fragment/user").status_code == 200
+
+            # the streams end on their own, and free their slot
+            start = time.monotonic()
+            for chunks in opened:
+                for _ in chunks:
+                    pass
+            assert time.monotonic() - start < EVENT_STREAM_MAX_AGE_S + 3
+
+        with client.stream("GET", "/events/qbittorrent/stats") as stream:
+            assert stream.status_code == 200
+
+    assert not list((tmp_path / "profiles").glob("*.json"))
@@ -0,0 +1,75 @@
+import math
+
+import app.fair_share as fair_share
+import app.qbittorrent as qbittorrent
+import app.watchdog as watchdog
+
+KB = 1024
+
+
+def test_torrent_weights_split_shared_torrents():
+    """
+    Every user weighs 1, a torrent requested by several users adds up their parts.
+    """
+    weights = fair_share.torrent_weights({"bob": ["a", "b"], "alice": ["b"], "": ["c"]})
+    assert weights == {"a": 0.5, "b": 1.5, "c": 1}
+
+
+def test_water_fill_splits_by_weight():
+    assert fair_share.water_fill(
+        900, {"a": 1, "b": 2}, {"a": math.inf, "b": math.inf}
+    ) == {"a": 300, "b": 600}
+
+
+def test_water_fill_redistributes_what_idle_torrents_leave():
+    """
+    A torrent demanding less than its share gets its demand, the others split the rest.
+    """
+    allocation = fair_share.water_fill(
+        900, {"a": 1, "b": 1, "c": 1}, {"a": 100, "b": math.inf, "c": math.inf}
+    )
+    assert allocation == {"a": 100, "b": 400, "c": 400}
+
+
+def test_water_fill_satisfies_every_demand_within_the_budget():
+    allocation = fair_share.water_fill(900, {"a": 1, "b": 1}, {"a": 100, "b": 200})
+    assert allocation == {"a": 100, "b": 200}
+
+
+def test_demand():
+    assert fair_share.demand({"dl_limit": 0, "dlspeed": 10 * KB}) == math.inf
+    # saturated, it could use more
+    assert fair_share.demand({"dl_limit": 100 * KB, "dlspeed": 95 * KB}) == math.inf
+    assert fair_share.demand({"dl_limit": 1000 * KB, "dlspeed": 100 * KB}) == 150 * KB
+    assert fair_share.demand({"dl_limit": 1000 * KB, "dlspeed": 0}) == 64 * KB
+
+
+class FakeDatabase:
+    async def get_requests_by_user(self):
+        return {}
+
+
+async def test_allocator_resets_the_limits_it_stops_managing(fake_qbittorrent, monkeypatch):
+    monkeypatch.setattr(fair_share, "FAIR_SHARE_BUDGET_BYTES", 1000 * KB)
+    fake_qbittorrent.add("a")
+    fake_qbittorrent.add("b")
+    allocator = fair_share.FairShareAllocator(FakeDatabase(), watchdog.DiskWatchdog())
+
+    await allocator.check()
+    assert allocator.limits == {"a": 500 * KB, "b": 500 * KB}
+    assert fake_qbittorrent.torrents["a"]["dl_limit"] == 500 * KB
+    assert fake_qbittorrent.torrents["a"]["tags"] == fair_share.FAIR_SHARE_TAG
+
+    fake_qbittorrent.torrents["a"]["dlspeed"] = 500 * KB
+    fake_qbittorrent.torrents["b"]["state"] = qbittorrent.TorrentState.PAUSED_DL
+    await allocator.check()
+    assert allocator.limits == {"a": 1000 * KB}
+    assert fake_qbittorrent.torrents["b"]["dl_limit"] == 0
+    assert fake_qbittorrent.torrents["b"]["tags"] == ""
+
+    # disabled, e.g. after a restart: the tagged torrents are reset once
+    monkeypatch.setattr(fair_share, "FAIR_SHARE_BUDGET_BYTES", 0)
+    allocator = fair_share.FairShareAllocator(FakeDatabase(), watchdog.DiskWatchdog())
+    await allocator.check()
+    assert fake_qbittorrent.torrents["a"]["dl_limit"] == 0
+    assert fake_qbittorrent.torrents["a"]["tags"] == ""
@@ -0,0 +1,34 @@
+import time
+import asyncio
+
+from app.background import BackgroundLoop
+from app.jobs import Job, JobPool, JobState
+
+
+async def _slow(job: Job) -> str:
+    await asyncio.sleep(0.05)
+    return "done"
+
+
+def _run_all(pool: JobPool, count: int) -> list[Job]:
+    jobs = [pool.submit("bob", _slow, {}) for _ in range(count)]
+    deadline = time.monotonic() + 10
+    while not all(job.finished for job in jobs):
+        assert time.monotonic() < deadline, "the jobs did not finish in time"
+        time.sleep(0.01)
+    return jobs
+
+
+def test_jobs_survive_a_restart_of_the_background_loop():
+    """
+    Like the ASGI lifespan does, more jobs than workers so that they wait on the semaphore.
+    """
+    background = BackgroundLoop("test-jobs")
+    pool = JobPool(background, max_workers=2)
+    for _ in range(2):
+        background.start()
+        try:
+            jobs = _run_all(pool, 6)
+        finally:
+            background.stop()
+        assert [job.state for job in jobs] == [JobState.DONE] * 6, [j.message for j in jobs]
@@ -0,0 +1,57 @@
+import httpx
+
+from live_server import login, wait_for_job
+
+# a hash no release of the catalog has
+OTHER_RELEASE_HASH = "0" * 40
+
+
+def test_join_request_records_the_known_torrent(upstreams, live_server):
+    """
+    Joining the request of another release only records it, and offering to join is free.
+    """
+    base_url = live_server()
+    torrent = upstreams.catalog.torrents[0]
+
+    with (
+        httpx.Client(base_url=base_url, timeout=30) as bob,
+        httpx.Client(base_url=base_url, timeout=30) as alice,
+    ):
+        login(bob, "bob")
+        login(alice, "alice")
+
+        res = bob.post(
+            "/api/request",
+            json={
+                "torrentTitle": torrent.title,
+                "torrentLink": f"{upstreams.jackett.url}/dl/{torrent.infohash}.torrent",
+                "torrentSize": torrent.size,
+            },
+        )
+        assert wait_for_job(bob, res)["state"] == "done"
+
+        # another release of the same media, more times than the daily limit
+        other_release = {
+            "torrentTitle": torrent.title,
+            "torrentLink": "magnet:?xt=urn:btih:" + OTHER_RELEASE_HASH,
+            "torrentSize": torrent.size,
+            "torrentHash": OTHER_RELEASE_HASH,
+        }
+        for _ in range(25):
+            res = alice.post("/api/request", json=other_release)
+            assert res.status_code == 409, res.text
+        assert res.json()["duplicates"][0]["infohash"] == torrent.infohash
+
+        added = len(upstreams.qbittorrent_state.torrents)
+        res = alice.post("/api/request/join", json={"torrentHash": torrent.infohash})
+        assert res.status_code == 200, res.text
+        assert len(upstreams.qbittorrent_state.torrents) == added
+
+        res = alice.post("/api/request/join", json={"torrentHash": torrent.infohash})
+        assert res.status_code == 400
+        res = alice.post("/api/request/join", json={"torrentHash": OTHER_RELEASE_HASH})
+        assert res.status_code == 404
+
+        # no offer to join a request alice already made
+        res = alice.post("/api/request", json=other_release)
+        assert res.status_code == 202, res.text
@@ -0,0 +1,107 @@
+import math
+
+import pytest
+
+import app.metrics as metrics
+
+
+def test_metric_is_abstract():
+    with pytest.raises(TypeError):
+        metrics.IMetric("name", "help")
+
+
+def test_counter():
+    counter = metrics.Counter("requests_total", "Requests.", ("method",))
+    counter.inc(method="GET")
+    counter.inc(2, method="GET")
+    counter.inc(method="POST")
+    assert counter.render() == "\n".join(
+        [
+            "# HELP requests_total Requests.",
+            "# TYPE requests_total counter",
+            'requests_total{method="GET"} 3.0',
+            'requests_total{method="POST"} 1.0',
+        ]
+    )
+
+
+def test_labels_must_match():
+    counter = metrics.Counter("requests_total", "Requests.", ("method",))
+    with pytest.raises(ValueError):
+        counter.inc()
+    with pytest.raises(ValueError):
+        counter.inc(method="GET", status="200")
+
+
+def test_label_values_are_escaped():
+    counter = metrics.Counter("errors_total", "Errors.", ("path",))
+    counter.inc(path='a\\b"\n')
+    assert counter.render().splitlines()[-1] == 'errors_total{path="a\\\\b\\"\\n"} 1.0'
+
+
+def test_gauge():
+    gauge = metrics.Gauge("in_flight", "In flight.")
+    assert gauge.render().splitlines()[-1] == "in_flight 0.0"
+    gauge.inc()
+    gauge.inc(2)
+    gauge.dec()
+    assert gauge.render().splitlines()[-1] == "in_flight 2.0"
+    gauge.set(-1.5)
+    assert gauge.render().splitlines() == [
+        "# HELP in_flight In flight.",
+        "# TYPE in_flight gauge",
+        "in_flight -1.5",
+    ]
+
+
+def test_gauge_fn():
+    values = [3, math.inf]
+    gauge = metrics.Gauge("queued", "Queued.", fn=lambda: values.pop(0))
+    assert gauge.render().splitlines()[-1] == "queued 3.0"
+    assert gauge.render().splitlines()[-1] == "queued +Inf"
+    # a failing computation drops the sample, not the scrape
+    assert gauge.render().splitlines() == ["# HELP queued Queued.", "# TYPE queued gauge"]
+
+
+def test_histogram():
+    histogram = metrics.Histogram("latency_seconds", "Latency.", ("op",), buckets=(1, 0.1))
+    for value in (0.05, 0.1, 0.5, 2):
+        histogram.observe(value, op="get")
+    assert histogram.render().splitlines() == [
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        # cumulative, the bounds are included
+        'latency_seconds_bucket{op="get",le="0.1"} 2.0',
+        'latency_seconds_bucket{op="get",le="1.0"} 3.0',
+        'latency_seconds_bucket{op="get",le="+Inf"} 4.0',
+        'latency_seconds_sum{op="get"} 2.65',
+        'latency_seconds_count{op="get"} 4.0',
+    ]
+
+
+def test_track_upstream():
+    before = len(metrics.UPSTREAM_ERRORS._samples())
+    with metrics.track_upstream("test", "ok"):
+        pass
+    with pytest.raises(RuntimeError):
+        with metrics.track_upstream("test", "fails"):
+            raise RuntimeError()
+    errors = {
+        labels["operation"]: value
+        for _, labels, value in metrics.UPSTREAM_ERRORS._samples()
+        if labels["upstream"] == "test"
+    }
+    assert errors == {"fails": 1}
+    assert len(metrics.UPSTREAM_ERRORS._samples()) == before + 1
+    counts = {
+        labels["operation"]: value
+        for name, labels, value in metrics.UPSTREAM_DURATION._samples()
+        if name.endswith("_count") and labels["upstream"] == "test"
+    }
+    assert counts == {"ok": 1, "fails": 1}
+
+
+def test_render_ends_with_a_newline():
+    text = metrics.render()
+    assert text.endswith("\n")
+    assert "# TYPE movie_request_http_request_duration_seconds histogram" in text
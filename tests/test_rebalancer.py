@@ -0,0 +1,101 @@
+import pytest
+
+import app.qbittorrent as qbittorrent
+import app.rebalancer as rebalancer
+import app.storage as storage
+
+GB = 1024**3
+
+DISK_A = storage.MountPoint("/a", "/srv/a")
+DISK_B = storage.MountPoint("/b", "/srv/b")
+DISK_C = storage.MountPoint("/c", "/srv/c")
+
+
+@pytest.fixture(autouse=True)
+def mount_points(monkeypatch):
+    monkeypatch.setattr(storage, "MOUNT_POINTS", [DISK_A, DISK_B, DISK_C])
+
+
+def torrent(infohash, size_gb, mount=DISK_A, **fields):
+    return {
+        "hash": infohash,
+        "name": infohash,
+        "size": size_gb * GB,
+        "save_path": f"{mount.qbittorrent_path}/movies",
+        "progress": 1,
+        "state": qbittorrent.TorrentState.STALLED_UP,
+        **fields,
+    }
+
+
+def usage(**free_gb):
+    """
+    Free GB per mount letter, every mount holds 100 GB.
+    """
+    mounts = {"a": DISK_A, "b": DISK_B, "c": DISK_C}
+    return {mounts[name]: (free * GB, 100 * GB) for name, free in free_gb.items()}
+
+
+@pytest.mark.parametrize(
+    "torrents, usage, budget_gb, threshold, expected",
+    [
+        # biggest torrent first, until the free space ratios are close
+        (
+            [torrent("small", 5), torrent("big", 30), torrent("medium", 10)],
+            usage(a=10, b=85),
+            100,
+            0.1,
+            [("big", "/b/movies"), ("small", "/b/movies")],
+        ),
+        # a move making the destination the fuller mount is skipped
+        ([torrent("huge", 60)], usage(a=10, b=70), 100, 0.1, []),
+        # the budget caps the bytes moved, torrents larger than what is left are skipped
+        (
+            [torrent("big", 30), torrent("medium", 10), torrent("small", 5)],
+            usage(a=10, b=70),
+            16,
+            0.1,
+            [("medium", "/b/movies"), ("small", "/b/movies")],
+        ),
+        # close enough
+        ([torrent("big", 30)], usage(a=10, b=15), 100, 0.1, []),
+        ([torrent("small", 2)], usage(a=10, b=15), 100, 0.01, [("small", "/b/movies")]),
+        # incomplete, moving and erroring torrents stay where they are
+        (
+            [
+                torrent("partial", 10, progress=0.5),
+                torrent("moving", 10, state=qbittorrent.TorrentState.MOVING),
+                torrent("error", 10, state=qbittorrent.TorrentState.ERROR),
+            ],
+            usage(a=10, b=70),
+            100,
+            0.1,
+            [],
+        ),
+        # always from the fullest to the emptiest mount of the moment
+        (
+            [torrent("from-a", 20), torrent("from-c", 20, DISK_C)],
+            usage(a=10, b=90, c=20),
+            100,
+            0.1,
+            [("from-a", "/b/movies"), ("from-c", "/b/movies")],
+        ),
+        # nothing to balance with a single mount
+        ([torrent("big", 30)], usage(a=10), 100, 0.1, []),
+    ],
+)
+def test_plan_moves(torrents, usage, budget_gb, threshold, expected):
+    moves = rebalancer.plan_moves(torrents, usage, budget_gb * GB, threshold)
+    assert [(move.infohash, move.destination) for move in moves] == expected
+    assert sum(move.size for move in moves) <= budget_gb * GB
+
+
+@pytest.mark.parametrize("dry_run, expected", [(True, []), (False, ["big"])])
+async def test_rebalance_dry_run(fake_qbittorrent, monkeypatch, dry_run, expected):
+    monkeypatch.setattr(rebalancer, "REBALANCE_DRY_RUN", dry_run)
+    monkeypatch.setattr(rebalancer, "get_mount_usage", lambda: usage(a=10, b=70))
+    fake_qbittorrent.torrents["big"] = torrent("big", 30)
+    await rebalancer.rebalance()
+    assert [hashes for endpoint, [hashes], _ in fake_qbittorrent.actions] == expected
+    if not dry_run:
+        assert fake_qbittorrent.torrents["big"]["save_path"] == "/b/movies"
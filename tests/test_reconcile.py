@@ -0,0 +1,141 @@
+import types
+
+import pytest
+
+import app.db as db
+import app.qbittorrent as qbittorrent
+import app.reconcile as reconcile
+
+CATEGORY = "movies"
+BOB = db.User(id="1", username="bob")
+
+
+@pytest.fixture
+def clock(monkeypatch) -> types.SimpleNamespace:
+    """
+    The time seen by the reconciler, advanced by the test.
+    """
+    ret = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(
+        reconcile,
+        "time",
+        types.SimpleNamespace(monotonic=lambda: ret.now, time=lambda: ret.now),
+    )
+    return ret
+
+
+@pytest.fixture
+def database(tmp_path) -> db.IDatabase:
+    ret = db.JsonDatabase(str(tmp_path / "db.json"))
+    ret.connect()
+    yield ret
+    ret.close()
+
+
+@pytest.fixture(autouse=True)
+def config(monkeypatch):
+    monkeypatch.setattr(qbittorrent, "QBITTORRENT_CATEGORY", CATEGORY)
+    monkeypatch.setattr(reconcile, "RECONCILE_ORPHANS", "delete")
+    monkeypatch.setattr(reconcile, "RECONCILE_DANGLING", "report")
+    monkeypatch.setattr(reconcile, "RECONCILE_GRACE_S", 24 * 3600)
+    monkeypatch.setattr(reconcile, "RECONCILE_MAX_REPAIRS", 20)
+
+
+async def requested_with_orphans(fake_qbittorrent, database, orphans: int = 3):
+    await database.make_request(BOB, db.Torrent("requested"))
+    fake_qbittorrent.add("requested", category=CATEGORY)
+    for i in range(orphans):
+        fake_qbittorrent.add(f"orphan-{i:02}", category=CATEGORY)
+    # not ours
+    fake_qbittorrent.add("other", category="tv")
+
+
+async def check_twice(reconciler, clock) -> reconcile.ReconcileReport:
+    """
+    Check, then again once the mismatches outlived the grace period.
+    """
+    await reconciler.check()
+    assert reconciler.report.deleted == [] and reconciler.report.removed == []
+    clock.now += reconcile.RECONCILE_GRACE_S
+    await reconciler.check()
+    return reconciler.report
+
+
+async def test_orphans_are_deleted_after_the_grace_period(fake_qbittorrent, database, clock):
+    await requested_with_orphans(fake_qbittorrent, database)
+    reconciler = reconcile.Reconciler(database)
+    await reconciler.check()
+    assert reconciler.report.orphans == ["orphan-00", "orphan-01", "orphan-02"]
+
+    clock.now += reconcile.RECONCILE_GRACE_S - 1
+    await reconciler.check()
+    assert reconciler.report.deleted == []
+
+    clock.now += 1
+    await reconciler.check()
+    assert reconciler.report.deleted == ["orphan-00", "orphan-01", "orphan-02"]
+    assert sorted(fake_qbittorrent.torrents) == ["other", "requested"]
+    assert fake_qbittorrent.actions[-1][2] == {"deleteFiles": True}
+
+
+async def test_orphan_deletion_is_opt_in(fake_qbittorrent, database, clock, monkeypatch):
+    monkeypatch.setattr(reconcile, "RECONCILE_ORPHANS", "report")
+    await requested_with_orphans(fake_qbittorrent, database)
+    report = await check_twice(reconcile.Reconciler(database), clock)
+    assert len(report.orphans) == 3
+    assert report.deleted == []
+    assert fake_qbittorrent.actions == []
+
+
+async def test_orphans_are_not_deleted_without_a_category(
+    fake_qbittorrent, database, clock, monkeypatch
+):
+    monkeypatch.setattr(qbittorrent, "QBITTORRENT_CATEGORY", "")
+    await requested_with_orphans(fake_qbittorrent, database)
+    report = await check_twice(reconcile.Reconciler(database), clock)
+    # every torrent is an orphan without a category
+    assert len(report.orphans) == 4
+    assert report.deleted == []
+
+
+async def test_orphans_are_not_deleted_without_requests(fake_qbittorrent, database, clock):
+    await requested_with_orphans(fake_qbittorrent, database)
+    # also deletes its torrent
+    await database.cancel_request(BOB, db.Torrent("requested"))
+    report = await check_twice(reconcile.Reconciler(database), clock)
+    assert len(report.orphans) == 3
+    assert report.deleted == []
+
+
+async def test_orphans_are_kept_once_asked(fake_qbittorrent, database, clock):
+    """
+    As after MOVIE_REQUEST_SERVER_CLEAR_DB_ON_STARTUP, see main.py.
+    """
+    await requested_with_orphans(fake_qbittorrent, database)
+    reconciler = reconcile.Reconciler(database)
+    reconciler.keep_orphans("the database was cleared on startup")
+    report = await check_twice(reconciler, clock)
+    assert len(report.orphans) == 3
+    assert report.deleted == []
+
+
+async def test_repairs_are_capped_per_run(fake_qbittorrent, database, clock, monkeypatch):
+    monkeypatch.setattr(reconcile, "RECONCILE_MAX_REPAIRS", 2)
+    await requested_with_orphans(fake_qbittorrent, database)
+    reconciler = reconcile.Reconciler(database)
+    report = await check_twice(reconciler, clock)
+    assert report.deleted == ["orphan-00", "orphan-01"]
+    await reconciler.check()
+    assert reconciler.report.deleted == ["orphan-02"]
+
+
+async def test_dangling_requests_are_removed_after_the_grace_period(
+    fake_qbittorrent, database, clock, monkeypatch
+):
+    monkeypatch.setattr(reconcile, "RECONCILE_DANGLING", "remove")
+    await requested_with_orphans(fake_qbittorrent, database, orphans=0)
+    await database.make_request(BOB, db.Torrent("gone"))
+    report = await check_twice(reconcile.Reconciler(database), clock)
+    assert report.dangling == ["gone"]
+    assert report.removed == ["gone"]
+    assert [r.torrent.infohash for r in await database.get_all_requests()] == ["requested"]
@@ -0,0 +1,107 @@
+import pytest
+
+import app.qbittorrent as qbittorrent
+import app.seeding as seeding
+from app.seeding import SeedingPolicy
+
+DEFAULT = SeedingPolicy(ratio=2, seeding_time_min=-1, min_upload_bytes=0)
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("", {}),
+        ("{}", {}),
+        (
+            '{"movies": {"ratio": 1.5, "min_upload_kbps": 10}, "tv": {"seeding_time_min": 60}}',
+            {
+                "movies": SeedingPolicy(ratio=1.5, seeding_time_min=-1, min_upload_bytes=10240),
+                "tv": SeedingPolicy(ratio=2, seeding_time_min=60, min_upload_bytes=0),
+            },
+        ),
+        # the malformed entries are ignored, not the others
+        (
+            '{"movies": {"ratio": "a lot"}, "tv": [], "anime": null, "music": {"ratio": 1}}',
+            {"music": SeedingPolicy(ratio=1, seeding_time_min=-1, min_upload_bytes=0)},
+        ),
+        ('{"movies": {"ratio": 1}', {}),
+        ('[{"ratio": 1}]', {}),
+    ],
+)
+def test_parse_policies(value, expected):
+    assert seeding.parse_policies(value, DEFAULT) == expected
+
+
+@pytest.mark.parametrize(
+    "policy, ratio, seeding_time_s, expected",
+    [
+        (SeedingPolicy(ratio=2), 1.9, 10**6, False),
+        (SeedingPolicy(ratio=2), 2, 0, True),
+        (SeedingPolicy(seeding_time_min=60), 10, 3599, False),
+        (SeedingPolicy(seeding_time_min=60), 0, 3600, True),
+        # either target
+        (SeedingPolicy(ratio=2, seeding_time_min=60), 0, 3600, True),
+        (SeedingPolicy(ratio=0), 0, 0, True),
+        # no target
+        (SeedingPolicy(), 100, 10**6, False),
+    ],
+)
+def test_is_done(policy, ratio, seeding_time_s, expected):
+    assert policy.is_done({"ratio": ratio, "seeding_time": seeding_time_s}) is expected
+
+
+@pytest.fixture
+def seeding_policy(monkeypatch, fake_qbittorrent):
+    """
+    Stop at ratio 1, with qbittorrent's share limit action set by the test.
+    """
+    policy = SeedingPolicy(ratio=1)
+    monkeypatch.setattr(seeding, "SEEDING_ENABLED", True)
+    monkeypatch.setattr(seeding, "SEEDING_DEFAULT_POLICY", policy)
+    monkeypatch.setattr(seeding, "SEEDING_POLICIES", {})
+    monkeypatch.setattr(qbittorrent, "QBITTORRENT_CATEGORY", "")
+    preferences = {}
+
+    async def get_preferences():
+        return preferences
+
+    monkeypatch.setattr(qbittorrent, "get_preferences", get_preferences)
+    fake_qbittorrent.add(
+        "done", state=qbittorrent.TorrentState.UPLOADING, ratio=1.2, ratio_limit=-2
+    )
+    fake_qbittorrent.add(
+        "seeding", state=qbittorrent.TorrentState.STALLED_UP, ratio=0.5, ratio_limit=-2
+    )
+    # left alone
+    fake_qbittorrent.add("forced", state=qbittorrent.TorrentState.FORCED_UP, ratio=5)
+    return preferences
+
+
+def _actions(fake_qbittorrent) -> dict[str, list[str]]:
+    return {endpoint: hashes for endpoint, hashes, _ in fake_qbittorrent.actions}
+
+
+@pytest.mark.parametrize("action", [None, seeding.QBITTORRENT_SHARE_LIMIT_ACTION_STOP])
+async def test_share_limits_are_set_when_qbittorrent_stops_the_torrents(
+    fake_qbittorrent, seeding_policy, action
+):
+    if action is not None:
+        seeding_policy["max_ratio_act"] = action
+    await seeding.SeedingManager().check()
+    actions = _actions(fake_qbittorrent)
+    assert actions["setShareLimits"] == ["done", "seeding"]
+    assert actions["pause"] == ["done"]
+
+
+async def test_share_limits_are_not_set_when_qbittorrent_removes_the_torrents(
+    fake_qbittorrent, seeding_policy
+):
+    # remove the torrent, its files would be gone for Jellyfin
+    seeding_policy["max_ratio_act"] = 1
+    manager = seeding.SeedingManager()
+    await manager.check()
+    await manager.check()
+    actions = _actions(fake_qbittorrent)
+    assert "setShareLimits" not in actions
+    # the periodic check still stops them
+    assert actions["pause"] == ["done"]
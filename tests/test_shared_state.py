@@ -0,0 +1,140 @@
+import time
+import multiprocessing
+
+import pytest
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter
+
+import app.shared_state as shared_state
+
+TTL_S = 0.2
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def state(request, tmp_path) -> shared_state.ISharedState:
+    if request.param == "memory":
+        return shared_state.create_shared_state("memory://")
+    return shared_state.create_shared_state(f"sqlite:///{tmp_path}/state.db")
+
+
+def test_incr(state):
+    assert state.incr("count") == 1
+    assert state.incr("count", 2) == 3
+    assert state.get("count") == "3"
+    assert state.get("missing") is None
+    assert state.get_expiry("count") is None
+
+
+def test_incr_ttl(state):
+    state.incr("count", ttl_s=TTL_S)
+    expiry = state.get_expiry("count")
+    assert expiry == pytest.approx(time.time() + TTL_S, abs=0.1)
+    # set on creation only
+    state.incr("count", ttl_s=60)
+    assert state.get_expiry("count") == expiry
+    time.sleep(TTL_S)
+    assert state.get("count") is None
+    assert state.incr("count", ttl_s=TTL_S) == 1
+
+
+def test_incr_refresh_ttl(state):
+    state.incr("count", ttl_s=TTL_S)
+    state.incr("count", ttl_s=60, refresh_ttl=True)
+    assert state.get_expiry("count") == pytest.approx(time.time() + 60, abs=1)
+
+
+def test_set_if_absent(state):
+    assert state.set_if_absent("lock", "a", ttl_s=TTL_S)
+    assert not state.set_if_absent("lock", "b")
+    assert state.get("lock") == "a"
+    time.sleep(TTL_S)
+    assert state.set_if_absent("lock", "b")
+    assert state.delete("lock")
+    assert not state.delete("lock")
+
+
+def test_scan_and_purge(state):
+    state.incr("job:1")
+    state.incr("job:2", ttl_s=TTL_S)
+    # not a LIKE wildcard
+    state.incr("jobx3")
+    state.incr("other")
+    assert state.scan("job:") == {"job:1": "1", "job:2": "1"}
+    time.sleep(TTL_S)
+    assert state.purge_expired() == 1
+    assert state.scan("job:") == {"job:1": "1"}
+    assert state.clear() == 3
+    assert state.scan("") == {}
+
+
+def test_unsupported_uri():
+    with pytest.raises(ValueError):
+        shared_state.create_shared_state("redis://localhost")
+
+
+def _incr_many(db_path: str, count: int):
+    state = shared_state.SqliteSharedState(db_path)
+    for _ in range(count):
+        state.incr("count")
+
+
+def test_sqlite_incr_is_atomic_across_processes(tmp_path):
+    db_path = str(tmp_path / "state.db")
+    state = shared_state.SqliteSharedState(db_path)
+    processes = [
+        multiprocessing.Process(target=_incr_many, args=(db_path, 50)) for _ in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    assert state.get("count") == "200"
+
+
+@pytest.fixture
+def limiter_storage(tmp_path) -> shared_state.SqliteLimiterStorage:
+    # registered for sqlite:// uris, like flask_limiter creates it from RATELIMIT_STORAGE_URI
+    ret = storage_from_string(f"sqlite:///{tmp_path}/limits.db")
+    assert isinstance(ret, shared_state.SqliteLimiterStorage)
+    return ret
+
+
+def test_limiter_storage(limiter_storage):
+    assert limiter_storage.check()
+    assert limiter_storage.incr("key", 60) == 1
+    assert limiter_storage.incr("key", 60, amount=2) == 3
+    assert limiter_storage.get("key") == 3
+    assert limiter_storage.get("missing") == 0
+    assert limiter_storage.get_expiry("key") == pytest.approx(time.time() + 60, abs=1)
+    limiter_storage.clear("key")
+    assert limiter_storage.get("key") == 0
+    limiter_storage.incr("key", 60)
+    assert limiter_storage.reset() == 1
+
+
+def test_fixed_window_rate_limiter(limiter_storage):
+    limiter = FixedWindowRateLimiter(limiter_storage)
+    limit = parse("2/minute")
+    assert limiter.hit(limit, "bob")
+    assert limiter.hit(limit, "bob")
+    assert not limiter.hit(limit, "bob")
+    assert not limiter.test(limit, "bob")
+    assert limiter.hit(limit, "alice")
+
+    reset, remaining = limiter.get_window_stats(limit, "bob")
+    assert remaining == 0
+    assert reset == pytest.approx(time.time() + 60, abs=1)
+
+    limiter.clear(limit, "bob")
+    assert limiter.test(limit, "bob")
+
+
+def test_fixed_window_expires(limiter_storage):
+    limiter = FixedWindowRateLimiter(limiter_storage)
+    limit = parse("1/second")
+    assert limiter.hit(limit, "bob")
+    assert not limiter.hit(limit, "bob")
+    time.sleep(1)
+    assert limiter.hit(limit, "bob")
@@ -0,0 +1,92 @@
+import itertools
+
+import pytest
+
+import app.storage as storage
+
+GB = 1024**3
+
+DISK_A = storage.MountPoint("/a", "/srv/a")
+DISK_B = storage.MountPoint("/b", "/srv/b", weight=0, max_active_downloads=1)
+DISK_C = storage.MountPoint("/c", "/srv/c", max_active_downloads=2)
+
+
+def candidate(mount_point, free_gb, active_downloads=0):
+    return storage.PlacementCandidate(mount_point, free_gb * GB, active_downloads)
+
+
+@pytest.mark.parametrize(
+    "strategy, candidates, expected",
+    [
+        ("most_free", [candidate(DISK_A, 10), candidate(DISK_C, 20)], DISK_C),
+        ("least_active", [candidate(DISK_A, 10, 1), candidate(DISK_C, 20, 2)], DISK_A),
+        # ties are broken by free space
+        ("least_active", [candidate(DISK_A, 10, 1), candidate(DISK_C, 20, 1)], DISK_C),
+        # a mount weighing 0 is never picked while another one has room
+        ("free_space_weighted", [candidate(DISK_A, 1), candidate(DISK_B, 100)], DISK_A),
+        # no weight at all falls back to most_free
+        ("free_space_weighted", [candidate(DISK_B, 100)], DISK_B),
+    ],
+)
+def test_strategy(strategy, candidates, expected):
+    for _ in range(20):
+        assert storage.PLACEMENT_STRATEGIES[strategy](candidates).mount_point == expected
+
+
+def test_round_robin_cycles_through_the_candidates(monkeypatch):
+    monkeypatch.setattr(storage, "g_round_robin_counter", itertools.count())
+    candidates = [candidate(DISK_A, 10), candidate(DISK_C, 20)]
+    picks = [storage.PLACEMENT_STRATEGIES["round_robin"](candidates) for _ in range(3)]
+    assert [c.mount_point for c in picks] == [DISK_A, DISK_C, DISK_A]
+
+
+@pytest.fixture
+def disks(monkeypatch):
+    """
+    DISK_A and DISK_C, with free space in GB set by the test.
+    """
+    free_gb = {DISK_A: 0, DISK_C: 0}
+    monkeypatch.setattr(storage, "MOUNT_POINTS", list(free_gb))
+    monkeypatch.setattr(storage, "QBITTORRENT_DOWNLOAD_SUBFOLDER", "")
+    monkeypatch.setattr(
+        storage, "_free_bytes", lambda: {m: free * GB for m, free in free_gb.items()}
+    )
+    return free_gb
+
+
+@pytest.mark.parametrize(
+    "free_gb, active_downloads, sizes_gb, expected",
+    [
+        # the space taken by the previous picks is accounted for
+        ((30, 20), {}, [15, 15, 15], ["/a", "/c", "/a"]),
+        # full disks are skipped, files fitting nowhere get None
+        ((5, 20), {}, [10, 10, 10], ["/c", "/c", None]),
+        ((0, 0), {}, [1], [None]),
+        # DISK_C holds at most 2 active downloads, the slots taken are accounted for
+        ((10, 100), {DISK_C: 1}, [1, 1, 1], ["/c", "/a", "/a"]),
+        # caps are ignored once every disk reached its own
+        ((0, 100), {DISK_C: 2}, [1], ["/c"]),
+    ],
+)
+def test_plan_placements(disks, free_gb, active_downloads, sizes_gb, expected):
+    disks.update(zip(disks, free_gb))
+    sizes = [size * GB for size in sizes_gb]
+    given = dict(active_downloads)
+    assert storage.plan_placements(sizes, active_downloads, "most_free") == expected
+    # the counts of the caller are left alone
+    assert active_downloads == given
+
+
+def test_plan_placements_spreads_by_weight(disks, monkeypatch):
+    """
+    free_space_weighted spreads by free space times weight: DISK_B weighs 0.
+    """
+    monkeypatch.setattr(storage, "MOUNT_POINTS", [DISK_A, DISK_B])
+    monkeypatch.setattr(storage, "_free_bytes", lambda: {DISK_A: 10 * GB, DISK_B: 100 * GB})
+    assert storage.plan_placements([GB] * 5, strategy="free_space_weighted") == ["/a"] * 5
+
+
+def test_plan_placements_with_a_subfolder(disks, monkeypatch):
+    monkeypatch.setattr(storage, "QBITTORRENT_DOWNLOAD_SUBFOLDER", "movies")
+    disks[DISK_A] = 10
+    assert storage.plan_placements([GB], strategy="most_free") == ["/a/movies"]
@@ -0,0 +1,123 @@
+import shutil
+from collections import namedtuple
+
+import pytest
+
+import app.qbittorrent as qbittorrent
+import app.storage as storage
+import app.watchdog as watchdog
+from app.watchdog import PressureLevel
+
+MB = 1024**2
+GB = 1024**3
+
+DISK = storage.MountPoint("/downloads", "/srv/downloads")
+DiskUsage = namedtuple("DiskUsage", "total used free")
+
+
+@pytest.fixture
+def disk(monkeypatch) -> dict:
+    """
+    The only mount, with its free bytes set by the test.
+    """
+    ret = {"free": 0}
+    monkeypatch.setattr(storage, "MOUNT_POINTS", [DISK])
+    monkeypatch.setattr(shutil, "disk_usage", lambda path: DiskUsage(0, 0, ret["free"]))
+    monkeypatch.setattr(watchdog, "WATCHDOG_RESERVE_BYTES", 0)
+    monkeypatch.setattr(watchdog, "WATCHDOG_HORIZON_S", 3600)
+    monkeypatch.setattr(watchdog, "WATCHDOG_RATE_LIMIT_BYTES", MB)
+    monkeypatch.setattr(watchdog, "WATCHDOG_RESUME_CHECKS", 3)
+    return ret
+
+
+def add(fake_qbittorrent, infohash, left_gb, speed_mb, priority=0, added_on=0):
+    fake_qbittorrent.add(
+        infohash,
+        save_path=DISK.qbittorrent_path,
+        amount_left=left_gb * GB,
+        dlspeed=speed_mb * MB,
+        priority=priority,
+        added_on=added_on,
+    )
+
+
+@pytest.mark.parametrize(
+    "free_gb, reserve_gb, expected",
+    [
+        # everything fits
+        (100, 0, PressureLevel.OK),
+        # 20 GB left do not fit, but 10 GB at 2 MB/s last longer than the horizon
+        (10, 0, PressureLevel.WARNING),
+        # full within the horizon
+        (5, 0, PressureLevel.CRITICAL),
+        # no room left above the reserve
+        (10, 10, PressureLevel.CRITICAL),
+    ],
+)
+async def test_pressure_level(fake_qbittorrent, disk, monkeypatch, free_gb, reserve_gb, expected):
+    monkeypatch.setattr(watchdog, "WATCHDOG_RESERVE_BYTES", reserve_gb * GB)
+    disk["free"] = free_gb * GB
+    add(fake_qbittorrent, "a", 10, 1)
+    add(fake_qbittorrent, "b", 10, 1)
+    disk_watchdog = watchdog.DiskWatchdog()
+    await disk_watchdog.check()
+    [status] = disk_watchdog.get_status()
+    assert status.level == expected
+    assert status.remaining_bytes == 20 * GB
+
+
+async def test_victims_are_the_lowest_priority_then_the_newest(fake_qbittorrent, disk):
+    disk["free"] = 25 * GB
+    add(fake_qbittorrent, "first", 10, 0.1, priority=1, added_on=1)
+    add(fake_qbittorrent, "newer", 10, 0.1, priority=2, added_on=3)
+    add(fake_qbittorrent, "older", 10, 0.1, priority=2, added_on=2)
+    add(fake_qbittorrent, "last", 10, 0.1, priority=3, added_on=0)
+    disk_watchdog = watchdog.DiskWatchdog()
+    await disk_watchdog.check()
+    [status] = disk_watchdog.get_status()
+    assert status.level == PressureLevel.WARNING
+    # until the 20 GB left of the others fit
+    assert status.throttled == ["last", "newer"]
+    assert disk_watchdog.limited == {"last", "newer"}
+    assert fake_qbittorrent.torrents["last"]["dl_limit"] == MB
+    assert fake_qbittorrent.torrents["older"]["dl_limit"] == 0
+
+
+async def test_paused_torrents_resume_after_calm_checks(fake_qbittorrent, disk):
+    disk["free"] = 12 * GB
+    add(fake_qbittorrent, "a", 10, 5, priority=1)
+    add(fake_qbittorrent, "b", 10, 5, priority=2)
+    disk_watchdog = watchdog.DiskWatchdog()
+    # the fair limit of b, restored once the watchdog releases it
+    disk_watchdog.set_base_limit(lambda infohash: MB // 2 if infohash == "b" else 0)
+
+    async def check(expected: PressureLevel) -> str:
+        await disk_watchdog.check()
+        [status] = disk_watchdog.get_status()
+        assert status.level == expected
+        return fake_qbittorrent.torrents["b"]["state"]
+
+    assert await check(PressureLevel.CRITICAL) == qbittorrent.TorrentState.PAUSED_DL
+    assert fake_qbittorrent.torrents["a"]["state"] == qbittorrent.TorrentState.DOWNLOADING
+
+    # slower, b would only be rate-limited, but stays paused for a few checks
+    for infohash in ("a", "b"):
+        fake_qbittorrent.torrents[infohash]["dlspeed"] = MB
+    for _ in range(watchdog.WATCHDOG_RESUME_CHECKS - 1):
+        assert await check(PressureLevel.WARNING) == qbittorrent.TorrentState.PAUSED_DL
+    assert await check(PressureLevel.WARNING) == qbittorrent.TorrentState.DOWNLOADING
+    assert disk_watchdog.limited == {"b"}
+    # not above its fair limit
+    assert fake_qbittorrent.torrents["b"]["dl_limit"] == MB // 2
+
+    # critical again resets the count
+    disk["free"] = 5 * GB
+    assert await check(PressureLevel.CRITICAL) == qbittorrent.TorrentState.PAUSED_DL
+    disk["free"] = 12 * GB
+    assert await check(PressureLevel.WARNING) == qbittorrent.TorrentState.PAUSED_DL
+
+    # everything fits: resumed and unlimited right away
+    disk["free"] = 100 * GB
+    assert await check(PressureLevel.OK) == qbittorrent.TorrentState.DOWNLOADING
+    assert disk_watchdog.limited == set()
+    assert fake_qbittorrent.torrents["b"]["dl_limit"] == MB // 2
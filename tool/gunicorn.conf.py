@@ -1,3 +1,4 @@
+import gc
 import os
 import multiprocessing
 from dotenv import load_dotenv
@@ -8,13 +9,46 @@ port = os.getenv("MOVIE_REQUEST_SERVER_PORT", "8000")
 bind = f"0.0.0.0:{port}"
 
 # Worker settings
+# a single worker, enforced by on_starting: the database (db.json) is held in memory by
+# the worker, and so are the periodic jobs acting on qbittorrent (watchdog, rebalancer,
+# fair share, seeding, reconciliation, download queue, eviction) and their state.
+# several workers would overwrite each other's requests and each run every job.
+# scale with MOVIE_REQUEST_SERVER_THREADS instead
 workers = 1
-worker_class = "sync"
-threads = 2
+worker_class = "gthread"
+# each open event stream (/events/...) holds a thread, see MOVIE_REQUEST_SERVER_EVENT_STREAM_MAX
+threads = int(os.getenv("MOVIE_REQUEST_SERVER_THREADS", 16))
 timeout = 30
 keepalive = 5
 
+# the app is built once by the master and forked into the workers, which share its
+# read-only state and spawn faster, see app.main.create_app
+preload_app = os.getenv("MOVIE_REQUEST_SERVER_PRELOAD", "true").lower() == "true"
+
 # Logging
 accesslog = "-"
 errorlog = "-"
 loglevel = "info"
+
+
+def on_starting(server):
+    # e.g. `gunicorn -w 4` overrides the setting above
+    if server.num_workers != 1:
+        server.log.warning(
+            f"Ignoring workers={server.num_workers}, the server runs a single worker, "
+            "see tool/gunicorn.conf.py"
+        )
+        server.num_workers = 1
+
+
+def when_ready(server):
+    if preload_app:
+        # the garbage collector never visits the objects of the preloaded app,
+        # so that their memory pages stay shared with the workers
+        gc.freeze()
+
+
+def post_worker_init(worker):
+    from app.main import init_worker
+
+    init_worker(worker.wsgi)